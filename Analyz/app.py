@@ -1,17 +1,47 @@
 import os
 import warnings
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone
 from typing import Dict, List, Optional, Tuple, Any
 import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as _FuturesTimeout, wait as _wait_futures
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import time
-
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import functools
+import itertools
+import queue
+import hashlib
+import re
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
 from flask_cors import CORS
 import pandas as pd
+import numpy as np
 import json
+import gzip
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 from modules.barcode_generator import barcode_bp
+from db import ensure_facts_schema, replace_day_facts, query_facts, reset_connection_pool
+
+try:
+    import brotli  # необязательная зависимость: сжатие br, если клиент его принимает
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl  # блокировки сборки дня между процессами (POSIX); без него — только внутри процесса
+except ImportError:
+    fcntl = None
+
+# Процесс пула сборки дня (spawn) заново импортирует этот модуль: стартовые действия
+# (сообщения о настройках, схема БД, уборка флагов) выполняет только основной процесс.
+# Переменную окружения выставляет родитель перед созданием пула (см. _submit_day_process)
+_DAY_PROCESS_ENV = "ANALYZ_DAY_PROCESS"
+_SPAWNED_CHILD = os.environ.get(_DAY_PROCESS_ENV) == "1"
 
 # Telegram Bot API
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "8467241470:AAHgY7NHZM9MDLu7we1xqqISOIxAH6jINGU")
@@ -20,12 +50,13 @@ _telegram_chat_ids_str = os.environ.get("TELEGRAM_CHAT_ID", "544569923,613051042
 TELEGRAM_CHAT_ID = [chat_id.strip() for chat_id in _telegram_chat_ids_str.split(",") if chat_id.strip()]
 
 # Логируем настройки Telegram при старте (без токена для безопасности)
-if TELEGRAM_BOT_TOKEN and TELEGRAM_BOT_TOKEN.strip():
-    print(f"INFO: Telegram Bot настроен. Количество получателей: {len(TELEGRAM_CHAT_ID)}")
-    if not TELEGRAM_CHAT_ID:
-        print("WARNING: TELEGRAM_CHAT_ID не установлен. Отправка в Telegram будет отключена.")
-else:
-    print("WARNING: TELEGRAM_BOT_TOKEN не установлен. Отправка в Telegram будет отключена.")
+if not _SPAWNED_CHILD:
+    if TELEGRAM_BOT_TOKEN and TELEGRAM_BOT_TOKEN.strip():
+        print(f"INFO: Telegram Bot настроен. Количество получателей: {len(TELEGRAM_CHAT_ID)}")
+        if not TELEGRAM_CHAT_ID:
+            print("WARNING: TELEGRAM_CHAT_ID не установлен. Отправка в Telegram будет отключена.")
+    else:
+        print("WARNING: TELEGRAM_BOT_TOKEN не установлен. Отправка в Telegram будет отключена.")
 
 # Подавляем предупреждения pandas о создании атрибутов через setattr
 warnings.filterwarnings('ignore', category=UserWarning, message='.*Pandas doesn\'t allow columns to be created via a new attribute name.*')
@@ -55,6 +86,60 @@ MAX_FILE_SIZE_MB = int(os.environ.get("MAX_FILE_SIZE_MB", "30"))  # Максим
 MAX_ROWS = int(os.environ.get("MAX_ROWS", "85000"))  # Максимальное количество строк: 85,000
 MAX_COLS = int(os.environ.get("MAX_COLS", "75"))  # Максимальное количество столбцов: 75
 
+# Пороги перерывов (в минутах). Колонки b15/b30/b45 отчёта всегда считаются по 15/30/45 минутам,
+# произвольные пороги считаются по сохранённым интервалам через /what_if/<date>.
+BREAK_MIN_MINUTES = float(os.environ.get("BREAK_MIN_MINUTES", "10"))  # Перерыв — интервал длиннее 10 минут
+ACTIVE_GAP_CAP_MINUTES = float(os.environ.get("ACTIVE_GAP_CAP_MINUTES", "15"))  # Потолок интервала для активного времени
+BREAK_BUCKETS_MINUTES: Tuple[int, ...] = tuple(sorted(
+    int(b) for b in os.environ.get("BREAK_BUCKETS_MINUTES", "15,30,45").split(",") if b.strip()
+))  # Корзины перерывов для UI и /what_if, через запятую
+
+# Кэш FastStat хранится по колонкам; gzip уменьшает его ещё в несколько раз
+FASTSTAT_CACHE_GZIP = os.environ.get("FASTSTAT_CACHE_GZIP", "1").strip().lower() not in {"0", "false", "no"}
+
+# Объём памяти под кэш результатов анализа дней (LRU)
+ANALYSIS_CACHE_MAX_MB = float(os.environ.get("ANALYSIS_CACHE_MAX_MB", "64"))
+
+# Фоновые задачи: число потоков общей очереди и приоритеты (меньше — раньше)
+BACKGROUND_WORKERS = int(os.environ.get(
+    "BACKGROUND_WORKERS", os.environ.get("DAY_SUMMARIES_WORKERS", str(min(4, os.cpu_count() or 1)))
+))
+TASK_PRIORITY_FASTSTAT = 0
+TASK_PRIORITY_SUMMARY = 1
+TASK_PRIORITY_SCREENSHOTS = 2
+TASK_PRIORITY_CATALOG = 3  # досчёт каталога дней (строки и готовность артефактов)
+
+# /day_summaries: сколько ждать, прежде чем отдать ещё не готовые дни как "pending"
+DAY_SUMMARIES_WAIT_SECONDS = float(os.environ.get("DAY_SUMMARIES_WAIT_SECONDS", "2"))
+DAY_SUMMARIES_MAX_DAYS = int(os.environ.get("DAY_SUMMARIES_MAX_DAYS", "366"))
+
+# Фоновый прогрев кэшей: последние CACHE_WARM_DAYS дней (сегодня — первым) при старте
+# и каждые CACHE_WARM_INTERVAL_SECONDS (0 — только при старте). Прогрев ждёт, пока
+# загрузка CPU на ядро выше CACHE_WARM_MAX_LOAD или свободной памяти меньше
+# CACHE_WARM_MIN_FREE_MB (0 — без ограничения), но не дольше CACHE_WARM_MAX_THROTTLE_SECONDS
+# за проход: дальше проход прерывается до следующего цикла и отпускает _cache_warmer.lock
+CACHE_WARM_ENABLED = os.environ.get("CACHE_WARM_ENABLED", "1").strip().lower() not in {"0", "false", "no"}
+CACHE_WARM_DAYS = int(os.environ.get("CACHE_WARM_DAYS", "7"))
+CACHE_WARM_INTERVAL_SECONDS = float(os.environ.get("CACHE_WARM_INTERVAL_SECONDS", "600"))
+CACHE_WARM_MAX_LOAD = float(os.environ.get("CACHE_WARM_MAX_LOAD", "0.75"))
+CACHE_WARM_MIN_FREE_MB = float(os.environ.get("CACHE_WARM_MIN_FREE_MB", "512"))
+CACHE_WARM_PAUSE_SECONDS = float(os.environ.get("CACHE_WARM_PAUSE_SECONDS", "1"))
+CACHE_WARM_MAX_THROTTLE_SECONDS = float(os.environ.get("CACHE_WARM_MAX_THROTTLE_SECONDS", "300"))
+
+# Артефакт дня строит один поток на (дату, стадию), в том числе между процессами
+# (lock-файлы в папке дня). Страницы ждут чужую сборку не дольше DAY_BUILD_WAIT_SECONDS,
+# затем отвечают 202 с токеном для /day_build/<token>
+DAY_BUILD_WAIT_SECONDS = float(os.environ.get("DAY_BUILD_WAIT_SECONDS", "15"))
+
+# Сборка артефактов дня (анализ, faststat, простои — разбор CSV и pandas) идёт в пуле
+# из DAY_PROCESS_WORKERS процессов, чтобы не занимать GIL веб-процесса; 0 — в самом процессе
+DAY_PROCESS_WORKERS = int(os.environ.get("DAY_PROCESS_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+# Сжатие ответов (gzip/br) для JSON и HTML крупнее порога
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/css", "text/plain", "application/javascript", "text/javascript"}
+
 # Honor reverse-proxy headers (X-Forwarded-*) so url_for keeps mounted prefix
 # x_prefix=1 позволяет использовать X-Forwarded-Prefix для определения базового пути
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
@@ -62,6 +147,13 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 # Регистрируем Blueprint для генератора штрих-кодов
 app.register_blueprint(barcode_bp)
 
+# Таблица фактов по сотрудникам/дням (для трендов и рейтингов без чтения ANL.csv)
+if not _SPAWNED_CHILD:
+    try:
+        ensure_facts_schema()
+    except Exception as e:
+        print(f"WARNING: Не удалось инициализировать таблицу фактов approver_day_facts: {e}")
+
 # Пути для хранения файла сотрудников (утверждающий -> компания)
 # В Docker используем /app/analyz-data, локально - относительный путь
 _default_employees_path = os.path.join(os.path.dirname(__file__), "employees.csv")
@@ -73,12 +165,20 @@ if not os.path.isabs(EMPLOYEES_FILE_PATH):
     EMPLOYEES_FILE_PATH = os.path.abspath(EMPLOYEES_FILE_PATH)
 if not os.path.isabs(EMPLOYEES_XLSX_PATH):
     EMPLOYEES_XLSX_PATH = os.path.abspath(EMPLOYEES_XLSX_PATH)
+# Нормализованный индекс справочника (SQLite), строится при загрузке файла сотрудников
+EMPLOYEES_INDEX_PATH = os.environ.get(
+    "EMPLOYEES_INDEX_PATH", os.path.join(os.path.dirname(EMPLOYEES_FILE_PATH), "employees_index.sqlite3")
+)
 
-# Кэш маппинга сотрудников по mtime
+# Справочник сотрудников в памяти процесса; перечитывается при смене файла (mtime/размер)
 _EMPLOYEES_CACHE: Dict[str, object] = {
-    "mtime": None,   # тип: Optional[float]
-    "mapping": None, # тип: Optional[pd.DataFrame]
+    "version": None,   # тип: Optional[tuple] — (путь, mtime_ns, размер)
+    "mapping": None,   # тип: Optional[pd.DataFrame] — Утвердил, Компания[, Занятость]
+    "by_code": {},     # тип: Dict[str, Tuple[str, str]] — код -> (компания, занятость)
+    "company_map": {}, # тип: Dict[str, str] — код -> компания (только непустые)
+    "loaded": False,
 }
+_EMPLOYEES_LOCK = threading.Lock()
 
 # Путь к накопительному файлу исходных строк (инкрементальные загрузки)
 ACCUMULATED_FILE_PATH = os.path.join(os.path.dirname(__file__), "accumulated.csv")
@@ -110,18 +210,62 @@ def _day_analysis_cache_paths(date_str: str) -> Tuple[str, str, str]:
     hourly_path = os.path.join(base, "ANL_hourly.json")
     return csv_path, breaks_path, hourly_path
 
+def _day_gaps_cache_path(date_str: str) -> str:
+    """Кэш интервалов между событиями (отсортированные массивы секунд по сотруднику)."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "ANL_gaps.npz")
+
+def _day_analysis_meta_path(date_str: str) -> str:
+    """Метаданные анализа дня (последняя отметка времени и т.п.) для сводки без пересчёта."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "ANL_meta.json")
+
 def _day_breaks_sum_cache_path(date_str: str) -> str:
     """Небольшой кэш: сумма перерывов (в секундах) по сотруднику за день."""
     base = _day_dir(date_str)
     return os.path.join(base, "ANL_breaks_sum.json")
 
 def _day_faststat_cache_path(date_str: str) -> str:
-    """Кэш для faststat: детальные данные по задачам за день в JSON формате."""
+    """Кэш для faststat: задачи за день в колоночном JSON (со сжатием gzip — .json.gz)."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "FASTSTAT_DATA.json.gz" if FASTSTAT_CACHE_GZIP else "FASTSTAT_DATA.json")
+
+def _day_faststat_body_path(date_str: str) -> str:
+    """Готовый gzip-ответ /faststat_data (полный список задач), чтобы не сжимать его на каждый запрос."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "FASTSTAT_BODY.json.gz")
+
+def _day_faststat_cache_paths(date_str: str) -> Tuple[str, ...]:
+    """Все файлы кэша faststat (оба имени кэша и готовый ответ) — для инвалидации."""
+    base = _day_dir(date_str)
+    return (
+        os.path.join(base, "FASTSTAT_DATA.json"),
+        os.path.join(base, "FASTSTAT_DATA.json.gz"),
+        _day_faststat_body_path(date_str),
+    )
+
+def _day_idle_cache_path(date_str: str) -> str:
+    """Кэш простоев дня (без компаний — они подставляются при чтении)."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "IDLE.json")
+
+def _day_company_views_path(date_str: str) -> str:
+    """Срезы дня по компаниям (сводка, строки отчёта, статистика сотрудников) для запросов с company_name."""
     base = _day_dir(date_str)
-    return os.path.join(base, "FASTSTAT_DATA.json")
+    return os.path.join(base, "COMPANY_VIEWS.json")
+
+def _day_manifest_path(date_str: str) -> str:
+    """Манифест артефактов дня: для каждой стадии — отпечаток входов, по которым она построена."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "MANIFEST.json")
+
+def _day_build_lock_path(date_str: str, name: str) -> str:
+    """Lock-файл стадии дня (или манифеста): захвачен, пока её артефакт строится."""
+    base = _day_dir(date_str)
+    return os.path.join(base, f"{name.upper()}.lock")
 
 def _day_faststat_processing_flag(date_str: str) -> str:
-    """Флаг обработки faststat: указывает, что обработка в процессе."""
+    """Флаг обработки faststat прежних версий; остаётся от прерванных процессов и удаляется при старте."""
     base = _day_dir(date_str)
     return os.path.join(base, "FASTSTAT_PROCESSING.flag")
 
@@ -141,6 +285,12 @@ def _duration_to_seconds(v: object) -> int:
     except Exception:
         return 0
 
+def _break_seconds(brk: Dict[str, object]) -> int:
+    """Длительность перерыва в секундах: gap_seconds, для старых кэшей ANL_breaks.json — duration."""
+    if brk.get("gap_seconds") is not None:
+        return int(float(brk["gap_seconds"]))
+    return _duration_to_seconds(brk.get("duration"))
+
 def _format_hhmm_from_seconds(total_seconds: int) -> str:
     mins = max(0, int(round(total_seconds / 60)))
     hh = mins // 60
@@ -187,77 +337,71 @@ def _load_day_df(date_str: str) -> Optional[pd.DataFrame]:
         return None
 
 
+def _load_day_rows(date_str: str, row_ids: set) -> Optional[pd.DataFrame]:
+    """Строки CSV дня с указанными номерами (индекс как у _load_day_df).
+
+    None — файла нет или в нём нашлись не все строки (CSV стал короче, чем при
+    построении перерывов): номера тогда не сопоставить надёжно.
+    """
+    path = _day_path(date_str)
+    if not os.path.exists(path):
+        return None
+    wanted = {i for i in row_ids if 0 <= i < MAX_ROWS}
+    read_kwargs = dict(
+        dtype=str,
+        # Строка 0 — заголовок, строки данных нумеруются с 1
+        skiprows=lambda i: i != 0 and (i - 1) not in wanted,
+        na_values=['nan', 'NaN', 'NAN', 'None', 'none', 'NULL', 'null', ''],
+    )
+    try:
+        try:
+            df = pd.read_csv(path, **read_kwargs)
+        except Exception:
+            # Быстрый C-парсер не справился с файлом — читаем так же, как _load_day_df
+            df = pd.read_csv(path, engine="python", **read_kwargs)
+    except Exception:
+        return None
+    if len(df) != len(wanted):
+        return None
+    df.index = sorted(wanted)
+    return df
+
+
 def _build_day_summary(
     date_str: str,
     company_name: Optional[str] = None,
-    preloaded_df: Optional[pd.DataFrame] = None,
     write_cache: bool = True,
+    preloaded_result: Optional[pd.DataFrame] = None,
 ) -> Dict[str, object]:
-    """Собирает краткую сводку дня и при необходимости кэширует в IT.json."""
-    df = preloaded_df if preloaded_df is not None else _load_day_df(date_str)
-    if df is None or df.empty:
-        raise ValueError("no_data")
-
-    approver_col, task_col, weight_col, qty_col, time_col, start_time_col, end_time_col, event_time_col = _match_columns(df)
-
-    cols = [approver_col, task_col, weight_col]
-    if start_time_col:
-        cols.append(start_time_col)
-    if end_time_col:
-        cols.append(end_time_col)
-    if event_time_col:
-        cols.append(event_time_col)
-
-    work = df[cols].copy()
-    work.rename(columns={
-        approver_col: "approver",
-        task_col: "task",
-        weight_col: "weight",
-        **({start_time_col: "start_time"} if start_time_col else {}),
-        **({end_time_col: "end_time"} if end_time_col else {}),
-        **({event_time_col: "event_time"} if event_time_col else {}),
-    }, inplace=True)
-
-    work["weight"] = _to_weight_kg(work["weight"]).astype(float)
-    if "start_time" in work.columns:
-        work["start_dt"] = _parse_datetime(work["start_time"])
-    if "end_time" in work.columns:
-        work["end_dt"] = _parse_datetime(work["end_time"])
-    if "event_time" in work.columns:
-        work["event_dt"] = _parse_datetime(work["event_time"])
-
-    confirm_as_dt = _parse_datetime(df[time_col]) if time_col in df.columns else None
-    if confirm_as_dt is not None:
-        if "end_dt" in work.columns:
-            mask = work["end_dt"].isna() & confirm_as_dt.notna()
-            work.loc[mask, "end_dt"] = confirm_as_dt[mask]
-        else:
-            work["end_dt"] = confirm_as_dt
+    """Собирает краткую сводку дня и при необходимости кэширует в IT.json.
 
-    latest_dt = None
-    for col in ["event_dt", "end_dt", "start_dt"]:
-        if col in work.columns:
-            cand = work[col].dropna().max()
-            if pd.notna(cand):
-                latest_dt = cand if latest_dt is None or cand > latest_dt else latest_dt
-
-    aggr = analyze_dataframe(df)
-
-    emp_df = None
-    candidate_path = _get_employees_file_path()
-    if candidate_path:
-        try:
-            emp_df = _try_read_employees(candidate_path)
-        except Exception as e:
-            app.logger.warning(f"Не удалось прочитать файл сотрудников {candidate_path}: {e}")
-            emp_df = None
-    if emp_df is not None:
-        mapping = _extract_employees_mapping(emp_df)
-        if mapping is not None and not mapping.empty:
-            mapping["Утвердил"] = mapping["Утвердил"].astype(str).str.strip()
-            mapping = mapping.dropna(subset=["Утвердил"]).drop_duplicates(subset=["Утвердил"], keep="first")
-            aggr["Утвердил"] = aggr["Утвердил"].astype(str).str.strip()
-            aggr = aggr.merge(mapping, on="Утвердил", how="left")
+    Сводка строится из кэша анализа дня (ANL.csv + ANL_meta.json с последней отметкой
+    времени). Если кэша нет, анализ строится через конвейер материализации.
+    preloaded_result — свежий результат analyze_dataframe (из конвейера материализации).
+    """
+    cached = _read_day_analysis_cache(date_str) if preloaded_result is None else None
+    meta = _read_day_analysis_meta(date_str) if cached is not None else None
+    if preloaded_result is not None:
+        aggr = preloaded_result.copy()
+        # Результат, прочитанный из кэша, не несёт latest_dt — тогда берём ANL_meta.json
+        meta = _day_analysis_meta(preloaded_result)
+        if not hasattr(preloaded_result, "latest_dt"):
+            meta = _read_day_analysis_meta(date_str) or meta
+    elif cached is not None and meta is not None:
+        aggr = cached[0]
+    else:
+        loaded = _ensure_day_analysis(date_str)
+        if loaded is None:
+            raise ValueError("no_data")
+        aggr = loaded[0]
+        meta = _read_day_analysis_meta(date_str) or _day_analysis_meta(aggr)
+
+    companies: List[str] = []
+    mapping = _employees_mapping()
+    if mapping is not None:
+        aggr["Утвердил"] = aggr["Утвердил"].astype(str).str.strip()
+        aggr = aggr.merge(mapping, on="Утвердил", how="left")
+        companies = mapping["Компания"].dropna().astype(str).str.strip().tolist()
 
     if company_name and "Компания" in aggr.columns:
         aggr = aggr[aggr["Компания"].fillna("").astype(str).str.strip() == company_name.strip()]
@@ -265,21 +409,12 @@ def _build_day_summary(
     total_tasks = int(aggr["СЗ"].sum()) if "СЗ" in aggr.columns else 0
     total_weight = float(aggr["Вес"].sum()) if "Вес" in aggr.columns else 0.0
 
-    def sum_by_company(name: str) -> int:
-        if "Компания" not in aggr.columns:
-            return 0
-        return int(aggr.loc[aggr["Компания"].fillna("").astype(str).str.strip().str.lower() == name.strip().lower(), "СЗ"].sum() or 0)
-
-    tasks_shtat = sum_by_company("Штат")
-    tasks_moving = sum_by_company("Мувинг")
-    tasks_gradusy = sum_by_company("Градус")
-    tasks_two_wheels = sum_by_company("Два Колеса")
-    tasks_no_company = int(aggr.loc[(aggr["Компания"].isna()) | (aggr["Компания"].fillna("").astype(str).str.strip() == ""), "СЗ"].sum() or 0) if "Компания" in aggr.columns else 0
+    by_company = _sum_tasks_by_company(aggr, companies)
 
     latest_time = None
-    if latest_dt is not None and pd.notna(latest_dt):
+    if meta.get("latest_dt"):
         try:
-            latest_time = latest_dt.strftime("%H:%M")
+            latest_time = datetime.fromisoformat(str(meta["latest_dt"])).strftime("%H:%M")
         except Exception:
             latest_time = None
 
@@ -287,13 +422,7 @@ def _build_day_summary(
         "date": date_str,
         "total_tasks": total_tasks,
         "total_weight": round(total_weight, 2),
-        "by_company": {
-            "Штат": tasks_shtat,
-            "Мувинг": tasks_moving,
-            "Градус": tasks_gradusy,
-            "Два Колеса": tasks_two_wheels,
-            "без компании": tasks_no_company,
-        },
+        "by_company": by_company,
         "latest_finish": latest_time,
     }
 
@@ -306,6 +435,260 @@ def _build_day_summary(
 
     return result
 
+def _sum_tasks_by_company(aggr: pd.DataFrame, companies: List[str]) -> Dict[str, int]:
+    """Сумма СЗ по каждой компании из файла сотрудников + "без компании" за один groupby.
+
+    Компании сравниваются без учёта регистра и пробелов по краям; в ответе используется
+    написание из первой строки файла сотрудников.
+    """
+    display: Dict[str, str] = {}
+    for name in companies:
+        key = name.strip().lower()
+        if key and key not in display:
+            display[key] = name.strip()
+    sums: Dict[str, int] = {}
+    if "Компания" in aggr.columns and "СЗ" in aggr.columns:
+        keys = aggr["Компания"].fillna("").astype(str).str.strip().str.lower()
+        sums = {str(k): int(v) for k, v in aggr["СЗ"].groupby(keys).sum().items()}
+    result = {name: sums.get(key, 0) for key, name in display.items()}
+    result["без компании"] = sums.get("", 0)
+    return result
+
+# --------------------------------
+# Каталог дней
+# --------------------------------
+# Сведения о днях в памяти процесса и в data_days/_catalog.json, чтобы /days и
+# поиск последнего дня не обходили DATA_DIR на каждый запрос. Запись дня:
+# rows — строк данных, bytes — размер CSV, ingested_at — время последней загрузки,
+# version — "mtime_ns-размер" CSV, artifacts — готовность стадий DAY_STAGES.
+# Каталог обновляется при загрузке и очистке дня и после сборки артефактов;
+# дни, появившиеся или изменённые в обход приложения, подхватываются при смене
+# mtime DATA_DIR. Для них сразу пишется запись-заготовка по stat (rows и artifacts
+# равны None), а строки и готовность артефактов досчитывает фоновая задача.
+DAY_CATALOG_PATH = os.path.join(DATA_DIR, "_catalog.json")
+_DAY_CATALOG: Dict[str, Any] = {
+    "days": {},           # тип: Dict[str, Dict[str, Any]] — дата -> запись каталога
+    "file_version": None, # (mtime_ns, размер) прочитанного/записанного _catalog.json
+    "dir_mtime_ns": None, # mtime DATA_DIR на момент последней сверки
+    "file_locked": False, # процесс держит _catalog.lock (см. _catalog_guard)
+}
+_DAY_CATALOG_LOCK = threading.RLock()
+_DAY_NAME_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+@contextmanager
+def _catalog_guard():
+    """_DAY_CATALOG_LOCK плюс блокировка data_days/_catalog.lock между процессами.
+
+    Повторный вход в том же потоке не берёт файловую блокировку второй раз.
+    """
+    with _DAY_CATALOG_LOCK:
+        if _DAY_CATALOG["file_locked"]:
+            yield
+            return
+        with _file_lock(os.path.join(DATA_DIR, "_catalog.lock")):
+            _DAY_CATALOG["file_locked"] = True
+            try:
+                yield
+            finally:
+                _DAY_CATALOG["file_locked"] = False
+
+
+def _count_csv_rows(path: str) -> int:
+    """Число строк данных в CSV (переводы строк без заголовка) без разбора файла."""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
+
+def _day_artifacts_ready(date_str: str) -> Dict[str, bool]:
+    inputs = _day_input_versions(date_str)
+    manifest = _read_artifact_manifest(date_str)
+    return {name: _artifact_ready(date_str, name, inputs, manifest) for name in DAY_STAGES}
+
+def _catalog_stub(st: os.stat_result) -> Dict[str, Any]:
+    """Запись каталога только по stat CSV: rows и artifacts досчитываются позже."""
+    return {
+        "rows": None,
+        "bytes": int(st.st_size),
+        "ingested_at": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds"),
+        "version": f"{st.st_mtime_ns}-{st.st_size}",
+        "artifacts": None,
+    }
+
+def _scan_catalog_day(date_str: str, path: str, rows: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Запись каталога по CSV дня; rows=None — посчитать строки по файлу."""
+    try:
+        st = os.stat(path)
+        if rows is None:
+            rows = _count_csv_rows(path)
+    except OSError:
+        return None
+    item = _catalog_stub(st)
+    item.update(rows=int(rows), artifacts=_day_artifacts_ready(date_str))
+    return item
+
+def _catalog_csv_path(date_str: str) -> str:
+    """CSV дня: в папке дня или старый плоский файл в DATA_DIR."""
+    path = _day_path(date_str)
+    if os.path.exists(path):
+        return path
+    return os.path.join(DATA_DIR, f"{date_str}.csv")
+
+def _catalog_fill_pending() -> None:
+    """Фоновая задача: досчитывает строки и артефакты для записей-заготовок каталога.
+
+    Файлы читаются без блокировки каталога; результат принимается, только если
+    версия CSV за это время не изменилась.
+    """
+    scanned = set()
+    while True:
+        with _catalog_guard():
+            pending = [(d, item["version"]) for d, item in _day_catalog().items()
+                       if item.get("rows") is None and (d, item["version"]) not in scanned]
+        if not pending:
+            return
+        for start in range(0, len(pending), 32):
+            filled = {}
+            for date_str, version in pending[start:start + 32]:
+                scanned.add((date_str, version))
+                item = _scan_catalog_day(date_str, _catalog_csv_path(date_str))
+                if item is not None and item["version"] == version:
+                    filled[date_str] = item
+            with _catalog_guard():
+                days = _day_catalog()
+                updated = False
+                for date_str, item in filled.items():
+                    current = days.get(date_str)
+                    if current is not None and current.get("rows") is None and current.get("version") == item["version"]:
+                        days[date_str] = item
+                        updated = True
+                if updated:
+                    _persist_day_catalog()
+
+def _catalog_schedule_fill() -> None:
+    """Ставит _catalog_fill_pending в фоновую очередь, если в каталоге есть заготовки."""
+    if any(item.get("rows") is None for item in _DAY_CATALOG["days"].values()):
+        _submit_task("catalog:fill", TASK_PRIORITY_CATALOG, _catalog_fill_pending)
+
+def _persist_day_catalog() -> None:
+    """Атомарно пишет _catalog.json (вызывается под _catalog_guard)."""
+    try:
+        _atomic_write_json(DAY_CATALOG_PATH, {"days": _DAY_CATALOG["days"]})
+        st = os.stat(DAY_CATALOG_PATH)
+        _DAY_CATALOG["file_version"] = (st.st_mtime_ns, st.st_size)
+        # Запись файла меняет mtime DATA_DIR — это не повод для новой сверки
+        _DAY_CATALOG["dir_mtime_ns"] = os.stat(DATA_DIR).st_mtime_ns
+    except OSError as e:
+        try:
+            app.logger.warning(f"Не удалось сохранить каталог дней: {e}")
+        except Exception:
+            pass
+
+def _reconcile_day_catalog() -> bool:
+    """Сверяет каталог с содержимым DATA_DIR: добавляет новые дни, убирает исчезнувшие,
+    обновляет дни, у которых CSV изменился (по stat). Файлы дней здесь не читаются."""
+    days: Dict[str, Dict[str, Any]] = _DAY_CATALOG["days"]
+    found: Dict[str, str] = {}
+    for entry in os.listdir(DATA_DIR):
+        if _DAY_NAME_RE.match(entry):
+            csv_path = os.path.join(DATA_DIR, entry, f"{entry}.csv")
+            if os.path.exists(csv_path):
+                found[entry] = csv_path
+        elif entry.endswith(".csv") and _DAY_NAME_RE.match(entry[:-4]):
+            # Backward compatibility: old flat files
+            found.setdefault(entry[:-4], os.path.join(DATA_DIR, entry))
+    changed = False
+    for date_str in [d for d in days if d not in found]:
+        del days[date_str]
+        changed = True
+    for date_str, csv_path in found.items():
+        try:
+            st = os.stat(csv_path)
+        except OSError:
+            continue
+        item = days.get(date_str)
+        if item is None or item.get("version") != f"{st.st_mtime_ns}-{st.st_size}":
+            days[date_str] = _catalog_stub(st)
+            changed = True
+    return changed
+
+def _day_catalog() -> Dict[str, Dict[str, Any]]:
+    """Актуальный каталог дней (общий словарь — не изменять)."""
+    with _catalog_guard():
+        try:
+            st = os.stat(DAY_CATALOG_PATH)
+            file_version = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            file_version = None
+        if file_version is not None and file_version != _DAY_CATALOG["file_version"]:
+            # Каталог изменён другим процессом (или ещё не читался)
+            try:
+                with open(DAY_CATALOG_PATH, "r", encoding="utf-8") as f:
+                    _DAY_CATALOG["days"] = dict((json.load(f) or {}).get("days") or {})
+                _DAY_CATALOG["file_version"] = file_version
+                _catalog_schedule_fill()
+            except Exception:
+                _DAY_CATALOG["days"] = {}
+                _DAY_CATALOG["dir_mtime_ns"] = None
+        try:
+            dir_mtime_ns = os.stat(DATA_DIR).st_mtime_ns
+        except OSError:
+            return _DAY_CATALOG["days"]
+        if file_version is None or dir_mtime_ns != _DAY_CATALOG["dir_mtime_ns"]:
+            if _reconcile_day_catalog() or file_version is None:
+                _persist_day_catalog()
+                _catalog_schedule_fill()
+            else:
+                _DAY_CATALOG["dir_mtime_ns"] = dir_mtime_ns
+        return _DAY_CATALOG["days"]
+
+def _catalog_days() -> List[str]:
+    """Отсортированный список дней с данными."""
+    return sorted(_day_catalog())
+
+def _catalog_record_ingest(date_str: str, rows_added: int) -> None:
+    with _catalog_guard():
+        days = _day_catalog()
+        prev = days.get(date_str)
+        rows = None
+        try:
+            st = os.stat(_day_path(date_str))
+            if prev and prev.get("rows") is not None:
+                if prev.get("version") == f"{st.st_mtime_ns}-{st.st_size}":
+                    rows = prev["rows"]  # каталог уже посчитал файл после записи
+                elif prev.get("bytes", 0) < st.st_size:
+                    rows = prev["rows"] + rows_added
+        except OSError:
+            pass
+        item = _scan_catalog_day(date_str, _day_path(date_str), rows=rows)
+        if item is not None:
+            item["ingested_at"] = datetime.now().isoformat(timespec="seconds")
+            days[date_str] = item
+            _persist_day_catalog()
+
+def _catalog_remove_day(date_str: str) -> None:
+    with _catalog_guard():
+        days = _day_catalog()
+        if days.pop(date_str, None) is not None:
+            _persist_day_catalog()
+
+def _catalog_refresh_artifacts(date_str: str) -> None:
+    """Обновляет готовность артефактов дня (файл пишется только при изменении)."""
+    with _catalog_guard():
+        item = _day_catalog().get(date_str)
+        if item is None:
+            return
+        ready = _day_artifacts_ready(date_str)
+        if ready != item.get("artifacts"):
+            item["artifacts"] = ready
+            _persist_day_catalog()
+
 def _append_to_day(date_str: str, new_df: pd.DataFrame) -> None:
     if new_df is None or new_df.empty:
         return
@@ -317,47 +700,53 @@ def _append_to_day(date_str: str, new_df: pd.DataFrame) -> None:
         os.makedirs(_day_dir(date_str), exist_ok=True)
     except Exception:
         pass
-    path = _day_path(date_str)
-    mode = "a" if os.path.exists(path) else "w"
-    header = (mode == "w")
-    # Проверяем размер существующего файла перед добавлением
-    if mode == "a" and os.path.exists(path):
+    # Запись и сброс артефактов — под DAY.lock: другой поток или процесс не допишет
+    # файл одновременно, а сборка дня не прочитает его наполовину записанным
+    with _file_lock(_day_build_lock_path(date_str, "day")):
+        path = _day_path(date_str)
+        mode = "a" if os.path.exists(path) else "w"
+        header = (mode == "w")
+        # Проверяем размер существующего файла перед добавлением
+        if mode == "a" and os.path.exists(path):
+            try:
+                existing_df = pd.read_csv(path, nrows=1)  # Читаем только заголовок для проверки
+                # Проверяем общий размер файла
+                file_size = os.path.getsize(path)
+                if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                    raise ValueError(f"Файл за день уже слишком большой ({file_size / 1024 / 1024:.1f} МБ). Очистите старые данные.")
+            except Exception:
+                pass  # Игнорируем ошибки проверки
+        to_save = new_df.copy()
+        for c in to_save.columns:
+            to_save[c] = to_save[c].astype(str)
+        to_save.to_csv(path, index=False, mode=mode, header=header, encoding="utf-8-sig")
+        # Очищаем память
+        del to_save
+        # Инвалидация кэша итогов дня
         try:
-            existing_df = pd.read_csv(path, nrows=1)  # Читаем только заголовок для проверки
-            # Проверяем общий размер файла
-            file_size = os.path.getsize(path)
-            if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-                raise ValueError(f"Файл за день уже слишком большой ({file_size / 1024 / 1024:.1f} МБ). Очистите старые данные.")
+            cache_path = _day_summary_cache_path(date_str)
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
         except Exception:
-            pass  # Игнорируем ошибки проверки
-    to_save = new_df.copy()
-    for c in to_save.columns:
-        to_save[c] = to_save[c].astype(str)
-    to_save.to_csv(path, index=False, mode=mode, header=header, encoding="utf-8-sig")
-    # Очищаем память
-    del to_save
-    # Инвалидация кэша итогов дня
-    try:
-        cache_path = _day_summary_cache_path(date_str)
-        if os.path.exists(cache_path):
-            os.remove(cache_path)
-    except Exception:
-        pass
-    # Инвалидация кэша анализа дня
-    try:
-        csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
-        for p in (csv_cache, br_cache, hr_cache):
-            if os.path.exists(p):
-                os.remove(p)
-    except Exception:
-        pass
-    # Инвалидация кэша faststat
-    try:
-        faststat_cache = _day_faststat_cache_path(date_str)
-        if os.path.exists(faststat_cache):
-            os.remove(faststat_cache)
-    except Exception:
-        pass
+            pass
+        # Инвалидация кэша анализа дня
+        try:
+            csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
+            for p in (csv_cache, br_cache, hr_cache, _day_gaps_cache_path(date_str), _day_analysis_meta_path(date_str),
+                      _day_breaks_sum_cache_path(date_str)):
+                if os.path.exists(p):
+                    os.remove(p)
+        except Exception:
+            pass
+        # Инвалидация кэша faststat, списка компаний, срезов по компаниям и простоев дня
+        try:
+            for p in (*_day_faststat_cache_paths(date_str), _day_companies_cache_path(date_str),
+                      _day_company_views_path(date_str), _day_idle_cache_path(date_str)):
+                if os.path.exists(p):
+                    os.remove(p)
+        except Exception:
+            pass
+    _catalog_record_ingest(date_str, len(new_df))
 
 # --------------------------------
 # Вспомогательные сериализаторы/безопасная запись
@@ -366,24 +755,273 @@ def _stringify_record_for_json(rec: Dict[str, object]) -> Dict[str, str]:
     return {k: ("" if v is None else str(v)) for k, v in rec.items()}
 
 def _serialize_breaks_map(breaks_map: Dict[str, List[Dict[str, object]]]) -> Dict[str, List[Dict[str, object]]]:
+    """Компактный вид перерывов для ANL_breaks.json: длительность в секундах, корзина,
+    номера строк дня до/после перерыва и время подтверждения этих строк."""
     out: Dict[str, List[Dict[str, object]]] = {}
     for approver, brs in (breaks_map or {}).items():
-        ser_list: List[Dict[str, object]] = []
-        for b in (brs or []):
-            ser_list.append({
-                "duration": str(b.get("duration")),
-                "bucket": b.get("bucket"),
-                "before": _stringify_record_for_json(b.get("before", {})),
-                "after": _stringify_record_for_json(b.get("after", {})),
-            })
-        out[str(approver)] = ser_list
+        out[str(approver)] = [{
+            "gap_seconds": b.get("gap_seconds"),
+            "bucket": b.get("bucket"),
+            "before_row": b.get("before_row"),
+            "after_row": b.get("after_row"),
+            "from": b.get("from", ""),
+            "to": b.get("to", ""),
+        } for b in (brs or [])]
+    return out
+
+_BREAK_TIME_RE = re.compile(r"\d{1,2}:\d{2}(?::\d{2})?")
+
+
+def _break_time(rec: Dict[str, object]) -> str:
+    """Время подтверждения из строки до/после перерыва (ЧЧ:ММ[:СС], если распознаётся)."""
+    raw = rec.get("confirm_time") or rec.get("Время подтверждения") or ""
+    if raw != raw:  # NaN
+        return ""
+    raw = str(raw)
+    m = _BREAK_TIME_RE.search(raw)
+    return m.group(0) if m else raw
+
+def _slim_breaks_map(breaks_map: Dict[str, List[Dict[str, object]]]) -> Dict[str, List[Dict[str, object]]]:
+    """Перерывы для страницы результатов: длительность, корзина и время начала/конца.
+
+    Принимает как свежую карту из analyze_dataframe, так и компактную из ANL_breaks.json.
+    Полные строки до/после перерыва отдаёт /breaks/<date>/<approver>.
+    """
+    out: Dict[str, List[Dict[str, object]]] = {}
+    for approver, brs in (breaks_map or {}).items():
+        out[str(approver)] = [{
+            "duration": str(b["duration"] if "duration" in b else timedelta(seconds=b.get("gap_seconds") or 0)),
+            "bucket": b.get("bucket"),
+            "from": b["from"] if "from" in b else _break_time(b.get("before") or {}),
+            "to": b["to"] if "to" in b else _break_time(b.get("after") or {}),
+        } for b in (brs or [])]
     return out
 
+def _without_row_refs(breaks_map: Dict[str, List[Dict[str, object]]]) -> Dict[str, List[Dict[str, object]]]:
+    """Перерывы без before_row/after_row — для анализа не CSV дня (загрузка, накопитель),
+    где номера строк не соответствуют файлу дня и не должны по нему разрешаться."""
+    return {
+        approver: [{k: v for k, v in b.items() if k not in ("before_row", "after_row")} for b in (brs or [])]
+        for approver, brs in (breaks_map or {}).items()
+    }
+
+def _resolve_break_rows(date_str: str, breaks: List[Dict[str, object]]) -> List[Dict[str, object]]:
+    """Подставляет в перерывы строки дня до/после перерыва (before/after) по номерам строк.
+
+    Из CSV читаются только нужные строки, а не весь день.
+    """
+    row_ids = {int(b[key]) for b in breaks for key in ("before_row", "after_row") if b.get(key) is not None}
+    if not row_ids:
+        return [dict(b, before={}, after={}) for b in breaks]
+    day_df = _load_day_rows(date_str, row_ids)
+    rows = day_df.index if day_df is not None else pd.Index([])
+
+    def _row(row_id: object) -> Dict[str, str]:
+        if row_id is None or row_id not in rows:
+            return {}
+        return _stringify_record_for_json(day_df.loc[row_id].to_dict())
+
+    return [dict(b, before=_row(b.get("before_row")), after=_row(b.get("after_row"))) for b in breaks]
+
+# umask процесса: временные файлы mkstemp создаются с правами 0600, выравниваем их
+# с обычными файлами (читаем один раз при импорте, пока процесс однопоточный)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _unique_tmp_path(path: str, suffix: str = ".tmp") -> str:
+    """Пустой временный файл с уникальным именем рядом с path (для записи и os.replace).
+
+    Уникальное имя не даёт параллельным потокам и процессам (воркерам gunicorn,
+    процессам пула) писать в один и тот же .tmp.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=suffix,
+                                    dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    os.chmod(tmp_path, 0o666 & ~_UMASK)
+    return tmp_path
+
+@contextmanager
+def _atomic_output(path: str, mode: str = "wb", **open_kwargs: Any):
+    """Файл для атомарной записи path: пишем во временный (_unique_tmp_path), затем os.replace."""
+    tmp_path = _unique_tmp_path(path)
+    try:
+        with open(tmp_path, mode, **open_kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def _atomic_write_json(path: str, data: object) -> None:
-    tmp_path = f"{path}.tmp"
-    with open(tmp_path, 'w', encoding='utf-8') as f:
+    with _atomic_output(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False)
-    os.replace(tmp_path, path)
+
+# LRU результатов анализа в памяти процесса: date -> (версия, размер, (result_df, breaks, hourly)).
+# Версия — (mtime, размер) CSV дня и файлов кэша анализа, поэтому любая перезапись
+# данных или кэша делает запись недействительной без явной инвалидации.
+_ANALYSIS_LRU: "OrderedDict[str, Tuple[Any, int, Tuple[pd.DataFrame, Dict[str, object], Dict[str, object]]]]" = OrderedDict()
+_ANALYSIS_LRU_LOCK = threading.Lock()
+_ANALYSIS_LRU_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _analysis_lru_stats() -> Dict[str, Any]:
+    with _ANALYSIS_LRU_LOCK:
+        return dict(
+            _ANALYSIS_LRU_STATS,
+            entries=len(_ANALYSIS_LRU),
+            max_bytes=int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024),
+        )
+
+def _read_day_analysis_cache(date_str: str) -> Optional[Tuple[pd.DataFrame, Dict[str, object], Dict[str, object]]]:
+    """Кэш анализа дня через LRU в памяти; при промахе читается с диска.
+
+    Возвращает копию result_df (вызывающие меняют её на месте); карты перерывов и
+    почасовой активности общие — их нельзя изменять.
+    """
+    csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
+    version, _ = _stat_version([_day_path(date_str), csv_cache, br_cache, hr_cache])
+    with _ANALYSIS_LRU_LOCK:
+        entry = _ANALYSIS_LRU.get(date_str)
+        if entry is not None and entry[0] == version:
+            _ANALYSIS_LRU.move_to_end(date_str)
+            _ANALYSIS_LRU_STATS["hits"] += 1
+            result_df, breaks_map, hourly_map = entry[2]
+            return result_df.copy(), breaks_map, hourly_map
+        _ANALYSIS_LRU_STATS["misses"] += 1
+    # Кэш на диске, построенный по другим входам (данные, пороги, версия алгоритма), не отдаём
+    if not _artifact_ready(date_str, "analysis"):
+        return None
+    loaded = _load_day_analysis_cache(date_str)
+    if loaded is None:
+        return None
+    # Оценка занимаемой памяти: таблица + разобранный JSON (примерно вчетверо больше файла)
+    size = int(loaded[0].memory_usage(deep=True).sum())
+    for path in (br_cache, hr_cache):
+        try:
+            size += 4 * os.path.getsize(path)
+        except OSError:
+            pass
+    max_bytes = int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024)
+    with _ANALYSIS_LRU_LOCK:
+        old = _ANALYSIS_LRU.pop(date_str, None)
+        if old is not None:
+            _ANALYSIS_LRU_STATS["bytes"] -= old[1]
+        if size <= max_bytes:
+            _ANALYSIS_LRU[date_str] = (version, size, loaded)
+            _ANALYSIS_LRU_STATS["bytes"] += size
+            while _ANALYSIS_LRU_STATS["bytes"] > max_bytes:
+                _, (_, evicted_size, _) = _ANALYSIS_LRU.popitem(last=False)
+                _ANALYSIS_LRU_STATS["bytes"] -= evicted_size
+                _ANALYSIS_LRU_STATS["evictions"] += 1
+    return loaded[0].copy(), loaded[1], loaded[2]
+
+def _load_day_analysis_cache(date_str: str) -> Optional[Tuple[pd.DataFrame, Dict[str, object], Dict[str, object]]]:
+    """Читает кэш анализа дня (ANL.csv + перерывы + по-часам). None, если кэша нет или он битый."""
+    csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
+    if not os.path.exists(csv_cache):
+        return None
+    try:
+        result_df = pd.read_csv(csv_cache, dtype={"Утвердил": str})
+        try:
+            with open(br_cache, 'r', encoding='utf-8') as f:
+                breaks_map = json.load(f)
+        except Exception:
+            breaks_map = {}
+        with open(hr_cache, 'r', encoding='utf-8') as f:
+            hourly_map = json.load(f)
+        return result_df, breaks_map, hourly_map
+    except Exception:
+        return None
+
+def _write_day_analysis_cache(date_str: str, result_df: pd.DataFrame) -> Dict[str, int]:
+    """Сохраняет свежий результат analyze_dataframe в кэш дня и в таблицу фактов.
+
+    Пишет ANL.csv, ANL_breaks.json (перерывы со ссылками на строки дня), ANL_hourly.json
+    и ANL_breaks_sum.json. Таблица фактов обновляется отдельной стадией "facts".
+    Возвращает сумму перерывов (в секундах) по сотруднику.
+    """
+    breaks_map = getattr(result_df, "breaks_by_approver", {}) or {}
+    hourly_map = getattr(result_df, "hourly_by_approver", {}) or {}
+    breaks_sum = {str(ap): sum(_break_seconds(x) for x in (brs or [])) for ap, brs in breaks_map.items()}
+    csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
+    _ensure_day_dir(date_str)
+    with _atomic_output(csv_cache, "w", encoding="utf-8-sig", newline="") as f:
+        result_df.to_csv(f, index=False)
+    # Кэш суммы перерывов (маленький файл, нужен для страницы /showstats)
+    _atomic_write_json(_day_breaks_sum_cache_path(date_str), breaks_sum)
+    _atomic_write_json(br_cache, _serialize_breaks_map(breaks_map))
+    _atomic_write_json(hr_cache, hourly_map)
+    _write_gaps_cache(date_str, getattr(result_df, "gaps_by_approver", {}) or {})
+    _atomic_write_json(_day_analysis_meta_path(date_str), _day_analysis_meta(result_df))
+    return breaks_sum
+
+def _day_analysis_meta(result_df: pd.DataFrame) -> Dict[str, object]:
+    latest_dt = getattr(result_df, "latest_dt", None)
+    active_map = getattr(result_df, "active_seconds_by_approver", {}) or {}
+    return {
+        "latest_dt": latest_dt.isoformat() if latest_dt is not None and pd.notna(latest_dt) else None,
+        "approvers": int(len(result_df)),
+        # Активное время нужно таблице фактов, когда она пересобирается из кэша анализа
+        "active_seconds": {str(k): int(v or 0) for k, v in active_map.items()},
+    }
+
+def _read_day_analysis_meta(date_str: str) -> Optional[Dict[str, object]]:
+    try:
+        with open(_day_analysis_meta_path(date_str), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _write_gaps_cache(date_str: str, gaps_by_approver: Dict[str, np.ndarray]) -> None:
+    """Сохраняет интервалы одним плоским массивом: approvers, offsets (CSR) и gaps (секунды)."""
+    approvers = sorted(gaps_by_approver)
+    lengths = np.array([len(gaps_by_approver[a]) for a in approvers], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    gaps = np.concatenate([gaps_by_approver[a] for a in approvers]) if approvers else np.empty(0, dtype=np.float64)
+    with _atomic_output(_day_gaps_cache_path(date_str)) as f:
+        np.savez_compressed(f, approvers=np.array(approvers, dtype=str), offsets=offsets, gaps=gaps.astype(np.float64))
+
+def _read_gaps_cache(date_str: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Читает ANL_gaps.npz: (approvers, offsets, gaps). None, если файла нет."""
+    path = _day_gaps_cache_path(date_str)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return data["approvers"], data["offsets"], data["gaps"]
+    except Exception:
+        return None
+
+def _upsert_day_facts(date_str: str, result_df: pd.DataFrame, breaks_sum: Dict[str, int]) -> None:
+    """Перезаписывает строки дня в таблице фактов approver_day_facts."""
+    active_map = getattr(result_df, "active_seconds_by_approver", None)
+    if active_map is None:
+        # Результат из кэша: активное время сохранено в ANL_meta.json
+        active_map = (_read_day_analysis_meta(date_str) or {}).get("active_seconds") or {}
+    company_map = _employees_company_map()
+    rows: List[Dict[str, object]] = []
+    for r in result_df.to_dict(orient="records"):
+        approver = str(r.get("Утвердил") or "").strip()
+        if not approver or approver.lower() == "nan":
+            continue
+        rows.append({
+            "approver": approver,
+            "company": company_map.get(approver) or None,
+            "tasks": int(r.get("СЗ") or 0),
+            "weight": float(r.get("Вес") or 0.0),
+            "qty": int(r.get("Шт") or 0),
+            "active_seconds": int(active_map.get(approver, 0) or 0),
+            "break_seconds": int(breaks_sum.get(approver, 0) or 0),
+            "b15": int(r.get("b15") or 0),
+            "b30": int(r.get("b30") or 0),
+            "b45": int(r.get("b45") or 0),
+        })
+    replace_day_facts(date_str, rows)
+
 def _load_accumulated_df() -> Optional[pd.DataFrame]:
     """Читает накопительный CSV, если существует.
 
@@ -429,18 +1067,20 @@ def _append_to_accumulated(new_df: pd.DataFrame) -> None:
     # Ограничиваем размер добавляемых данных
     if len(new_df) > MAX_ROWS:
         raise ValueError(f"Слишком много строк для добавления ({len(new_df)}). Максимально допустимо: {MAX_ROWS} строк")
-    mode = "a" if os.path.exists(ACCUMULATED_FILE_PATH) else "w"
-    header = (mode == "w")
-    # Проверяем размер существующего файла перед добавлением
-    if mode == "a" and os.path.exists(ACCUMULATED_FILE_PATH):
-        file_size = os.path.getsize(ACCUMULATED_FILE_PATH)
-        if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-            raise ValueError(f"Накопительный файл уже слишком большой ({file_size / 1024 / 1024:.1f} МБ). Очистите накопленные данные.")
     # Приводим все к строкам для единообразия хранения
     to_save = new_df.copy()
     for c in to_save.columns:
         to_save[c] = to_save[c].astype(str)
-    to_save.to_csv(ACCUMULATED_FILE_PATH, index=False, mode=mode, header=header, encoding="utf-8-sig")
+    # Дописываем под блокировкой файла: загрузки в разных процессах не перемешают строки
+    with _file_lock(f"{ACCUMULATED_FILE_PATH}.lock"):
+        mode = "a" if os.path.exists(ACCUMULATED_FILE_PATH) else "w"
+        header = (mode == "w")
+        # Проверяем размер существующего файла перед добавлением
+        if mode == "a" and os.path.exists(ACCUMULATED_FILE_PATH):
+            file_size = os.path.getsize(ACCUMULATED_FILE_PATH)
+            if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                raise ValueError(f"Накопительный файл уже слишком большой ({file_size / 1024 / 1024:.1f} МБ). Очистите накопленные данные.")
+        to_save.to_csv(ACCUMULATED_FILE_PATH, index=False, mode=mode, header=header, encoding="utf-8-sig")
     # Очищаем память
     del to_save
 
@@ -852,6 +1492,158 @@ def _extract_employees_mapping(emp_df: pd.DataFrame) -> Optional[pd.DataFrame]:
 	return res
 
 
+def _normalize_employees_mapping(mapping: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Утвердил/Компания[/Занятость] без пустых кодов и повторов; пустые значения — None.
+
+    Бросает ValueError, если в файле не нашлось ни одного сотрудника.
+    """
+    if mapping is None or mapping.empty:
+        raise ValueError("Не найдены столбцы Утвердил/Компания или файл пуст")
+    mapping = mapping.dropna(subset=["Утвердил"]).copy()
+    mapping["Утвердил"] = mapping["Утвердил"].astype(str).str.strip()
+    mapping = mapping[mapping["Утвердил"] != ""]
+    mapping = mapping.drop_duplicates(subset=["Утвердил"], keep="first").reset_index(drop=True)
+    if mapping.empty:
+        raise ValueError("В файле сотрудников нет ни одного кода в столбце Утвердил")
+    for col in mapping.columns[1:]:
+        values = mapping[col].astype(object).where(mapping[col].notna(), "").astype(str).str.strip()
+        mapping[col] = values.where(values != "", None)
+    return mapping
+
+def _build_employees_index(path: str, source_path: Optional[str] = None) -> Dict[str, Any]:
+    """Разбирает файл сотрудников и атомарно записывает индекс EMPLOYEES_INDEX_PATH.
+
+    source_path — путь, под которым файл будет использоваться (при загрузке файл
+    сначала проверяется во временном месте). Ошибки разбора — ValueError.
+    Вызывается под _employees_index_lock().
+    """
+    import sqlite3
+    try:
+        emp_df = _try_read_employees(path)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Не удалось прочитать файл: {e}") from e
+    mapping = _normalize_employees_mapping(_extract_employees_mapping(emp_df))
+    has_assignment = "Занятость" in mapping.columns
+    if not has_assignment:
+        mapping["Занятость"] = None
+    st = os.stat(path)
+    meta = {
+        "source": os.path.abspath(source_path or path),
+        "mtime_ns": str(st.st_mtime_ns),
+        "size": str(st.st_size),
+        "has_assignment": "1" if has_assignment else "0",
+        "rows": str(len(mapping)),
+    }
+    tmp_path = _unique_tmp_path(EMPLOYEES_INDEX_PATH)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("CREATE TABLE employees (code TEXT PRIMARY KEY, company TEXT, assignment TEXT)")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.executemany(
+                "INSERT INTO employees (code, company, assignment) VALUES (?, ?, ?)",
+                mapping[["Утвердил", "Компания", "Занятость"]].itertuples(index=False, name=None),
+            )
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, EMPLOYEES_INDEX_PATH)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return {"rows": len(mapping), "has_assignment": has_assignment}
+
+@contextmanager
+def _employees_index_lock():
+    """_EMPLOYEES_LOCK плюс flock на EMPLOYEES_INDEX_PATH.lock: индекс перестраивает
+    один поток во всех процессах (воркеры gunicorn, процессы пула сборки)."""
+    with _EMPLOYEES_LOCK:
+        with _file_lock(f"{EMPLOYEES_INDEX_PATH}.lock"):
+            yield
+
+def _read_employees_index(version: Tuple[str, int, int]) -> Optional[pd.DataFrame]:
+    """Справочник из индекса, если он построен по текущей версии файла; иначе None."""
+    import sqlite3
+    if not os.path.exists(EMPLOYEES_INDEX_PATH):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{EMPLOYEES_INDEX_PATH}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            if (meta.get("source"), meta.get("mtime_ns"), meta.get("size")) != (version[0], str(version[1]), str(version[2])):
+                return None
+            rows = conn.execute("SELECT code, company, assignment FROM employees ORDER BY rowid").fetchall()
+        finally:
+            conn.close()
+    except Exception:
+        return None
+    mapping = pd.DataFrame(rows, columns=["Утвердил", "Компания", "Занятость"], dtype=object)
+    if meta.get("has_assignment") != "1":
+        mapping = mapping.drop(columns=["Занятость"])
+    return mapping
+
+def _load_employees() -> Dict[str, object]:
+    """Справочник сотрудников (см. _EMPLOYEES_CACHE), перечитывается только при смене файла.
+
+    Читается из индекса EMPLOYEES_INDEX_PATH; если индекса нет или он построен по
+    другой версии файла (файл подложили вручную), файл разбирается и индекс перестраивается.
+    Коды сотрудников без пробелов по краям, при повторах берётся первая строка.
+    Ошибка чтения файла кэшируется как пустой справочник до следующего изменения файла.
+    """
+    path = _get_employees_file_path()
+    version = None
+    if path:
+        try:
+            st = os.stat(path)
+            version = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        except OSError:
+            version = None
+    with _EMPLOYEES_LOCK:
+        if _EMPLOYEES_CACHE["loaded"] and _EMPLOYEES_CACHE["version"] == version:
+            return _EMPLOYEES_CACHE
+        mapping = None
+        if path and version is not None:
+            mapping = _read_employees_index(version)
+            if mapping is None:
+                try:
+                    with _file_lock(f"{EMPLOYEES_INDEX_PATH}.lock"):
+                        # Пока ждали, индекс мог перестроить другой процесс
+                        mapping = _read_employees_index(version)
+                        if mapping is None:
+                            _build_employees_index(path)
+                            mapping = _read_employees_index(version)
+                except Exception as e:
+                    app.logger.warning(f"Не удалось прочитать файл сотрудников {path}: {e}")
+        by_code: Dict[str, Tuple[str, str]] = {}
+        company_map: Dict[str, str] = {}
+        if mapping is not None and not mapping.empty:
+            companies = mapping["Компания"].fillna("")
+            if "Занятость" in mapping.columns:
+                assignments = mapping["Занятость"].fillna("")
+            else:
+                assignments = pd.Series("", index=mapping.index)
+            by_code = dict(zip(mapping["Утвердил"], zip(companies, assignments)))
+            company_map = {code: company for code, (company, _) in by_code.items() if company}
+        else:
+            mapping = None
+        _EMPLOYEES_CACHE.update(version=version, mapping=mapping, by_code=by_code, company_map=company_map, loaded=True)
+        return _EMPLOYEES_CACHE
+
+def _employees_mapping() -> Optional[pd.DataFrame]:
+    """Таблица Утвердил/Компания[/Занятость] для merge с результатами (общая — не изменять)."""
+    return _load_employees()["mapping"]  # type: ignore[return-value]
+
+def _employees_company_map() -> Dict[str, str]:
+    """Код сотрудника -> компания (только сотрудники с указанной компанией)."""
+    return _load_employees()["company_map"]  # type: ignore[return-value]
+
+
 def _parse_timedelta(value: str) -> timedelta:
 	"""Парсер времени подтверждения в timedelta.
 
@@ -1016,7 +1808,7 @@ def _compute_active_time_per_approver(df: pd.DataFrame) -> pd.Series:
 
     Используются подтверждения как datetime: приоритет `confirm_dt`, затем `end_dt`, затем `event_dt`.
     """
-    max_gap = timedelta(minutes=15)
+    max_gap = timedelta(minutes=ACTIVE_GAP_CAP_MINUTES)
     results: Dict[str, timedelta] = {}
     for approver, grp in df.groupby("approver", dropna=False):
         if "confirm_dt" in grp.columns:
@@ -1046,13 +1838,14 @@ def _compute_active_time_per_approver(df: pd.DataFrame) -> pd.Series:
     return pd.Series(results)
 
 
-def _compute_breaks_and_active_time(df: pd.DataFrame) -> Tuple[pd.Series, Dict[str, List[Dict[str, object]]]]:
-    """Векторизованный расчёт активного времени и перерывов >10 минут по сотруднику.
+def _compute_breaks_and_active_time(df: pd.DataFrame) -> Tuple[pd.Series, Dict[str, List[Dict[str, object]]], Dict[str, np.ndarray]]:
+    """Векторизованный расчёт активного времени и перерывов >BREAK_MIN_MINUTES по сотруднику.
 
-    Возвращает Series approver->Timedelta и подробные перерывы для отображения.
+    Возвращает Series approver->Timedelta, подробные перерывы для отображения и
+    отсортированные интервалы между событиями (секунды) по сотруднику.
     Приоритет времени: event_dt, затем end_dt, затем start_dt.
     """
-    min_break = pd.Timedelta(minutes=10)
+    min_break = pd.Timedelta(minutes=BREAK_MIN_MINUTES)
 
     # Единая временная метка
     primary_dt = None
@@ -1066,7 +1859,7 @@ def _compute_breaks_and_active_time(df: pd.DataFrame) -> Tuple[pd.Series, Dict[s
     if primary_dt is None:
         # Нет валидных временных меток
         empty = pd.Series(dtype="timedelta64[ns]")
-        return empty, {}
+        return empty, {}, {}
 
     tmp = pd.DataFrame({
         "approver": df["approver"],
@@ -1075,7 +1868,7 @@ def _compute_breaks_and_active_time(df: pd.DataFrame) -> Tuple[pd.Series, Dict[s
     tmp = tmp.dropna(subset=["t"])  # оставляем только строки с временем
     if tmp.empty:
         empty = pd.Series(dtype="timedelta64[ns]")
-        return empty, {}
+        return empty, {}, {}
 
     # Сортировка по сотруднику и времени
     tmp = tmp.sort_values(["approver", "t"])  # сохраняет исходные индексы
@@ -1096,39 +1889,49 @@ def _compute_breaks_and_active_time(df: pd.DataFrame) -> Tuple[pd.Series, Dict[s
     window_by_approver = (tmp.groupby("approver")["t"].last() - tmp.groupby("approver")["t"].first())
     active_td = (window_by_approver - sum_long_gaps).clip(lower=pd.Timedelta(0))
 
-    # Формирование подробного списка перерывов для UI (точечно по точкам, где gap>10)
+    # Отсортированные интервалы по сотруднику — для пересчёта с другими порогами без повторного анализа
+    gap_seconds = gap.dt.total_seconds()
+    gaps_frame = pd.DataFrame({"approver": tmp["approver"].astype(str), "g": gap_seconds}).dropna(subset=["g"])
+    gaps_frame = gaps_frame.sort_values(["approver", "g"], kind="stable")
+    gaps_by_approver: Dict[str, np.ndarray] = {str(a): np.empty(0, dtype=np.float64) for a in tmp["approver"].unique()}
+    for appr, vals in gaps_frame.groupby("approver", sort=False)["g"]:
+        gaps_by_approver[appr] = vals.to_numpy(dtype=np.float64)
+
+    # Перерывы для UI: ссылки на строки дня до/после перерыва (индекс исходного CSV),
+    # сами строки подгружаются по запросу (/breaks/<date>/<approver>)
     breaks_by_approver: Dict[str, List[Dict[str, object]]] = {}
-    # Подготовим быстрый доступ к исходным строкам
-    df_local = df
-    idx_series = tmp.index
-    approver_vals = tmp["approver"].to_numpy()
-    t_vals = tmp["t"].to_numpy()
     gap_vals = gap.to_numpy()
-    for i in range(1, len(tmp)):
-        g = gap_vals[i]
-        if pd.isna(g) or g <= min_break:
-            continue
-        appr = approver_vals[i]
-        before_idx = idx_series[i - 1]
-        after_idx = idx_series[i]
-        # Категория корзины
-        if g >= pd.Timedelta(minutes=45):
-            bucket = 45
-        elif g >= pd.Timedelta(minutes=30):
-            bucket = 30
-        elif g >= pd.Timedelta(minutes=15):
-            bucket = 15
+    positions = np.nonzero(gap.gt(min_break).to_numpy())[0]
+    if len(positions):
+        # Первая строка сотрудника не имеет gap, поэтому строка "до" всегда того же сотрудника
+        before_ids = tmp.index[positions - 1]
+        after_ids = tmp.index[positions]
+        # Категория корзины (наибольший порог из BREAK_BUCKETS_MINUTES, который перекрыт)
+        thresholds = sorted(BREAK_BUCKETS_MINUTES, reverse=True)
+        buckets = np.select(
+            [gap_vals[positions] >= np.timedelta64(int(b_min * 60), "s") for b_min in thresholds],
+            thresholds,
+            default=0,
+        )
+        if "confirm_time" in df.columns:
+            from_times = [_break_time({"confirm_time": v}) for v in df.loc[before_ids, "confirm_time"].tolist()]
+            to_times = [_break_time({"confirm_time": v}) for v in df.loc[after_ids, "confirm_time"].tolist()]
         else:
-            bucket = 0
-        lst = breaks_by_approver.setdefault(appr, [])
-        lst.append({
-            "duration": _to_python_timedelta(g),
-            "bucket": bucket,
-            "before": df_local.loc[before_idx].to_dict() if before_idx in df_local.index else {},
-            "after": df_local.loc[after_idx].to_dict() if after_idx in df_local.index else {},
-        })
+            from_times = to_times = [""] * len(positions)
+        approver_vals = tmp["approver"].to_numpy()[positions]
+        for k, pos in enumerate(positions):
+            g = gap_vals[pos]
+            breaks_by_approver.setdefault(approver_vals[k], []).append({
+                "duration": _to_python_timedelta(g),
+                "gap_seconds": float(g / np.timedelta64(1, "s")),
+                "bucket": int(buckets[k]),
+                "before_row": int(before_ids[k]),
+                "after_row": int(after_ids[k]),
+                "from": from_times[k],
+                "to": to_times[k],
+            })
 
-    return active_td, breaks_by_approver
+    return active_td, breaks_by_approver, gaps_by_approver
 
 
 def analyze_dataframe(df: pd.DataFrame) -> pd.DataFrame:
@@ -1251,6 +2054,14 @@ def analyze_dataframe(df: pd.DataFrame) -> pd.DataFrame:
 		else:
 			work_df["end_dt"] = confirm_as_dt
 
+	# Последняя отметка времени дня (для "latest_finish" в сводке без повторного чтения данных)
+	latest_dt = None
+	for col in ["event_dt", "end_dt", "start_dt"]:
+		if col in work_df.columns:
+			cand = work_df[col].dropna().max()
+			if pd.notna(cand):
+				latest_dt = cand if latest_dt is None or cand > latest_dt else latest_dt
+
 	# Пересчёт confirm_td: если есть пара start_dt/end_dt, то длительность = разница
 	if "start_dt" in work_df.columns and "end_dt" in work_df.columns:
 		delta = (work_df["end_dt"] - work_df["start_dt"]).where(~(work_df["end_dt"].isna() | work_df["start_dt"].isna()))
@@ -1278,16 +2089,20 @@ def analyze_dataframe(df: pd.DataFrame) -> pd.DataFrame:
 	}).reset_index()
 
 	# Новая логика (векторная): активное время = (последнее - первое) - сумма перерывов >10 минут
-	active_time_map, breaks_by_approver = _compute_breaks_and_active_time(work_df)
+	active_time_map, breaks_by_approver, gaps_by_approver = _compute_breaks_and_active_time(work_df)
 	grouped = grouped.merge(active_time_map.rename("active_td"), left_on="approver", right_index=True, how="left")
 
-	# Подсчёт количества перерывов по корзинам 15/30/45 минут
-	def _count_bucket(approver: str, bucket: int) -> int:
+	# Подсчёт количества перерывов по корзинам 15/30/45 минут. Колонки отчёта фиксированы,
+	# поэтому считаем по длительности, а не по настраиваемым BREAK_BUCKETS_MINUTES
+	def _count_bucket(approver: str, lo_min: int, hi_min: Optional[int] = None) -> int:
 		brs = breaks_by_approver.get(approver, [])
-		return sum(1 for b in brs if b.get("bucket") == bucket)
+		return sum(
+			1 for b in brs
+			if b.get("gap_seconds", 0) >= lo_min * 60 and (hi_min is None or b.get("gap_seconds", 0) < hi_min * 60)
+		)
 
-	grouped["b15"] = grouped["approver"].apply(lambda a: _count_bucket(a, 15))
-	grouped["b30"] = grouped["approver"].apply(lambda a: _count_bucket(a, 30))
+	grouped["b15"] = grouped["approver"].apply(lambda a: _count_bucket(a, 15, 30))
+	grouped["b30"] = grouped["approver"].apply(lambda a: _count_bucket(a, 30, 45))
 	grouped["b45"] = grouped["approver"].apply(lambda a: _count_bucket(a, 45))
 
 	grouped.rename(columns={
@@ -1329,6 +2144,11 @@ def analyze_dataframe(df: pd.DataFrame) -> pd.DataFrame:
 	# Прикладываем карту перерывов как атрибут для последующей передачи в шаблон
 	# Используем setattr для избежания предупреждения pandas
 	setattr(final_df, 'breaks_by_approver', breaks_by_approver)
+	setattr(final_df, 'gaps_by_approver', gaps_by_approver)
+	setattr(final_df, 'latest_dt', latest_dt)
+	# Точное активное время в секундах (в "Время" оно округлено до минут) — для таблицы фактов
+	active_seconds = grouped["active_td"].dt.total_seconds().fillna(0).astype(int)
+	setattr(final_df, 'active_seconds_by_approver', dict(zip(grouped["Утвердил"].astype(str), active_seconds)))
 
 	# Подсчёт количества задач по часам (09..20) на основе первого доступного времени
 	hours = list(range(9, 21))
@@ -1707,109 +2527,9 @@ def analyze():
 				_append_to_day(date_str, df)
 				processed_count += 1
 				
-				# Запускаем асинхронную обработку для этой даты
+				# Ставим обработку этой даты в очередь фоновых задач (faststat — первым)
 				if is_api_request:
-					def process_async_for_date(d_str):
-						def process():
-							try:
-								try:
-									app.logger.info(f"Начата асинхронная обработка данных за {d_str}")
-								except Exception:
-									pass
-								time.sleep(0.5)
-								# Далее тот же код обработки, что и ниже
-								csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(d_str)
-								result_df = None
-								if os.path.exists(csv_cache):
-									try:
-										import json as _json
-										result_df = pd.read_csv(csv_cache)
-										with open(br_cache, 'r', encoding='utf-8') as f:
-											breaks_map = _json.load(f)
-										with open(hr_cache, 'r', encoding='utf-8') as f:
-											hourly_map = _json.load(f)
-										try:
-											app.logger.info(f"Использован кэш для {d_str}")
-										except Exception:
-											pass
-									except Exception:
-										result_df = None
-								if result_df is None:
-									try:
-										app.logger.info(f"Загрузка данных за {d_str} для обработки")
-									except Exception:
-										pass
-									day_df = _load_day_df(d_str)
-									if day_df is None or day_df.empty:
-										try:
-											app.logger.error(f"Не удалось загрузить данные за {d_str}")
-										except Exception:
-											pass
-										return
-									try:
-										app.logger.info(f"Обработка {len(day_df)} строк для {d_str}")
-									except Exception:
-										pass
-									result_df = analyze_dataframe(day_df)
-									breaks_map = getattr(result_df, "breaks_by_approver", {})
-									hourly_map = getattr(result_df, "hourly_by_approver", {})
-									# Сохраняем кэш (код ниже)
-									try:
-										import json as _json
-										_ensure_day_dir(d_str)
-										result_df.to_csv(csv_cache, index=False, encoding='utf-8-sig')
-										serializable_breaks = {}
-										for approver, brs in (breaks_map or {}).items():
-											serializable_breaks[approver] = [{
-												"duration": str(b.get("duration")),
-												"bucket": b.get("bucket"),
-												"before": {k: ("" if v is None else str(v)) for k, v in b.get("before", {}).items()},
-												"after": {k: ("" if v is None else str(v)) for k, v in b.get("after", {}).items()},
-											} for b in brs]
-										breaks_sum = {ap: sum(_duration_to_seconds(x.get("duration")) for x in (brs or [])) for ap, brs in (breaks_map or {}).items()}
-										tmp_sum = f"{_day_breaks_sum_cache_path(d_str)}.tmp"
-										with open(tmp_sum, 'w', encoding='utf-8') as f:
-											_json.dump(breaks_sum, f, ensure_ascii=False)
-										os.replace(tmp_sum, _day_breaks_sum_cache_path(d_str))
-										tmp_path = f"{br_cache}.tmp"
-										with open(tmp_path, 'w', encoding='utf-8') as f:
-											_json.dump(serializable_breaks, f, ensure_ascii=False)
-										os.replace(tmp_path, br_cache)
-										with open(hr_cache, 'w', encoding='utf-8') as f:
-											_json.dump(hourly_map or {}, f, ensure_ascii=False)
-									except Exception as e:
-										try:
-											app.logger.error(f"Ошибка при сохранении кэша для {d_str}: {e}")
-										except Exception:
-											pass
-								try:
-									try:
-										app.logger.info(f"Построение сводки дня для {d_str}")
-									except Exception:
-										pass
-									_build_day_summary(d_str, preloaded_df=_load_day_df(d_str), write_cache=True)
-									try:
-										app.logger.info(f"Асинхронная обработка данных за {d_str} завершена успешно")
-									except Exception:
-										pass
-								except Exception as e:
-									try:
-										app.logger.error(f"Ошибка при построении сводки дня {d_str}: {e}")
-										import traceback
-										app.logger.error(traceback.format_exc())
-									except Exception:
-										pass
-							except Exception as e:
-								try:
-									app.logger.error(f"Ошибка при асинхронной обработке файла для {d_str}: {e}")
-									import traceback
-									app.logger.error(traceback.format_exc())
-								except Exception:
-									pass  # Игнорируем ошибки логирования при завершении
-						return process
-					
-					thread = threading.Thread(target=process_async_for_date(date_str), daemon=True)
-					thread.start()
+					_submit_day_processing(date_str)
 			
 			if is_api_request:
 				return jsonify({"success": True, "message": f"Обработано {processed_count} дат. Обработка продолжается в фоне."})
@@ -1859,135 +2579,9 @@ def analyze():
 			
 			# Для API запросов: сразу возвращаем успех, обработку делаем в фоне
 			if is_api_request:
-				# Запускаем обработку в фоновом потоке
-				def process_async():
-					try:
-						try:
-							app.logger.info(f"Начата асинхронная обработка данных за {date_str}")
-						except Exception:
-							pass  # Игнорируем ошибки логирования при завершении
-						# Ждем немного, чтобы файл точно сохранился
-						time.sleep(0.5)
-						# Обрабатываем данные
-						csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
-						result_df = None
-						# Если есть кэш, используем его
-						if os.path.exists(csv_cache):
-							try:
-								import json as _json
-								result_df = pd.read_csv(csv_cache)
-								with open(br_cache, 'r', encoding='utf-8') as f:
-									breaks_map = _json.load(f)
-								with open(hr_cache, 'r', encoding='utf-8') as f:
-									hourly_map = _json.load(f)
-								app.logger.info(f"Использован кэш для {date_str}")
-							except Exception as e:
-								app.logger.warning(f"Не удалось использовать кэш для {date_str}: {e}")
-								result_df = None
-						if result_df is None:
-							app.logger.info(f"Загрузка данных за {date_str} для обработки")
-							day_df = _load_day_df(date_str)
-							if day_df is None or day_df.empty:
-								app.logger.error(f"Не удалось загрузить данные за {date_str}")
-								return
-							app.logger.info(f"Обработка {len(day_df)} строк для {date_str}")
-							result_df = analyze_dataframe(day_df)
-							breaks_map = getattr(result_df, "breaks_by_approver", {})
-							hourly_map = getattr(result_df, "hourly_by_approver", {})
-							# Сохраняем кэш
-							try:
-								import json as _json
-								_ensure_day_dir(date_str)
-								result_df.to_csv(csv_cache, index=False, encoding='utf-8-sig')
-								serializable_breaks = {}
-								for approver, brs in (breaks_map or {}).items():
-									serializable_breaks[approver] = [{
-										"duration": str(b.get("duration")),
-										"bucket": b.get("bucket"),
-										"before": {k: ("" if v is None else str(v)) for k, v in b.get("before", {}).items()},
-										"after": {k: ("" if v is None else str(v)) for k, v in b.get("after", {}).items()},
-									} for b in brs]
-								breaks_sum = {ap: sum(_duration_to_seconds(x.get("duration")) for x in (brs or [])) for ap, brs in (breaks_map or {}).items()}
-								tmp_sum = f"{_day_breaks_sum_cache_path(date_str)}.tmp"
-								with open(tmp_sum, 'w', encoding='utf-8') as f:
-									_json.dump(breaks_sum, f, ensure_ascii=False)
-								os.replace(tmp_sum, _day_breaks_sum_cache_path(date_str))
-								tmp_path = f"{br_cache}.tmp"
-								with open(tmp_path, 'w', encoding='utf-8') as f:
-									_json.dump(serializable_breaks, f, ensure_ascii=False)
-								os.replace(tmp_path, br_cache)
-								with open(hr_cache, 'w', encoding='utf-8') as f:
-									_json.dump(hourly_map or {}, f, ensure_ascii=False)
-							except Exception as e:
-								app.logger.error(f"Ошибка при сохранении кэша: {e}")
-						# Генерируем и сохраняем кэш для faststat (приоритетная обработка)
-						# Это делается в первую очередь, чтобы /faststat_data мог сразу получить данные
-						try:
-							try:
-								app.logger.info(f"Генерация кэша faststat для {date_str} (приоритет)")
-							except Exception:
-								pass
-							faststat_result = _generate_faststat_tasks(date_str)
-							if "error" not in faststat_result:
-								faststat_cache_path = _day_faststat_cache_path(date_str)
-								_ensure_day_dir(date_str)
-								tmp_path = f"{faststat_cache_path}.tmp"
-								import json as _json
-								with open(tmp_path, 'w', encoding='utf-8') as f:
-									_json.dump(faststat_result, f, ensure_ascii=False, indent=2)
-								os.replace(tmp_path, faststat_cache_path)
-								# Удаляем флаг обработки, если он был создан
-								processing_flag = _day_faststat_processing_flag(date_str)
-								try:
-									if os.path.exists(processing_flag):
-										os.remove(processing_flag)
-								except Exception:
-									pass
-								try:
-									app.logger.info(f"Кэш faststat для {date_str} сохранен")
-								except Exception:
-									pass
-							else:
-								try:
-									app.logger.warning(f"Не удалось сгенерировать кэш faststat для {date_str}: {faststat_result.get('error')}")
-								except Exception:
-									pass
-						except Exception as e:
-							try:
-								app.logger.error(f"Ошибка при генерации кэша faststat для {date_str}: {e}")
-								import traceback
-								app.logger.error(traceback.format_exc())
-							except Exception:
-								pass
-						
-						# Обновляем сводку дня
-						try:
-							try:
-								app.logger.info(f"Построение сводки дня для {date_str}")
-							except Exception:
-								pass
-							_build_day_summary(date_str, preloaded_df=_load_day_df(date_str), write_cache=True)
-							try:
-								app.logger.info(f"Асинхронная обработка данных за {date_str} завершена успешно")
-							except Exception:
-								pass
-						except Exception as e:
-							try:
-								app.logger.error(f"Ошибка при построении сводки дня {date_str}: {e}")
-								import traceback
-								app.logger.error(traceback.format_exc())
-							except Exception:
-								pass
-					except Exception as e:
-						try:
-							app.logger.error(f"Ошибка при асинхронной обработке файла для {date_str}: {e}")
-							import traceback
-							app.logger.error(traceback.format_exc())
-						except Exception:
-							pass  # Игнорируем ошибки логирования при завершении
-				
-				thread = threading.Thread(target=process_async, daemon=True)
-				thread.start()
+				# Один разбор CSV дня на все артефакты; faststat — первым приоритетом,
+				# чтобы /faststat_data мог сразу получить данные
+				_submit_day_processing(date_str)
 				# Сразу возвращаем успешный ответ
 				return jsonify({"success": True, "message": "Файл успешно загружен. Обработка продолжается в фоне."})
 		
@@ -1995,7 +2589,6 @@ def analyze():
 		if is_api_request and not date_str:
 			def process_accumulated_async():
 				try:
-					time.sleep(0.5)
 					_append_to_accumulated(df)
 					acc_df = _load_accumulated_df()
 					analyze_dataframe(acc_df if acc_df is not None else df)
@@ -2004,66 +2597,34 @@ def analyze():
 						app.logger.error(f"Ошибка при асинхронной обработке накопленных данных: {e}")
 					except Exception:
 						pass  # Игнорируем ошибки логирования при завершении
-			thread = threading.Thread(target=process_accumulated_async, daemon=True)
-			thread.start()
+			# Без ключа: каждая загрузка дописывается в накопительный файл
+			_submit_task(None, TASK_PRIORITY_SUMMARY, process_accumulated_async)
 			return jsonify({"success": True, "message": "Файл успешно загружен. Обработка продолжается в фоне."})
 		
 		# Старая логика для HTML форм (сохраняем для обратной совместимости)
 		if date_str:
-			# Пытаемся использовать кэш анализа
-			csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
-			day_path = _day_path(date_str)
-			result_df = None
-			# Если есть кэш, используем его (пересчёт не нужен)
-			if os.path.exists(csv_cache):
-				try:
-					import json as _json
-					result_df = pd.read_csv(csv_cache)
-					with open(br_cache, 'r', encoding='utf-8') as f:
-						breaks_map = _json.load(f)
-					with open(hr_cache, 'r', encoding='utf-8') as f:
-						hourly_map = _json.load(f)
-				except Exception:
-					result_df = None
-			if result_df is None:
+			# Пытаемся использовать кэш анализа (пересчёт не нужен)
+			cached = _read_day_analysis_cache(date_str)
+			if cached is not None:
+				result_df, breaks_map, hourly_map = cached
+			else:
 				try:
-					day_df = _load_day_df(date_str)
-					result_df = analyze_dataframe(day_df if day_df is not None else df)
+					# Анализ дня через конвейер (он же сохраняет кэш и манифест)
+					loaded = _ensure_day_analysis(date_str)
+					if loaded is not None:
+						result_df, breaks_map, hourly_map = loaded
+					else:
+						# CSV дня недоступен — анализируем загруженный файл; номера строк
+						# в его перерывах указывают в загрузку, а не в CSV дня
+						result_df = analyze_dataframe(df)
+						breaks_map = _without_row_refs(getattr(result_df, "breaks_by_approver", {}))
+						hourly_map = getattr(result_df, "hourly_by_approver", {})
 				except MemoryError:
 					flash("Недостаточно памяти для анализа данных. Файл слишком большой.", "danger")
 					return redirect(url_for("index"))
 				except Exception as e:
 					flash(f"Ошибка при анализе данных: {str(e)}", "danger")
 					return redirect(url_for("index"))
-			breaks_map = getattr(result_df, "breaks_by_approver", {})
-			hourly_map = getattr(result_df, "hourly_by_approver", {})
-			# Сохраняем кэш
-			try:
-				import json as _json
-				_ensure_day_dir(date_str)
-				result_df.to_csv(csv_cache, index=False, encoding='utf-8-sig')
-				serializable_breaks = {}
-				for approver, brs in (breaks_map or {}).items():
-					serializable_breaks[approver] = [{
-						"duration": str(b.get("duration")),
-						"bucket": b.get("bucket"),
-						"before": {k: ("" if v is None else str(v)) for k, v in b.get("before", {}).items()},
-						"after": {k: ("" if v is None else str(v)) for k, v in b.get("after", {}).items()},
-					} for b in brs]
-				# Кэш суммы перерывов (маленький файл, нужен для страницы /showstats)
-				breaks_sum = {ap: sum(_duration_to_seconds(x.get("duration")) for x in (brs or [])) for ap, brs in (breaks_map or {}).items()}
-				tmp_sum = f"{_day_breaks_sum_cache_path(date_str)}.tmp"
-				with open(tmp_sum, 'w', encoding='utf-8') as f:
-					_json.dump(breaks_sum, f, ensure_ascii=False)
-				os.replace(tmp_sum, _day_breaks_sum_cache_path(date_str))
-				tmp_path = f"{br_cache}.tmp"
-				with open(tmp_path, 'w', encoding='utf-8') as f:
-					_json.dump(serializable_breaks, f, ensure_ascii=False)
-				os.replace(tmp_path, br_cache)
-				with open(hr_cache, 'w', encoding='utf-8') as f:
-					_json.dump(hourly_map or {}, f, ensure_ascii=False)
-			except Exception:
-				pass
 		else:
 			try:
 				_append_to_accumulated(df)
@@ -2076,77 +2637,40 @@ def analyze():
 				flash(f"Ошибка при анализе накопленных данных: {str(e)}", "danger")
 				return redirect(url_for("index"))
 		# Сохраним карты (перерывы и почасовая) ДО любых merge, чтобы не потерять атрибуты (могут быть из кэша)
-		breaks_map = locals().get('breaks_map', getattr(result_df, "breaks_by_approver", {}))
+		breaks_map = locals().get('breaks_map', _without_row_refs(getattr(result_df, "breaks_by_approver", {})))
 		hourly_map = locals().get('hourly_map', getattr(result_df, "hourly_by_approver", {}))
 		# Сразу обновляем краткую сводку дня, чтобы IT.json появлялся после загрузки
 		if date_str:
 			try:
-				_build_day_summary(date_str, preloaded_df=_load_day_df(date_str), write_cache=True)
+				_materialize_day(date_str, ["summary"])
 			except Exception:
 				pass
-			# Запускаем отправку скриншотов в фоновом потоке (не блокируем ответ)
+			# Отправка скриншотов — последним приоритетом в очереди фоновых задач (не блокируем ответ)
 			try:
 				def send_screenshots_async():
+					# Триггер для фронтенда - он сам сгенерирует и отправит скриншоты
+					# Здесь мы просто логируем, что отчет загружен
 					try:
-						# Небольшая задержка, чтобы данные успели сохраниться
-						time.sleep(2)
-						# Триггер для фронтенда - он сам сгенерирует и отправит скриншоты
-						# Здесь мы просто логируем, что отчет загружен
-						try:
-							app.logger.info(f"Отчет за {date_str} загружен. Скриншоты будут отправлены фронтендом.")
-						except Exception:
-							pass  # Игнорируем ошибки логирования при завершении
+						app.logger.info(f"Отчет за {date_str} загружен. Скриншоты будут отправлены фронтендом.")
 					except Exception:
-						pass  # Игнорируем все ошибки в daemon потоке при завершении
-				thread = threading.Thread(target=send_screenshots_async, daemon=True)
-				thread.start()
+						pass  # Игнорируем ошибки логирования при завершении
+				_submit_task(f"screenshots:{date_str}", TASK_PRIORITY_SCREENSHOTS, send_screenshots_async)
 			except Exception as e:
 				app.logger.error(f"Ошибка при запуске отправки скриншотов: {e}")
-		# Если есть файл сотрудников, присоединим компании (робастно)
-		emp_df = None
-		# Попытка взять из кэша; инвалидация по времени модификации
-		candidate_path = _get_employees_file_path()
-
-		if candidate_path is not None:
-			try:
-				mtime = os.path.getmtime(candidate_path)
-				cached_mtime = _EMPLOYEES_CACHE.get("mtime")
-				cached_mapping = _EMPLOYEES_CACHE.get("mapping")
-				if cached_mapping is not None and cached_mtime == mtime:
-					# Уже загружено
-					emp_df = cached_mapping  # type: ignore[assignment]
-				else:
-					# Читаем и кладём в кэш
-					emp_df = _try_read_employees(candidate_path)
-					_EMPLOYEES_CACHE["mtime"] = mtime
-					_EMPLOYEES_CACHE["mapping"] = emp_df
-			except MemoryError:
-				# Пропускаем загрузку сотрудников при нехватке памяти
-				pass
-			except Exception:
-				# Если не удалось, пробуем прочитать без кэша, но не падаем
-				try:
-					emp_df = _try_read_employees(candidate_path)
-				except:
-					pass  # Игнорируем ошибки загрузки сотрудников
-
-		if emp_df is not None:
-			mapping = _extract_employees_mapping(emp_df)
-			if mapping is not None and not mapping.empty:
-				# Нормализуем ключи и устраняем дубликаты в маппинге
-				mapping["Утвердил"] = mapping["Утвердил"].astype(str).str.strip()
-				mapping = mapping.dropna(subset=["Утвердил"]).drop_duplicates(subset=["Утвердил"], keep="first")
-				# Нормализуем ключи и в результатах
-				result_df["Утвердил"] = result_df["Утвердил"].astype(str).str.strip()
-				result_df = result_df.merge(mapping, on="Утвердил", how="left")
-				# Перенесём столбец Компания в начало
-				cols = ["Компания"] + [c for c in result_df.columns if c != "Компания"]
-				result_df = result_df[cols]
-				# Значение занятости по умолчанию — "ТСД"
-				if "Занятость" not in result_df.columns:
-					result_df["Занятость"] = "ТСД"
-				else:
-					result_df["Занятость"] = result_df["Занятость"].fillna("ТСД").replace({"": "ТСД"})
+		# Если есть файл сотрудников, присоединим компании (справочник кэшируется в процессе)
+		mapping = _employees_mapping()
+		if mapping is not None:
+			# Нормализуем ключи в результатах (в справочнике уже нормализованы)
+			result_df["Утвердил"] = result_df["Утвердил"].astype(str).str.strip()
+			result_df = result_df.merge(mapping, on="Утвердил", how="left")
+			# Перенесём столбец Компания в начало
+			cols = ["Компания"] + [c for c in result_df.columns if c != "Компания"]
+			result_df = result_df[cols]
+			# Значение занятости по умолчанию — "ТСД"
+			if "Занятость" not in result_df.columns:
+				result_df["Занятость"] = "ТСД"
+			else:
+				result_df["Занятость"] = result_df["Занятость"].fillna("ТСД").replace({"": "ТСД"})
 		# Преобразуем в список словарей для удобной отрисовки в шаблоне
 		records = result_df.to_dict(orient="records")
 		
@@ -2173,17 +2697,8 @@ def analyze():
 				out.append({k: _sanitize_value(v) for k, v in r.items()})
 			return out
 		records_json = json.dumps(_sanitize_records(records), ensure_ascii=False, allow_nan=False)
-		# Подготовим JSON со сведениями о перерывах, значения сериализуем в строки
-		def _stringify_record(rec: Dict[str, object]) -> Dict[str, str]:
-			return {k: ("" if v is None else str(v)) for k, v in rec.items()}
-		serializable_breaks = {}
-		for approver, brs in (breaks_map or {}).items():
-			serializable_breaks[approver] = [{
-				"duration": str(b.get("duration")),
-				"bucket": b.get("bucket"),
-				"before": _stringify_record(b.get("before", {})),
-				"after": _stringify_record(b.get("after", {})),
-			} for b in brs]
+		# Перерывы для страницы — только длительность, корзина и время (подробности: /breaks/<date>/<approver>)
+		serializable_breaks = _slim_breaks_map(breaks_map)
 		# JSON по часам (используем сохранённую карту до merge)
 		hourly_json = json.dumps(hourly_map or {}, ensure_ascii=False)
 		return render_template(
@@ -2225,24 +2740,42 @@ def clear_accumulator():
     try:
         date_str = request.form.get("date")
         if date_str:
-            # Удаляем целиком папку дня (новая структура), иначе — старые файлы
+            # Удаляем содержимое папки дня (новая структура), иначе — старые файлы
             day_dir = _day_dir(date_str)
             if os.path.isdir(day_dir):
                 import shutil as _sh
-                _sh.rmtree(day_dir, ignore_errors=True)
+                day_lock = _day_build_lock_path(date_str, "day")
+                # Под DAY.lock, как _append_to_day: удаление не пересечётся с дозаписью дня
+                # и чтением CSV сборкой. Сам DAY.lock не удаляем — ждущие его процессы
+                # должны получить блокировку на том же файле
+                with _file_lock(day_lock):
+                    for entry in os.listdir(day_dir):
+                        entry_path = os.path.join(day_dir, entry)
+                        if entry_path == day_lock:
+                            continue
+                        if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+                            _sh.rmtree(entry_path, ignore_errors=True)
+                        else:
+                            try:
+                                os.remove(entry_path)
+                            except OSError:
+                                pass
             else:
                 # Backward compat
                 for p in (
                     _day_path(date_str),
                     _day_summary_cache_path(date_str),
                     *_day_analysis_cache_paths(date_str),
-                    _day_faststat_cache_path(date_str),
+                    *_day_faststat_cache_paths(date_str),
                 ):
                     if os.path.exists(p):
                         try:
                             os.remove(p)
                         except Exception:
                             pass
+            _catalog_remove_day(date_str)
+            # Строки дня в таблице фактов — иначе /facts/* продолжат показывать удалённый день
+            replace_day_facts(date_str, [])
             flash(f"Данные и кэши за {date_str} очищены.", "success")
         else:
             if os.path.exists(ACCUMULATED_FILE_PATH):
@@ -2316,130 +2849,210 @@ def health_check():
             "timestamp": datetime.now().isoformat()
         }), 503
 
+# -------------------------------
+# Сжатие ответов
+# -------------------------------
+def _negotiate_encoding() -> Optional[str]:
+    """Выбирает кодирование по Accept-Encoding: br (если установлен brotli), затем gzip."""
+    accept = request.accept_encodings
+    if brotli is not None and accept.quality("br") > 0:
+        return "br"
+    if accept.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+def _add_vary_accept_encoding(resp) -> None:
+    if "accept-encoding" not in {v.strip().lower() for v in resp.headers.get("Vary", "").split(",")}:
+        resp.vary.add("Accept-Encoding")
+
+@app.after_request
+def _compress_response(resp):
+    """Сжимает крупные JSON/HTML-ответы, если клиент это поддерживает."""
+    try:
+        if (
+            resp.status_code != 200
+            or resp.direct_passthrough
+            or resp.is_streamed
+            or "Content-Encoding" in resp.headers
+            or resp.mimetype not in COMPRESS_MIMETYPES
+        ):
+            return resp
+        _add_vary_accept_encoding(resp)
+        body = resp.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return resp
+        encoding = _negotiate_encoding()
+        if encoding is None:
+            return resp
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=min(COMPRESS_LEVEL, 11))
+        else:
+            compressed = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+        resp.set_data(compressed)
+        resp.headers["Content-Encoding"] = encoding
+        etag, weak = resp.get_etag()
+        if etag and not weak:
+            resp.set_etag(etag, weak=True)
+    except Exception as e:
+        app.logger.warning(f"Не удалось сжать ответ: {e}")
+    return resp
+
+
+# -------------------------------
+# Условные GET (ETag / Last-Modified)
+# -------------------------------
+def _etag_salt() -> str:
+    """Всё, что влияет на ответы, кроме файлов данных: пороги перерывов и простоев,
+    формат кэша и версии алгоритмов стадий (ARTIFACT_VERSIONS объявлен ниже)."""
+    return repr((
+        BREAK_MIN_MINUTES, ACTIVE_GAP_CAP_MINUTES, BREAK_BUCKETS_MINUTES, FASTSTAT_CACHE_GZIP,
+        IDLE_MIN_SECONDS, tuple(sorted(ARTIFACT_VERSIONS.items())),
+    ))
+
+
+def _stat_version(paths: List[Optional[str]]) -> Tuple[List[Any], float]:
+    """(mtime_ns, size) каждого файла и самый поздний mtime — без чтения содержимого."""
+    parts: List[Any] = []
+    last_modified = 0.0
+    for path in paths:
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        parts.append((path, st.st_mtime_ns, st.st_size) if st else (path, None))
+        if st:
+            last_modified = max(last_modified, st.st_mtime)
+    return parts, last_modified
+
+def _day_data_version(date_str: str) -> Tuple[List[Any], float]:
+    """Версия данных дня: CSV дня и справочник сотрудников."""
+    return _stat_version([_day_path(date_str), _get_employees_file_path()])
+
+def _days_list_version() -> Tuple[List[Any], float]:
+    """Версия списка дней — версия файла каталога дней (он переписывается при любом изменении)."""
+    _day_catalog()
+    return _stat_version([DAY_CATALOG_PATH])
+
+def _conditional_get(version_fn):
+    """Декоратор: ETag/Last-Modified из версии данных, 304 на совпадающий If-None-Match.
+
+    version_fn получает аргументы view и возвращает (части версии, последний mtime).
+    ETag учитывает путь, параметры запроса и Accept, поэтому разные выборки
+    кэшируются клиентом раздельно. Заголовки ставятся только на ответы 200.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                parts, last_modified = version_fn(*args, **kwargs)
+            except Exception:
+                return view(*args, **kwargs)
+            key = repr((
+                request.path,
+                sorted(request.args.items(multi=True)),
+                request.headers.get("Accept", ""),
+                parts,
+                _etag_salt(),
+            ))
+            etag = hashlib.sha1(key.encode("utf-8")).hexdigest()[:24]
+            not_modified = request.if_none_match.contains_weak(etag)
+            if not request.if_none_match and request.if_modified_since and last_modified:
+                not_modified = int(last_modified) <= request.if_modified_since.timestamp()
+            if not_modified:
+                resp = app.response_class(status=304)
+            else:
+                resp = app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            # Сжатое представление отличается побайтно — такой ETag слабый
+            resp.set_etag(etag, weak=bool(resp.headers.get("Content-Encoding")))
+            if last_modified:
+                resp.last_modified = datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+        return wrapper
+    return decorator
+
+
 @app.route("/days", methods=["GET"]) 
+@_conditional_get(_days_list_version)
 def list_days():
-    """Возвращает список дат (YYYY-MM-DD), для которых есть данные."""
+    """Возвращает список дат (YYYY-MM-DD), для которых есть данные.
+
+    ?meta=1 — дополнительно сведения каталога по каждому дню (строки, размер,
+    время загрузки, версия данных, готовность артефактов).
+    """
     try:
         # Убеждаемся, что директория существует
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR, exist_ok=True)
             return jsonify({"days": []})  # Возвращаем пустой список, если директория только что создана
-        
-        days: List[str] = []
-        # New structure: directories with date names and a CSV inside
-        for entry in os.listdir(DATA_DIR):
-            day_dir = os.path.join(DATA_DIR, entry)
-            if os.path.isdir(day_dir) and os.path.exists(os.path.join(day_dir, f"{entry}.csv")):
-                days.append(entry)
-        # Backward compatibility: old flat files
-        for fname in os.listdir(DATA_DIR):
-            if fname.endswith('.csv') and len(fname) == 14:  # YYYY-MM-DD.csv
-                candidate = fname[:-4]
-                if candidate not in days:
-                    days.append(candidate)
-        days.sort()
+
+        with _catalog_guard():
+            catalog = _day_catalog()
+            days = sorted(catalog)
+            if request.args.get("meta", "").strip().lower() in ("1", "true", "yes"):
+                return jsonify({"days": days, "meta": {d: catalog[d] for d in days}})
         return jsonify({"days": days})
     except Exception as e:
         app.logger.error(f"Error listing days: {e}", exc_info=True)
         return jsonify({"days": [], "error": str(e)}), 500
 
 
+def _page_records(result_df: pd.DataFrame) -> List[Dict[str, object]]:
+    """Строки отчёта для results.html: компания первой колонкой, занятость по умолчанию "ТСД"."""
+    mapping = _employees_mapping()
+    if mapping is not None:
+        result_df = result_df.copy()
+        result_df["Утвердил"] = result_df["Утвердил"].astype(str).str.strip()
+        result_df = result_df.merge(mapping, on="Утвердил", how="left")
+        cols = ["Компания"] + [c for c in result_df.columns if c != "Компания"]
+        result_df = result_df[cols]
+        if "Занятость" not in result_df.columns:
+            result_df["Занятость"] = "ТСД"
+        else:
+            result_df["Занятость"] = result_df["Занятость"].fillna("ТСД").replace({"": "ТСД"})
+    return result_df.to_dict(orient="records")
+
+def _top_leaders(records: List[Dict[str, object]]) -> List[str]:
+    """Топ-3 лидеров дня по количеству задач (СЗ) для кубков, при равенстве — по скорости."""
+    sorted_for_top = sorted(records, key=lambda r: (
+        -float(r.get('СЗ', 0) or 0),
+        -float(r.get('скорость', 0) or 0)
+    ))
+    return [r.get('Утвердил', '') for r in sorted_for_top[:3] if r.get('Утвердил')]
+
+
 @app.route("/analyze_day/<date_str>", methods=["GET"]) 
 def analyze_day(date_str: str):
     """Загрузка и анализ данных за конкретный день."""
+    # Общий для анализа и среза компании предел ожидания чужой сборки
+    deadline = time.monotonic() + DAY_BUILD_WAIT_SECONDS
     try:
         # 1) Если есть свежий кэш — отдать его
-        csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
-        day_path = _day_path(date_str)
         # Используем кэш, если он существует (пересчёт не требуется, пока данные дня не перезаписаны)
-        if os.path.exists(csv_cache):
-            try:
-                import json as _json
-                result_df = pd.read_csv(csv_cache)
-                try:
-                    with open(br_cache, 'r', encoding='utf-8') as f:
-                        breaks_map = _json.load(f)
-                except Exception:
-                    breaks_map = {}
-                with open(hr_cache, 'r', encoding='utf-8') as f:
-                    hourly_map = _json.load(f)
-                # Переход к рендеру ниже
-            except Exception:
-                result_df = None
-        else:
-            result_df = None
-
-        # 2) Если кэша нет — считать и сохранить
-        if result_df is None:
-            df = _load_day_df(date_str)
-            if df is None:
+        cached = _read_day_analysis_cache(date_str)
+        if cached is None:
+            # 2) Если кэша нет — считать и сохранить
+            cached = _ensure_day_analysis(date_str, wait=_wait_left(deadline))
+            if cached is None:
                 flash("Данных за выбранную дату нет.", "warning")
                 return redirect(url_for("index"))
-            result_df = analyze_dataframe(df)
-            breaks_map = getattr(result_df, "breaks_by_approver", {})
-            hourly_map = getattr(result_df, "hourly_by_approver", {})
-            # Сохраняем кэш
-            try:
-                import json as _json
-                _ensure_day_dir(date_str)
-                result_df.to_csv(csv_cache, index=False, encoding='utf-8-sig')
-                # Сериализуем перерывы в безопасный JSON и пишем атомарно
-                serializable_breaks = {}
-                for approver, brs in (breaks_map or {}).items():
-                    serializable_breaks[approver] = [{
-                        "duration": str(b.get("duration")),
-                        "bucket": b.get("bucket"),
-                        "before": {k: ("" if v is None else str(v)) for k, v in b.get("before", {}).items()},
-                        "after": {k: ("" if v is None else str(v)) for k, v in b.get("after", {}).items()},
-                    } for b in brs]
-                # Кэш суммы перерывов (маленький файл, нужен для страницы /showstats)
-                breaks_sum = {ap: sum(_duration_to_seconds(x.get("duration")) for x in (brs or [])) for ap, brs in (breaks_map or {}).items()}
-                tmp_sum = f"{_day_breaks_sum_cache_path(date_str)}.tmp"
-                with open(tmp_sum, 'w', encoding='utf-8') as f:
-                    _json.dump(breaks_sum, f, ensure_ascii=False)
-                os.replace(tmp_sum, _day_breaks_sum_cache_path(date_str))
-                tmp_path = f"{br_cache}.tmp"
-                with open(tmp_path, 'w', encoding='utf-8') as f:
-                    _json.dump(serializable_breaks, f, ensure_ascii=False)
-                os.replace(tmp_path, br_cache)
-                with open(hr_cache, 'w', encoding='utf-8') as f:
-                    _json.dump(hourly_map or {}, f, ensure_ascii=False)
-            except Exception:
-                pass
-        # Маппинг сотрудников
-        emp_df = None
-        candidate_path = _get_employees_file_path()
-        if candidate_path:
-            emp_df = _try_read_employees(candidate_path)
-        if emp_df is not None:
-            mapping = _extract_employees_mapping(emp_df)
-            if mapping is not None and not mapping.empty:
-                mapping["Утвердил"] = mapping["Утвердил"].astype(str).str.strip()
-                mapping = mapping.dropna(subset=["Утвердил"]).drop_duplicates(subset=["Утвердил"], keep="first")
-                result_df["Утвердил"] = result_df["Утвердил"].astype(str).str.strip()
-                result_df = result_df.merge(mapping, on="Утвердил", how="left")
-                cols = ["Компания"] + [c for c in result_df.columns if c != "Компания"]
-                result_df = result_df[cols]
-                if "Занятость" not in result_df.columns:
-                    result_df["Занятость"] = "ТСД"
-                else:
-                    result_df["Занятость"] = result_df["Занятость"].fillna("ТСД").replace({"": "ТСД"})
-
-        records = result_df.to_dict(orient="records")
-        
-        # Вычисляем топ-3 лидеров по количеству задач (СЗ) для кубков
-        # Сортируем по СЗ (задачам), при равенстве - по скорости
-        sorted_for_top = sorted(records, key=lambda r: (
-            -float(r.get('СЗ', 0) or 0),
-            -float(r.get('скорость', 0) or 0)
-        ))
-        top_leaders = [r.get('Утвердил', '') for r in sorted_for_top[:3] if r.get('Утвердил')]
-        
-        # Фильтрация по компании, если передан параметр company_name
+        result_df, breaks_map, hourly_map = cached
         company_filter = request.args.get("company_name", "").strip()
+        view = _company_view(date_str, company_filter, wait=_wait_left(deadline)) if company_filter else None
+        if view is not None:
+            # Готовый срез компании: строки отчёта и кубки дня без merge всего дня
+            records = view["records"]
+            top_leaders = view["top_leaders"]
+        else:
+            records = _page_records(result_df)
+            top_leaders = _top_leaders(records)
+            # Фильтрация по компании, если передан параметр company_name
+            if company_filter:
+                # Фильтруем записи по компании (преобразуем в строку перед сравнением)
+                records = [r for r in records if str(r.get("Компания") or "").strip() == company_filter]
         if company_filter:
-            # Фильтруем записи по компании (преобразуем в строку перед сравнением)
-            records = [r for r in records if str(r.get("Компания") or "").strip() == company_filter]
             # Фильтруем breaks_map - оставляем только утвердителей из отфильтрованных записей
             approvers_in_company = {r.get("Утвердил") for r in records}
             breaks_map = {k: v for k, v in (breaks_map or {}).items() if k in approvers_in_company}
@@ -2459,16 +3072,8 @@ def analyze_day(date_str: str):
                 out.append({k: _sanitize_value(v) for k, v in r.items()})
             return out
         records_json = json.dumps(_sanitize_records(records), ensure_ascii=False, allow_nan=False)
-        def _stringify_record(rec: Dict[str, object]) -> Dict[str, str]:
-            return {k: ("" if v is None else str(v)) for k, v in rec.items()}
-        serializable_breaks = {}
-        for approver, brs in (breaks_map or {}).items():
-            serializable_breaks[approver] = [{
-                "duration": str(b.get("duration")),
-                "bucket": b.get("bucket"),
-                "before": _stringify_record(b.get("before", {})),
-                "after": _stringify_record(b.get("after", {})),
-            } for b in brs]
+        # Перерывы для страницы — только длительность, корзина и время (подробности: /breaks/<date>/<approver>)
+        serializable_breaks = _slim_breaks_map(breaks_map)
         hourly_json = json.dumps(hourly_map or {}, ensure_ascii=False)
         return render_template("results.html", 
                              records=records, 
@@ -2477,35 +3082,25 @@ def analyze_day(date_str: str):
                              hourly_json=hourly_json,
                              top_leaders=top_leaders,
                              top_leaders_json=json.dumps(top_leaders, ensure_ascii=False))
+    except DayBuildPending:
+        # Анализ дня строит другой запрос — страница обновится сама, когда он закончит
+        return render_template("processing.html", date_str=date_str, retry_after=3), 202, {"Retry-After": "3"}
     except Exception as e:
         flash(f"Ошибка анализа дня: {e}", "danger")
         return redirect(url_for("index"))
 
 
 @app.route("/day_summary/<date_str>", methods=["GET"]) 
+@_conditional_get(_day_data_version)
 def day_summary(date_str: str):
     """Краткая сводка по дню для календаря (JSON)."""
     try:
         company_filter = request.args.get("company_name", "").strip()
-        # 1) Пытаемся вернуть кэш, если актуален, только для нефильтрованных запросов
-        if not company_filter:
-            try:
-                cache_path = _day_summary_cache_path(date_str)
-                day_path = _day_path(date_str)
-                if os.path.exists(cache_path) and os.path.exists(day_path):
-                    if os.path.getmtime(cache_path) >= os.path.getmtime(day_path):
-                        with open(cache_path, "r", encoding="utf-8") as f:
-                            import json as _json
-                            return _json.load(f)
-            except Exception:
-                pass
-
-        result = _build_day_summary(
-            date_str,
-            company_name=company_filter or None,
-            write_cache=(company_filter == ""),
-        )
-        return result
+        # Без фильтра — сводка дня из конвейера (IT.json, пока его входы не менялись),
+        # с фильтром — готовый срез компании
+        return _day_summary_for(date_str, company_filter, wait=DAY_BUILD_WAIT_SECONDS)
+    except DayBuildPending as e:
+        return _day_build_pending_response(e)
     except ValueError as ve:
         error_msg = str(ve)
         app.logger.error(f"ValueError in day_summary for {date_str}: {error_msg}")
@@ -2517,131 +3112,359 @@ def day_summary(date_str: str):
         app.logger.error(f"Exception in day_summary for {date_str}: {error_msg}", exc_info=True)
         return {"error": error_msg}, 500
 
+# Фоновые задачи (обработка загрузок, faststat, сводки календаря, скриншоты) —
+# общая очередь с приоритетами и фиксированным числом потоков, см. _submit_task
+_TASK_QUEUE: "queue.PriorityQueue[Tuple[int, int, str]]" = queue.PriorityQueue()
+_TASKS: Dict[str, Dict[str, Any]] = {}  # ключ -> {"future", "priority", "fn", "args", "state", ...}
+_TASK_WORKERS: List[threading.Thread] = []
+_TASK_SEQ = itertools.count()
+_TASKS_LOCK = threading.Lock()
+
+
+def _task_worker() -> None:
+    while True:
+        priority, _, key = _TASK_QUEUE.get()
+        with _TASKS_LOCK:
+            task = _TASKS.get(key)
+            # Устаревшая запись очереди: задачу уже подняли в приоритете или выполнили
+            if task is None or task["state"] != "queued" or task["priority"] != priority:
+                continue
+            task["state"] = "running"
+            task["started_at"] = time.time()
+        fut = task["future"]
+        try:
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(task["fn"](*task["args"]))
+                except Exception as e:
+                    fut.set_exception(e)
+                    try:
+                        app.logger.error(f"Ошибка фоновой задачи {key}: {e}", exc_info=True)
+                    except Exception:
+                        pass
+        finally:
+            with _TASKS_LOCK:
+                if _TASKS.get(key) is task:
+                    del _TASKS[key]
+
+def _submit_task(key: Optional[str], priority: int, fn, *args) -> Future:
+    """Ставит fn(*args) в фоновую очередь; меньший priority выполняется раньше.
+
+    Пока задача с тем же key ждёт в очереди или выполняется, повторная постановка
+    возвращает её Future (ожидающую задачу при этом можно поднять в приоритете).
+    key=None — задача без дедупликации. Потоки (BACKGROUND_WORKERS) стартуют при
+    первой постановке.
+    """
+    with _TASKS_LOCK:
+        _TASK_WORKERS[:] = [t for t in _TASK_WORKERS if t.is_alive()]
+        while len(_TASK_WORKERS) < max(1, BACKGROUND_WORKERS):
+            worker = threading.Thread(target=_task_worker, name=f"bg-task-{len(_TASK_WORKERS)}", daemon=True)
+            worker.start()
+            _TASK_WORKERS.append(worker)
+        if key is None:
+            key = f"task:{next(_TASK_SEQ)}"
+        task = _TASKS.get(key)
+        if task is not None:
+            if task["state"] == "queued" and priority < task["priority"]:
+                task["priority"] = priority
+                _TASK_QUEUE.put((priority, next(_TASK_SEQ), key))
+            return task["future"]
+        task = {
+            "future": Future(),
+            "priority": priority,
+            "fn": fn,
+            "args": args,
+            "state": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+        }
+        _TASKS[key] = task
+        _TASK_QUEUE.put((priority, next(_TASK_SEQ), key))
+        return task["future"]
+
+def _task_pending(key: str) -> bool:
+    """Задача с этим ключом ждёт в очереди или выполняется."""
+    with _TASKS_LOCK:
+        return key in _TASKS
+
+def _day_task_key(kind: str, date_str: str) -> str:
+    """Ключ задачи по дню с версией CSV: после дозагрузки дня задача ставится заново."""
+    return f"{kind}:{date_str}:{_day_input_versions(date_str)['day']}"
+
+def _run_day_task(date_str: str, stages: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Фоновая материализация дня (после загрузки или по запросу /faststat_data)."""
+    what = ", ".join(stages) if stages else "все артефакты"
+    try:
+        app.logger.info(f"Начата фоновая обработка данных за {date_str} ({what})")
+    except Exception:
+        pass
+    res = _materialize_day(date_str, stages)
+    try:
+        if res["errors"]:
+            app.logger.error(f"Ошибки при обработке данных за {date_str}: {res['errors']}")
+        else:
+            app.logger.info(f"Фоновая обработка данных за {date_str} ({what}) завершена")
+    except Exception:
+        pass
+    return res
+
+def _submit_day_processing(date_str: str) -> None:
+    """После загрузки дня: faststat — первым приоритетом, остальные артефакты — следом."""
+    _submit_task(_day_task_key("faststat", date_str), TASK_PRIORITY_FASTSTAT, _run_day_task, date_str, ["faststat"])
+    _submit_task(_day_task_key("day", date_str), TASK_PRIORITY_SUMMARY, _run_day_task, date_str)
+
+def _recover_stale_task_markers() -> int:
+    """Удаляет флаги FASTSTAT_PROCESSING.flag, оставшиеся от прерванных процессов.
+
+    Ход сборки теперь определяется очередью задач и блокировками стадий (flock
+    снимается вместе с процессом), так что флаг на диске всегда устаревший.
+    """
+    removed = 0
+    try:
+        names = os.listdir(DATA_DIR)
+    except OSError:
+        return 0
+    for name in names:
+        if not _DAY_NAME_RE.match(name):
+            continue
+        flag = _day_faststat_processing_flag(name)
+        try:
+            os.remove(flag)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+@app.route("/tasks", methods=["GET"])
+def tasks_status():
+    """JSON: фоновые задачи в очереди и в работе."""
+    with _TASKS_LOCK:
+        tasks = [
+            {"key": key, "state": t["state"], "priority": t["priority"],
+             "submitted_at": t["submitted_at"], "started_at": t["started_at"]}
+            for key, t in _TASKS.items()
+        ]
+        workers = sum(1 for t in _TASK_WORKERS if t.is_alive())
+    tasks.sort(key=lambda t: (t["state"] != "running", t["priority"], t["submitted_at"]))
+    return {"workers": workers, "max_workers": BACKGROUND_WORKERS, "tasks": tasks}
+
+
+if not _SPAWNED_CHILD:
+    try:
+        _stale_flags = _recover_stale_task_markers()
+        if _stale_flags:
+            print(f"INFO: Удалено устаревших флагов обработки faststat: {_stale_flags}")
+    except Exception as e:
+        print(f"WARNING: Не удалось очистить флаги обработки faststat: {e}")
+
+
+def _day_summary_for(date_str: str, company: str, wait: Optional[float] = None) -> Dict[str, object]:
+    """Сводка дня (по всей смене или по компании) через конвейер материализации."""
+    if not company:
+        res = _materialize_day(date_str, ["summary"], wait=wait)
+        if "raw" in res["errors"]:
+            raise ValueError("no_data")
+        if "summary" in res["errors"]:
+            raise RuntimeError(res["errors"]["summary"])
+        return res["values"]["summary"]
+    view = _company_view(date_str, company, wait=wait)
+    if view is not None:
+        return view["summary"]
+    return _build_day_summary(date_str, company_name=company, write_cache=False)
+
+def _day_summary_ready(date_str: str, company: str) -> bool:
+    return _artifact_ready(date_str, "company_views" if company else "summary")
+
+def _submit_day_summary(date_str: str, company: str) -> Future:
+    return _submit_task(f"summary:{date_str}:{company}", TASK_PRIORITY_SUMMARY, _day_summary_for, date_str, company)
+
+
+@app.route("/day_summaries", methods=["GET"])
+def day_summaries():
+    """Сводки за диапазон дней одним ответом (для календаря).
+
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD[&company_name=] — берутся дни из каталога в диапазоне.
+    Готовые сводки читаются из кэша, недостающие считаются в очереди фоновых задач;
+    дни, не успевшие посчитаться за DAY_SUMMARIES_WAIT_SECONDS, перечислены в "pending"
+    (их расчёт продолжается — повторите запрос позже).
+    """
+    date_from = request.args.get("from", "").strip()
+    date_to = request.args.get("to", "").strip()
+    company_filter = request.args.get("company_name", "").strip()
+    try:
+        start = datetime.strptime(date_from, "%Y-%m-%d")
+        end = datetime.strptime(date_to, "%Y-%m-%d")
+    except ValueError:
+        return {"error": "bad_request", "message": "from и to должны быть датами YYYY-MM-DD"}, 400
+    if end < start:
+        return {"error": "bad_request", "message": "to раньше from"}, 400
+    if (end - start).days + 1 > DAY_SUMMARIES_MAX_DAYS:
+        return {"error": "bad_request", "message": f"Диапазон больше {DAY_SUMMARIES_MAX_DAYS} дней"}, 400
+
+    days = [d for d in _catalog_days() if date_from <= d <= date_to]
+    summaries: Dict[str, object] = {}
+    errors: Dict[str, str] = {}
+    futures: Dict[str, Future] = {}
+    for d in days:
+        if _day_summary_ready(d, company_filter):
+            try:
+                summaries[d] = _day_summary_for(d, company_filter)
+                continue
+            except Exception:
+                pass
+        futures[d] = _submit_day_summary(d, company_filter)
+
+    if futures:
+        _wait_futures(list(futures.values()), timeout=DAY_SUMMARIES_WAIT_SECONDS)
+    pending: List[str] = []
+    for d, fut in futures.items():
+        if not fut.done():
+            pending.append(d)
+            continue
+        try:
+            summaries[d] = fut.result()
+        except Exception as e:
+            errors[d] = str(e)
+    return {
+        "from": date_from,
+        "to": date_to,
+        "summaries": {d: summaries[d] for d in sorted(summaries)},
+        "pending": pending,
+        "errors": errors,
+    }
+
+@app.route("/breaks/<date_str>/<approver>", methods=["GET"])
+@_conditional_get(lambda date_str, approver: _day_data_version(date_str))
+def breaks_detail(date_str: str, approver: str):
+    """JSON: перерывы сотрудника за день вместе с полными строками до и после перерыва.
+
+    ?bucket=15|30|45 оставляет только перерывы указанной корзины.
+    """
+    approver = approver.strip()
+    bucket_raw = request.args.get("bucket", "").strip()
+    try:
+        bucket = int(bucket_raw) if bucket_raw else None
+    except ValueError:
+        return {"error": "bad_request", "message": "bucket должен быть целым числом"}, 400
+    try:
+        cached = _read_day_analysis_cache(date_str)
+        breaks_map = cached[1] if cached is not None else None
+        # Кэш, записанный до появления ссылок на строки, пересчитываем один раз
+        if breaks_map is None or any("before_row" not in b for brs in breaks_map.values() for b in brs):
+            res = _materialize_day(date_str, ["analysis"], force=cached is not None)
+            if "raw" in res["errors"]:
+                return {"error": "no_data", "message": "Нет данных за указанную дату", "breaks": []}, 404
+            if "analysis" in res["errors"]:
+                return {"error": res["errors"]["analysis"], "breaks": []}, 500
+            cached = _read_day_analysis_cache(date_str)
+            breaks_map = cached[1] if cached is not None else {}
+        breaks = list(breaks_map.get(approver) or [])
+        if bucket is not None:
+            breaks = [b for b in breaks if b.get("bucket") == bucket]
+        durations = [b["duration"] for b in _slim_breaks_map({approver: breaks})[approver]]
+        breaks = _resolve_break_rows(date_str, [dict(b, duration=d) for b, d in zip(breaks, durations)])
+        return {"date": date_str, "approver": approver, "breaks": breaks, "total": len(breaks)}
+    except Exception as e:
+        app.logger.error(f"Ошибка при получении перерывов {approver} за {date_str}: {e}", exc_info=True)
+        return {"error": str(e), "breaks": []}, 500
+
+
+def _read_breaks_sum(date_str: str) -> Dict[str, int]:
+    """Сумма перерывов по сотруднику: маленький кэш, иначе восстановление из ANL_breaks.json."""
+    _, br_cache, _ = _day_analysis_cache_paths(date_str)
+    sum_cache = _day_breaks_sum_cache_path(date_str)
+    breaks_sum_map: Dict[str, int] = {}
+    if os.path.exists(sum_cache):
+        try:
+            import json as _json
+            with open(sum_cache, "r", encoding="utf-8") as f:
+                loaded = _json.load(f) or {}
+            breaks_sum_map = {str(k): int(v or 0) for k, v in loaded.items()}
+        except Exception:
+            breaks_sum_map = {}
+    if not breaks_sum_map and os.path.exists(br_cache):
+        # единоразовый фолбэк: большой файл, но сразу пересохраним маленький
+        try:
+            import json as _json
+            with open(br_cache, "r", encoding="utf-8") as f:
+                big = _json.load(f) or {}
+            breaks_sum_map = {ap: sum(_break_seconds(x) for x in (brs or [])) for ap, brs in big.items()}
+            _atomic_write_json(sum_cache, breaks_sum_map)
+        except Exception:
+            breaks_sum_map = {}
+    return breaks_sum_map
+
+def _employee_stats_rows(result_df: pd.DataFrame, breaks_sum_map: Dict[str, int]) -> List[Dict[str, object]]:
+    """Строки /employee_stats из результата анализа (с колонкой Компания после merge)."""
+    employees = []
+    for r in result_df.to_dict(orient="records"):
+        emp_id = str(r.get("Утвердил") or "").strip()
+        if not emp_id:
+            continue
+        sec = int(breaks_sum_map.get(emp_id, 0) or 0)
+        employees.append({
+            "id": emp_id,
+            "name": emp_id,
+            "company": (str(r.get("Компания") or "").strip() if "Компания" in r else ""),
+            "tasks": int(float(r.get("СЗ") or 0)),
+            "weight": float(r.get("Вес") or 0),
+            "qty": int(float(r.get("Шт") or 0)),
+            "speed": float(r.get("скорость") or 0),
+            "breaks_total_seconds": sec,
+            "breaks_total": _format_hhmm_from_seconds(sec),
+        })
+
+    # сортировка: сначала по задачам, потом по скорости
+    employees.sort(key=lambda x: (x.get("tasks", 0), x.get("speed", 0.0)), reverse=True)
+    return employees
+
+
 @app.route("/employee_stats/<date_str>", methods=["GET"])
+@_conditional_get(_day_data_version)
 def employee_stats(date_str: str):
     """JSON: статистика по каждому сотруднику за день (для /showstats)."""
+    deadline = time.monotonic() + DAY_BUILD_WAIT_SECONDS
     try:
         company_filter = request.args.get("company_name", "").strip()
-
-        csv_cache, br_cache, hr_cache = _day_analysis_cache_paths(date_str)
-        sum_cache = _day_breaks_sum_cache_path(date_str)
+        if company_filter:
+            view = _company_view(date_str, company_filter, wait=_wait_left(deadline))
+            if view is not None:
+                return {"date": date_str, "employees": view["employees"]}
 
         result_df = None
         breaks_sum_map: Dict[str, int] = {}
 
-        # 1) Пробуем кэш ANL.csv
-        if os.path.exists(csv_cache):
-            try:
-                result_df = pd.read_csv(csv_cache)
-            except Exception:
-                result_df = None
+        # 1) Пробуем кэш ANL.csv (через общий LRU результатов анализа)
+        cached = _read_day_analysis_cache(date_str)
+        if cached is not None:
+            result_df = cached[0]
 
         # 2) Если кэша нет — считаем и сохраняем (как в analyze_day)
         if result_df is None:
-            df = _load_day_df(date_str)
-            if df is None:
+            loaded = _ensure_day_analysis(date_str, wait=_wait_left(deadline))
+            if loaded is None:
                 return {"error": "no_data"}, 404
-            result_df = analyze_dataframe(df)
-            breaks_map = getattr(result_df, "breaks_by_approver", {}) or {}
-            hourly_map = getattr(result_df, "hourly_by_approver", {}) or {}
-
-            # сохраняем кэш (включая breaks_sum)
-            try:
-                import json as _json
-                _ensure_day_dir(date_str)
-                result_df.to_csv(csv_cache, index=False, encoding='utf-8-sig')
-
-                breaks_sum_map = {ap: sum(_duration_to_seconds(x.get("duration")) for x in (brs or [])) for ap, brs in breaks_map.items()}
-                tmp_sum = f"{sum_cache}.tmp"
-                with open(tmp_sum, 'w', encoding='utf-8') as f:
-                    _json.dump(breaks_sum_map, f, ensure_ascii=False)
-                os.replace(tmp_sum, sum_cache)
-
-                serializable_breaks = {}
-                for approver, brs in breaks_map.items():
-                    serializable_breaks[approver] = [{
-                        "duration": str(b.get("duration")),
-                        "bucket": b.get("bucket"),
-                        "before": {k: ("" if v is None else str(v)) for k, v in b.get("before", {}).items()},
-                        "after": {k: ("" if v is None else str(v)) for k, v in b.get("after", {}).items()},
-                    } for b in brs]
-                tmp_path = f"{br_cache}.tmp"
-                with open(tmp_path, 'w', encoding='utf-8') as f:
-                    _json.dump(serializable_breaks, f, ensure_ascii=False)
-                os.replace(tmp_path, br_cache)
-                with open(hr_cache, 'w', encoding='utf-8') as f:
-                    _json.dump(hourly_map or {}, f, ensure_ascii=False)
-            except Exception:
-                pass
+            result_df = loaded[0]
 
         # 3) Маппинг сотрудников (Компания)
-        emp_df = None
-        candidate_path = _get_employees_file_path()
-        if candidate_path:
-            try:
-                emp_df = _try_read_employees(candidate_path)
-            except Exception:
-                emp_df = None
-        if emp_df is not None:
-            mapping = _extract_employees_mapping(emp_df)
-            if mapping is not None and not mapping.empty:
-                mapping["Утвердил"] = mapping["Утвердил"].astype(str).str.strip()
-                mapping = mapping.dropna(subset=["Утвердил"]).drop_duplicates(subset=["Утвердил"], keep="first")
-                result_df["Утвердил"] = result_df["Утвердил"].astype(str).str.strip()
-                result_df = result_df.merge(mapping, on="Утвердил", how="left")
+        mapping = _employees_mapping()
+        if mapping is not None:
+            result_df["Утвердил"] = result_df["Утвердил"].astype(str).str.strip()
+            result_df = result_df.merge(mapping, on="Утвердил", how="left")
 
         # 4) Фильтр по компании — только если передан
         if company_filter and "Компания" in result_df.columns:
             result_df["Компания"] = result_df["Компания"].astype(str).str.strip()
             result_df = result_df[result_df["Компания"] == company_filter].copy()
 
-        # 5) Сумма перерывов: читаем маленький кэш; если его нет — пробуем восстановить из большого
-        if not breaks_sum_map and os.path.exists(sum_cache):
-            try:
-                import json as _json
-                with open(sum_cache, "r", encoding="utf-8") as f:
-                    loaded = _json.load(f) or {}
-                breaks_sum_map = {str(k): int(v or 0) for k, v in loaded.items()}
-            except Exception:
-                breaks_sum_map = {}
-        if not breaks_sum_map and os.path.exists(br_cache):
-            # единоразовый фолбэк: большой файл, но сразу пересохраним маленький
-            try:
-                import json as _json
-                with open(br_cache, "r", encoding="utf-8") as f:
-                    big = _json.load(f) or {}
-                breaks_sum_map = {ap: sum(_duration_to_seconds(x.get("duration")) for x in (brs or [])) for ap, brs in big.items()}
-                tmp_sum = f"{sum_cache}.tmp"
-                with open(tmp_sum, 'w', encoding='utf-8') as f:
-                    _json.dump(breaks_sum_map, f, ensure_ascii=False)
-                os.replace(tmp_sum, sum_cache)
-            except Exception:
-                breaks_sum_map = {}
+        # 5) Сумма перерывов
+        if not breaks_sum_map:
+            breaks_sum_map = _read_breaks_sum(date_str)
 
         # 6) Ответ
-        rows = result_df.to_dict(orient="records")
-        employees = []
-        for r in rows:
-            emp_id = str(r.get("Утвердил") or "").strip()
-            if not emp_id:
-                continue
-            sec = int(breaks_sum_map.get(emp_id, 0) or 0)
-            employees.append({
-                "id": emp_id,
-                "name": emp_id,
-                "company": (str(r.get("Компания") or "").strip() if "Компания" in r else ""),
-                "tasks": int(float(r.get("СЗ") or 0)),
-                "weight": float(r.get("Вес") or 0),
-                "qty": int(float(r.get("Шт") or 0)),
-                "speed": float(r.get("скорость") or 0),
-                "breaks_total_seconds": sec,
-                "breaks_total": _format_hhmm_from_seconds(sec),
-            })
-
-        # сортировка: сначала по задачам, потом по скорости
-        employees.sort(key=lambda x: (x.get("tasks", 0), x.get("speed", 0.0)), reverse=True)
-
-        return {"date": date_str, "employees": employees}
+        return {"date": date_str, "employees": _employee_stats_rows(result_df, breaks_sum_map)}
+    except DayBuildPending as e:
+        return _day_build_pending_response(e, date=date_str, employees=[])
     except ValueError as ve:
         error_msg = str(ve)
         app.logger.error(f"ValueError in employee_stats for {date_str}: {error_msg}")
@@ -2662,9 +3485,8 @@ def employee_stats_today():
         csv_cache, _, _ = _day_analysis_cache_paths(today)
         if os.path.exists(csv_cache) or os.path.exists(_day_path(today)):
             return employee_stats(today)
-        # fallback: последний день из DATA_DIR
-        days_resp = list_days()
-        days = (days_resp.get("days") or []) if isinstance(days_resp, dict) else []
+        # fallback: последний день из каталога дней
+        days = _catalog_days()
         if days:
             return employee_stats(days[-1])
     except Exception as e:
@@ -2677,14 +3499,426 @@ def employee_stats_today():
             return jsonify({"error": str(e2), "date": today, "employees": []}), 500
     return employee_stats(today)
 
-def _generate_faststat_tasks(date_str: str) -> Dict[str, Any]:
-    """Генерирует список задач для FastStat из DataFrame. Используется для кэширования."""
+# Состояние фонового прогрева (см. CACHE_WARM_*), отдаётся /cache_warmer
+_CACHE_WARMER: Dict[str, Any] = {
+    "state": "stopped",   # stopped | waiting | running | throttled | standby (прогревает другой процесс)
+    "current": None,      # день, который сейчас прогревается
+    "queue": [],          # дни текущего прохода, которые ещё впереди
+    "warmed": [],         # дни, для которых в текущем/последнем проходе что-то построено
+    "skipped": 0,         # дни, где все артефакты уже были готовы
+    "errors": {},         # день -> ошибки стадий
+    "throttled_seconds": 0.0,
+    "last_started": None,
+    "last_finished": None,
+    "next_run": None,
+}
+_CACHE_WARMER_LOCK = threading.Lock()
+_CACHE_WARMER_THREAD: Optional[threading.Thread] = None
+
+
+def _memory_available_mb() -> Optional[float]:
+    """MemAvailable из /proc/meminfo (МБ); None, если недоступно."""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _cache_warm_budget() -> Dict[str, Any]:
+    """Текущая нагрузка и достаточно ли ресурсов для прогрева."""
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        load = None
+    mem_mb = _memory_available_mb()
+    ok = (load is None or load <= CACHE_WARM_MAX_LOAD) and (
+        mem_mb is None or CACHE_WARM_MIN_FREE_MB <= 0 or mem_mb >= CACHE_WARM_MIN_FREE_MB
+    )
+    return {
+        "ok": ok,
+        "load_per_cpu": round(load, 2) if load is not None else None,
+        "max_load_per_cpu": CACHE_WARM_MAX_LOAD,
+        "memory_available_mb": round(mem_mb) if mem_mb is not None else None,
+        "min_free_mb": CACHE_WARM_MIN_FREE_MB,
+    }
+
+def _cache_warm_targets() -> List[str]:
+    """Дни для прогрева в порядке приоритета: сегодня, затем последние дни от новых к старым."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    days = [d for d in _catalog_days() if d <= today]
+    recent = [d for d in reversed(days) if d != today][:max(CACHE_WARM_DAYS, 0)]
+    return ([today] if today in days else []) + recent
+
+def _warm_caches_once() -> None:
+    """Один проход прогрева: строит недостающие артефакты дней из _cache_warm_targets()."""
+    targets = _cache_warm_targets()
+    throttle_deadline = time.monotonic() + max(CACHE_WARM_MAX_THROTTLE_SECONDS, 0.0)
+    with _CACHE_WARMER_LOCK:
+        _CACHE_WARMER.update(
+            state="running", queue=list(targets), warmed=[], skipped=0, errors={},
+            last_started=datetime.now().isoformat(timespec="seconds"), next_run=None,
+        )
+    for date_str in targets:
+        with _CACHE_WARMER_LOCK:
+            _CACHE_WARMER["queue"].remove(date_str)
+            _CACHE_WARMER["current"] = date_str
+        missing = [name for name, ready in _day_artifacts_ready(date_str).items() if not ready]
+        if not missing:
+            with _CACHE_WARMER_LOCK:
+                _CACHE_WARMER["skipped"] += 1
+            continue
+        # Ждём, пока машина освободится: прогрев не должен отнимать ресурсы у запросов.
+        # Под постоянной нагрузкой прерываем проход — оставшиеся дни прогреет следующий
+        while not _cache_warm_budget()["ok"]:
+            left = throttle_deadline - time.monotonic()
+            if left <= 0:
+                with _CACHE_WARMER_LOCK:
+                    _CACHE_WARMER.update(current=None, last_finished=datetime.now().isoformat(timespec="seconds"))
+                return
+            pause = min(5.0, left)
+            with _CACHE_WARMER_LOCK:
+                _CACHE_WARMER["state"] = "throttled"
+                _CACHE_WARMER["throttled_seconds"] += pause
+            time.sleep(pause)
+        with _CACHE_WARMER_LOCK:
+            _CACHE_WARMER["state"] = "running"
+        res = _materialize_day(date_str, missing)
+        with _CACHE_WARMER_LOCK:
+            if res["built"]:
+                _CACHE_WARMER["warmed"].append(date_str)
+            if res["errors"]:
+                _CACHE_WARMER["errors"][date_str] = res["errors"]
+        time.sleep(max(CACHE_WARM_PAUSE_SECONDS, 0.0))
+    with _CACHE_WARMER_LOCK:
+        _CACHE_WARMER.update(current=None, last_finished=datetime.now().isoformat(timespec="seconds"))
+
+def _cache_warmer_loop() -> None:
+    while True:
+        acquired = True
+        try:
+            # Прогрев запущен в каждом воркере, но проход делает тот, кто взял _cache_warmer.lock
+            with _file_lock(os.path.join(DATA_DIR, "_cache_warmer.lock"), deadline=time.monotonic()) as acquired:
+                if acquired:
+                    _warm_caches_once()
+        except Exception as e:
+            try:
+                app.logger.error(f"Ошибка прогрева кэшей: {e}", exc_info=True)
+            except Exception:
+                pass
+        if CACHE_WARM_INTERVAL_SECONDS <= 0:
+            break
+        with _CACHE_WARMER_LOCK:
+            _CACHE_WARMER.update(
+                state="waiting" if acquired else "standby",
+                next_run=(datetime.now() + timedelta(seconds=CACHE_WARM_INTERVAL_SECONDS)).isoformat(timespec="seconds"),
+            )
+        time.sleep(CACHE_WARM_INTERVAL_SECONDS)
+    with _CACHE_WARMER_LOCK:
+        _CACHE_WARMER.update(state="stopped", next_run=None)
+
+def start_cache_warmer() -> bool:
+    """Запускает фоновый прогрев (один раз на процесс). False — выключен или уже запущен."""
+    global _CACHE_WARMER_THREAD
+    if not CACHE_WARM_ENABLED:
+        return False
+    with _CACHE_WARMER_LOCK:
+        if _CACHE_WARMER_THREAD is not None and _CACHE_WARMER_THREAD.is_alive():
+            return False
+        _CACHE_WARMER_THREAD = threading.Thread(target=_cache_warmer_loop, name="cache-warmer", daemon=True)
+        _CACHE_WARMER["state"] = "waiting"
+        _CACHE_WARMER_THREAD.start()
+    return True
+
+def reset_after_fork() -> None:
+    """Сбрасывает состояние, унаследованное воркером от родителя при pre-fork (post_fork gunicorn).
+
+    Пул процессов сборки, очередь фоновых задач и пул соединений PostgreSQL
+    создаются в воркере заново при первом обращении. Кэши в памяти (справочник
+    сотрудников, анализ дней, каталог) сверяются с версиями файлов и остаются верными.
+    """
+    global _DAY_PROCESS_POOL, _TASK_QUEUE
+    _DAY_PROCESS_POOL = None
+    _DAY_PROCESS_INFLIGHT.clear()
+    _TASK_QUEUE = queue.PriorityQueue()
+    _TASKS.clear()
+    _TASK_WORKERS.clear()
+    _DAY_BUILDS.clear()
+    reset_connection_pool()
+
+
+@app.route("/cache_warmer", methods=["GET"])
+def cache_warmer_status():
+    """JSON: состояние фонового прогрева кэшей и текущий бюджет ресурсов."""
+    with _CACHE_WARMER_LOCK:
+        status = dict(_CACHE_WARMER, queue=list(_CACHE_WARMER["queue"]), warmed=list(_CACHE_WARMER["warmed"]),
+                      errors=dict(_CACHE_WARMER["errors"]))
+    status.update(
+        enabled=CACHE_WARM_ENABLED,
+        days=CACHE_WARM_DAYS,
+        interval_seconds=CACHE_WARM_INTERVAL_SECONDS,
+        budget=_cache_warm_budget(),
+    )
+    return status
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """JSON: состояние кэшей в памяти процесса (попадания, промахи, вытеснения, объём)."""
+    return {"analysis": _analysis_lru_stats()}
+
+@app.route("/day_build/<token>", methods=["GET"])
+def day_build_status(token: str):
+    """JSON: ход сборки стадии дня по токену из ответа 202 ("YYYY-MM-DD:стадия").
+
+    state: running — строится (в этом или другом процессе), queued — ждёт очереди в пуле
+    процессов сборки, ready — готово, повторите исходный запрос; idle — не строится и
+    не готово (исходный запрос запустит сборку).
+    """
+    date_str, _, stage = token.rpartition(":")
+    if stage not in DAY_STAGES or not _DAY_NAME_RE.match(date_str):
+        return {"error": "bad_request", "message": "Неизвестный токен сборки"}, 400
+    return dict(_day_build_state(date_str, stage), token=token, date=date_str, stage=stage)
+
+# Метрики, по которым можно строить рейтинг (значение — SQL-выражение агрегата)
+_FACT_METRICS: Dict[str, str] = {
+    "tasks": "SUM(tasks)",
+    "weight": "SUM(weight)",
+    "qty": "SUM(qty)",
+    "active_seconds": "SUM(active_seconds)",
+    "break_seconds": "SUM(break_seconds)",
+    "speed": "CASE WHEN SUM(active_seconds) > 0 THEN SUM(tasks) * 60.0 / SUM(active_seconds) ELSE 0 END",
+}
+
+_FACT_AGGREGATES = (
+    "SUM(tasks) AS tasks, SUM(weight) AS weight, SUM(qty) AS qty, "
+    "SUM(active_seconds) AS active_seconds, SUM(break_seconds) AS break_seconds, "
+    "SUM(b15) AS b15, SUM(b30) AS b30, SUM(b45) AS b45, COUNT(*) AS days, "
+    f"{_FACT_METRICS['speed']} AS speed"
+)
+
+
+def _facts_date_range() -> Tuple[str, str]:
+    """Читает ?from=&to= (YYYY-MM-DD). По умолчанию — последние 30 дней."""
+    date_to = request.args.get("to", "").strip() or datetime.now().strftime("%Y-%m-%d")
+    date_from = request.args.get("from", "").strip() or (
+        datetime.strptime(date_to, "%Y-%m-%d") - timedelta(days=29)
+    ).strftime("%Y-%m-%d")
+    for value in (date_from, date_to):
+        datetime.strptime(value, "%Y-%m-%d")  # ValueError при неверном формате
+    return date_from, date_to
+
+
+def _facts_where(date_from: str, date_to: str) -> Tuple[str, List[Any]]:
+    """Условие WHERE по диапазону дат и ?company_name= для запросов к таблице фактов.
+
+    Компания сравнивается без учёта регистра и пробелов по краям, как в /faststat_data.
+    LOWER в SQLite не понижает кириллицу, поэтому подходящие названия отбираются в Python
+    и подставляются в IN (...).
+    """
+    where = "day >= {p} AND day <= {p}"
+    params: List[Any] = [date_from, date_to]
+    company_filter = request.args.get("company_name", "").strip().lower()
+    if company_filter:
+        names = [
+            r["company"] for r in query_facts(
+                "SELECT DISTINCT company FROM approver_day_facts "
+                "WHERE day >= {p} AND day <= {p} AND company IS NOT NULL",
+                (date_from, date_to),
+            )
+            if str(r["company"]).strip().lower() == company_filter
+        ]
+        if names:
+            where += " AND company IN (" + ", ".join(["{p}"] * len(names)) + ")"
+            params.extend(names)
+        else:
+            where += " AND 1 = 0"
+    return where, params
+
+def _round_fact_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(row)
+    for key in ("weight", "speed", "score"):
+        if out.get(key) is not None:
+            out[key] = round(float(out[key]), 2)
+    return out
+
+
+@app.route("/facts/range", methods=["GET"])
+def facts_range():
+    """JSON: суммы по каждому сотруднику за диапазон дат (один запрос к таблице фактов)."""
+    try:
+        date_from, date_to = _facts_date_range()
+        where, params = _facts_where(date_from, date_to)
+        rows = query_facts(
+            f"SELECT approver, MAX(company) AS company, {_FACT_AGGREGATES} "
+            f"FROM approver_day_facts WHERE {where} GROUP BY approver ORDER BY tasks DESC",
+            tuple(params),
+        )
+        return {"from": date_from, "to": date_to, "employees": [_round_fact_row(r) for r in rows]}
+    except ValueError as ve:
+        return {"error": str(ve)}, 400
+    except Exception as e:
+        app.logger.error(f"Exception in facts_range: {e}", exc_info=True)
+        return {"error": str(e)}, 500
+
+
+@app.route("/facts/trend/<approver>", methods=["GET"])
+def facts_trend(approver: str):
+    """JSON: показатели сотрудника по дням за диапазон (для графиков динамики скорости)."""
+    try:
+        date_from, date_to = _facts_date_range()
+        rows = query_facts(
+            "SELECT day, company, tasks, weight, qty, active_seconds, break_seconds, b15, b30, b45, "
+            "CASE WHEN active_seconds > 0 THEN tasks * 60.0 / active_seconds ELSE 0 END AS speed "
+            "FROM approver_day_facts WHERE approver = {p} AND day >= {p} AND day <= {p} ORDER BY day",
+            (approver.strip(), date_from, date_to),
+        )
+        return {"approver": approver.strip(), "from": date_from, "to": date_to, "days": [_round_fact_row(r) for r in rows]}
+    except ValueError as ve:
+        return {"error": str(ve)}, 400
+    except Exception as e:
+        app.logger.error(f"Exception in facts_trend for {approver}: {e}", exc_info=True)
+        return {"error": str(e)}, 500
+
+
+@app.route("/facts/leaderboard", methods=["GET"])
+def facts_leaderboard():
+    """JSON: топ сотрудников за диапазон по метрике (?metric=tasks|weight|qty|speed|..., ?limit=)."""
+    try:
+        date_from, date_to = _facts_date_range()
+        metric = request.args.get("metric", "tasks").strip()
+        if metric not in _FACT_METRICS:
+            return {"error": f"Неизвестная метрика: {metric}. Доступны: {', '.join(_FACT_METRICS)}"}, 400
+        try:
+            limit = max(1, min(int(request.args.get("limit", "10")), 500))
+        except ValueError:
+            limit = 10
+        where, params = _facts_where(date_from, date_to)
+        rows = query_facts(
+            f"SELECT approver, MAX(company) AS company, {_FACT_AGGREGATES}, {_FACT_METRICS[metric]} AS score "
+            f"FROM approver_day_facts WHERE {where} GROUP BY approver ORDER BY score DESC LIMIT {limit}",
+            tuple(params),
+        )
+        return {"from": date_from, "to": date_to, "metric": metric, "leaders": [_round_fact_row(r) for r in rows]}
+    except ValueError as ve:
+        return {"error": str(ve)}, 400
+    except Exception as e:
+        app.logger.error(f"Exception in facts_leaderboard: {e}", exc_info=True)
+        return {"error": str(e)}, 500
+
+def _what_if_from_gaps(
+    approvers: np.ndarray,
+    offsets: np.ndarray,
+    gaps: np.ndarray,
+    break_min: float,
+    cap_min: Optional[float],
+    buckets: List[float],
+) -> List[Dict[str, object]]:
+    """Пересчитывает перерывы/активное время по сохранённым интервалам без повторного анализа.
+
+    Все свёртки векторные (bincount по номеру сотрудника):
+    - перерыв — интервал > break_min минут, активное время = окно работы - сумма перерывов;
+    - при cap_min дополнительно считается сумма min(интервал, cap_min);
+    - корзины — число перерывов, у которых наибольший перекрытый порог равен корзине.
+    """
+    n = len(approvers)
+    lengths = np.diff(offsets)
+    seg = np.repeat(np.arange(n), lengths)
+    is_break = gaps > break_min * 60
+    window = np.bincount(seg, weights=gaps, minlength=n)
+    breaks_count = np.bincount(seg, weights=is_break, minlength=n).astype(int)
+    breaks_seconds = np.bincount(seg, weights=np.where(is_break, gaps, 0.0), minlength=n)
+    active = np.clip(window - breaks_seconds, 0, None)
+    capped = None
+    if cap_min is not None:
+        capped = np.bincount(seg, weights=np.minimum(gaps, cap_min * 60), minlength=n)
+    bucket_edges = np.array(sorted(buckets), dtype=np.float64) * 60
+    # 0 — перерыв короче первой корзины, i — перекрыт i-й порог
+    bucket_idx = np.searchsorted(bucket_edges, gaps, side="right")
+    nb = len(bucket_edges) + 1
+    flat = np.bincount((seg * nb + bucket_idx)[is_break], minlength=n * nb).reshape(n, nb)
+
+    out: List[Dict[str, object]] = []
+    for i, approver in enumerate(approvers.tolist()):
+        row: Dict[str, object] = {
+            "approver": approver,
+            "breaks_count": int(breaks_count[i]),
+            "breaks_seconds": int(breaks_seconds[i]),
+            "active_seconds": int(active[i]),
+            "window_seconds": int(window[i]),
+            "buckets": {f"{b:g}": int(flat[i, j + 1]) for j, b in enumerate(sorted(buckets))},
+        }
+        if capped is not None:
+            row["active_capped_seconds"] = int(capped[i])
+        out.append(row)
+    return out
+
+
+@app.route("/what_if/<date_str>", methods=["GET"])
+def what_if(date_str: str):
+    """JSON: перерывы и активное время за день при произвольных порогах.
+
+    Параметры: ?break_min= (порог перерыва, мин), ?cap_min= (потолок интервала для
+    активного времени, мин), ?buckets=15,30,45, ?approver=. Считается по ANL_gaps.npz.
+    """
+    started = time.perf_counter()
+    try:
+        try:
+            break_min = float(request.args.get("break_min", BREAK_MIN_MINUTES))
+            cap_raw = request.args.get("cap_min", "").strip()
+            cap_min = float(cap_raw) if cap_raw else None
+            buckets_raw = request.args.get("buckets", "").strip()
+            buckets = [float(b) for b in buckets_raw.split(",") if b.strip()] if buckets_raw else [float(b) for b in BREAK_BUCKETS_MINUTES]
+        except ValueError:
+            return {"error": "Параметры break_min, cap_min и buckets должны быть числами"}, 400
+
+        stored = _read_gaps_cache(date_str)
+        if stored is None:
+            # Старый кэш без интервалов — один раз пересчитываем день
+            if _ensure_day_analysis(date_str) is None:
+                return {"error": "no_data"}, 404
+            stored = _read_gaps_cache(date_str)
+            if stored is None:
+                return {"error": "Не удалось сохранить интервалы за день"}, 500
+        approvers, offsets, gaps = stored
+
+        approver_filter = request.args.get("approver", "").strip()
+        if approver_filter:
+            idx = np.flatnonzero(approvers == approver_filter)
+            if idx.size == 0:
+                return {"error": "approver_not_found", "approver": approver_filter}, 404
+            i = int(idx[0])
+            gaps = gaps[offsets[i]:offsets[i + 1]]
+            approvers = approvers[i:i + 1]
+            offsets = np.array([0, len(gaps)], dtype=np.int64)
+
+        employees = _what_if_from_gaps(approvers, offsets, gaps, break_min, cap_min, buckets)
+        return {
+            "date": date_str,
+            "break_min": break_min,
+            "cap_min": cap_min,
+            "buckets": buckets,
+            "employees": employees,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+    except Exception as e:
+        app.logger.error(f"Exception in what_if for {date_str}: {e}", exc_info=True)
+        return {"error": str(e)}, 500
+
+def _generate_faststat_tasks(date_str: str, df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+    """Генерирует задачи FastStat из DataFrame. Используется для кэширования.
+
+    Задачи возвращаются по колонкам: {"date", "columns": {поле: [значения]}, "total_tasks"}.
+    df — уже прочитанный CSV дня (из конвейера материализации); иначе читается с диска.
+    """
     try:
         day_path = _day_path(date_str)
-        if not os.path.exists(day_path):
+        if df is None and not os.path.exists(day_path):
             return {"error": "no_data", "message": f"Файл {day_path} не найден", "tasks": []}
         
-        df = _load_day_df(date_str)
+        if df is None:
+            df = _load_day_df(date_str)
         if df is None or df.empty:
             return {"error": "no_data", "message": "Файл пуст или не может быть прочитан", "tasks": []}
 
@@ -2751,127 +3985,82 @@ def _generate_faststat_tasks(date_str: str) -> Dict[str, Any]:
             }
 
         # Загружаем маппинг сотрудников для получения компаний
-        employee_company_map = {}
-        emp_df = None
-        candidate_path = _get_employees_file_path()
-        if candidate_path:
-            try:
-                emp_df = _try_read_employees(candidate_path)
-                if emp_df is not None:
-                    mapping = _extract_employees_mapping(emp_df)
-                    if mapping is not None and not mapping.empty:
-                        mapping["Утвердил"] = mapping["Утвердил"].astype(str).str.strip()
-                        mapping = mapping.dropna(subset=["Утвердил"]).drop_duplicates(subset=["Утвердил"], keep="first")
-                        # Создаем словарь для быстрого поиска
-                        for _, row in mapping.iterrows():
-                            emp_code = str(row["Утвердил"]).strip()
-                            company = str(row.get("Компания", "")).strip() if "Компания" in row else ""
-                            if emp_code and company:
-                                employee_company_map[emp_code] = company
-            except Exception as e:
-                # Игнорируем ошибки при загрузке маппинга - это не критично
-                pass
-
-        tasks = []
-        for idx, row in df.iterrows():
-            # Пропускаем первую строку (заголовок) если она содержит названия колонок
-            if idx == 0:
-                # Проверяем, не является ли это заголовком
-                first_employee = str(row.get(approver_col, '')).strip() if approver_col else ''
-                if 'утвердил' in first_employee.lower():
-                    continue
-            
-            employee_val = row.get(approver_col)
-            time_val = row.get(time_col)
-            
-            # Проверяем на NaN значения pandas
-            if pd.isna(employee_val) or pd.isna(time_val):
-                continue
-            
-            employee = str(employee_val).strip()
-            time = str(time_val).strip()
-            
-            # Пропускаем пустые строки, заголовки и строки с nan
-            if (not employee or not time or 
-                employee == 'Утвердил:' or employee == '' or time == '' or
-                employee.lower() == 'nan' or time.lower() == 'nan' or
-                employee.lower() == 'none' or time.lower() == 'none'):
-                continue
+        employee_company_map = _employees_company_map()
+
+        def _text(col: Optional[str]) -> pd.Series:
+            """Колонка как строки без пробелов по краям; NaN и отсутствующая колонка — ''."""
+            if not col:
+                return pd.Series('', index=rows.index)
+            return rows[col].fillna('').astype(str).str.strip()
+
+        employees = df[approver_col]
+        times = df[time_col]
+        # Первая строка может оказаться повторённым заголовком
+        header_row = (df.index == 0) & employees.astype(str).str.strip().str.lower().str.contains('утвердил', regex=False)
+        keep = employees.notna() & times.notna() & ~header_row
+        rows = df[keep]
+        employees = employees[keep].astype(str).str.strip()
+        times = times[keep].astype(str).str.strip()
+        # Пропускаем пустые строки, заголовки и строки с nan
+        emp_lower = employees.str.lower()
+        time_lower = times.str.lower()
+        keep = (
+            (employees != '') & (times != '') & (employees != 'Утвердил:')
+            & ~emp_lower.isin(['nan', 'none']) & ~time_lower.isin(['nan', 'none'])
+        )
+        rows = rows[keep]
+        employees = employees[keep]
+        times = times[keep]
+
+        # Вес: запятая -> точка, оставляем только цифры, точку и минус; нечисло -> 0
+        if weight_col:
+            weight_str = rows[weight_col].fillna('0').astype(str).str.replace(',', '.', regex=False).str.replace(r'[^\d.\-]', '', regex=True)
+            is_number = weight_str.str.fullmatch(r'-?(?:\d+\.?\d*|\.\d+)')
+            weights = pd.Series(0.0, index=rows.index)
+            weights[is_number] = weight_str[is_number].astype(float)
+        else:
+            weights = pd.Series(0.0, index=rows.index)
+        # Конвертируем граммы в килограммы
+        grams = _text(unit_col).str.upper().isin(['Г', 'ГР', 'GRAM', 'GRAMS']) & (weights > 0)
+        weights = weights.where(~grams, weights / 1000)
 
-            # Обрабатываем вес - заменяем запятую на точку и убираем кавычки
-            weight_val = row.get(weight_col, '0') if weight_col else '0'
-            if pd.isna(weight_val):
-                weight_val = '0'
-            weight_str = str(weight_val).replace(',', '.').replace('"', '').strip()
-            # Убираем все нечисловые символы кроме точки и минуса
-            weight_str = ''.join(c for c in weight_str if c.isdigit() or c == '.' or c == '-')
+        def _parse_count(value: str) -> int:
+            count_str = value.replace(',', '.').replace('"', '').strip()
             try:
-                weight = float(weight_str) if weight_str else 0.0
+                return int(float(count_str)) if count_str else 1
             except (ValueError, TypeError):
-                weight = 0.0
+                return 1
 
-            # Конвертируем граммы в килограммы
-            unit = str(row.get(unit_col, '')).strip() if unit_col else ''
-            if unit and unit.upper() in ['Г', 'ГР', 'GRAM', 'GRAMS'] and weight > 0:
-                weight = weight / 1000
+        # Различных значений количества немного — парсим каждое один раз
+        count_raw = rows[count_col].fillna('1').astype(str) if count_col else pd.Series('1', index=rows.index)
+        counts = count_raw.map({value: _parse_count(value) for value in count_raw.unique()})
 
-            product = str(row.get(product_col, '')).strip() if product_col else ''
-            if pd.isna(row.get(product_col)) if product_col else False:
-                product = ''
-            
-            count_val = row.get(count_col, '1') if count_col else '1'
-            if pd.isna(count_val):
-                count_val = '1'
-            count_str = str(count_val).replace(',', '.').replace('"', '').strip()
-            try:
-                count = int(float(count_str)) if count_str else 1
-            except (ValueError, TypeError):
-                count = 1
+        process_types = _text(process_col)
+        # МХ в зависимости от типа процесса: 2060 (хранение) — ОтпускСкладМест, 2021 (КДК) — Приним. СкладМесто
+        mx_values = np.where(
+            process_types == '2060', _text(otpusk_sklad_mest_col),
+            np.where(process_types == '2021', _text(primim_sklad_mesto_col), ''),
+        )
 
-            eo = ''
-            if eo_col and not pd.isna(row.get(eo_col)):
-                eo = str(row.get(eo_col, '')).strip()
-            
-            source_eo = ''
-            if source_eo_col and not pd.isna(row.get(source_eo_col)):
-                source_eo = str(row.get(source_eo_col, '')).strip()
-            
-            process_type = ''
-            if process_col and not pd.isna(row.get(process_col)):
-                process_type = str(row.get(process_col, '')).strip()
-
-            # Получаем МХ в зависимости от типа процесса
-            mx_value = ''
-            if process_type == '2060':  # Хранение - используем ОтпускСкладМест
-                if otpusk_sklad_mest_col and not pd.isna(row.get(otpusk_sklad_mest_col)):
-                    mx_value = str(row.get(otpusk_sklad_mest_col, '')).strip()
-            elif process_type == '2021':  # КДК - используем Приним. СкладМесто
-                if primim_sklad_mesto_col and not pd.isna(row.get(primim_sklad_mesto_col)):
-                    mx_value = str(row.get(primim_sklad_mesto_col, '')).strip()
-
-            # Получаем складской заказ
-            warehouse_order = ''
-            if warehouse_order_col and not pd.isna(row.get(warehouse_order_col)):
-                warehouse_order = str(row.get(warehouse_order_col, '')).strip()
-
-            # Получаем компанию из маппинга
-            company = employee_company_map.get(employee, "")
-
-            tasks.append({
-                "employee": employee,
-                "company": company,
-                "time": time,
-                "product": product,
-                "weight": weight,
-                "count": count,
-                "eo": eo,
-                "sourceEO": source_eo,
-                "processType": process_type,
-                "mx": mx_value,
-                "warehouseOrder": warehouse_order
-            })
+        # Получаем компанию из маппинга
+        companies = employees.map(employee_company_map).fillna('')
+
+        columns = {
+            "employee": employees.tolist(),
+            "company": companies.tolist(),
+            "time": times.tolist(),
+            "product": _text(product_col).tolist(),
+            "weight": weights.tolist(),
+            "count": counts.tolist(),
+            "eo": _text(eo_col).tolist(),
+            "sourceEO": _text(source_eo_col).tolist(),
+            "processType": process_types.tolist(),
+            "mx": mx_values.tolist(),
+            "warehouseOrder": _text(warehouse_order_col).tolist(),
+        }
+        total_tasks = len(employees)
 
-        if len(tasks) == 0:
+        if total_tasks == 0:
             # Попробуем понять, почему задачи не найдены
             sample_rows = []
             for idx, row in df.head(5).iterrows():
@@ -2905,7 +4094,7 @@ def _generate_faststat_tasks(date_str: str) -> Dict[str, Any]:
                 "tasks": []
             }
 
-        return {"date": date_str, "tasks": tasks, "total_tasks": len(tasks)}
+        return {"date": date_str, "columns": columns, "total_tasks": total_tasks}
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -2916,31 +4105,878 @@ def _generate_faststat_tasks(date_str: str) -> Dict[str, Any]:
             "tasks": []
         }
 
+# -------------------------------
+# Конвейер материализации дня
+# -------------------------------
+def _day_companies_cache_path(date_str: str) -> str:
+    """Кэш списка компаний, у которых есть задачи за день."""
+    base = _day_dir(date_str)
+    return os.path.join(base, "COMPANIES.json")
+
+FASTSTAT_FIELDS = (
+    "employee", "company", "time", "product", "weight", "count",
+    "eo", "sourceEO", "processType", "mx", "warehouseOrder",
+)
+
+
+def _faststat_to_columnar(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Переводит колонки _generate_faststat_tasks в формат кэша.
+
+    Каждое поле — отдельный массив; строковые поля с небольшим числом различных
+    значений (сотрудник, компания, тип процесса, ...) хранятся словарём
+    {"dict": [...], "codes": [...]}. Результаты с ошибкой сохраняются как есть.
+    """
+    if "error" in result:
+        return result
+    columns: Dict[str, Any] = {}
+    for field in FASTSTAT_FIELDS:
+        values = result["columns"][field]
+        if field not in ("weight", "count"):
+            codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+            if len(uniques) * 2 <= len(values):
+                columns[field] = {"dict": uniques.tolist(), "codes": codes.tolist()}
+                continue
+        columns[field] = values
+    return {
+        "format": "columnar",
+        "version": 1,
+        "date": result.get("date"),
+        "total_tasks": result.get("total_tasks", 0),
+        "columns": columns,
+    }
+
+def _faststat_column(column: Any):
+    """Итератор значений колонки кэша (словарные колонки раскодируются по ходу)."""
+    if isinstance(column, dict):
+        return map(column["dict"].__getitem__, column["codes"])
+    return iter(column)
+
+def _iter_faststat_columnar(data: Dict[str, Any]):
+    """Задачи из колоночного кэша по одной, без сборки всего списка в памяти."""
+    if data.get("format") != "columnar":
+        yield from data.get("tasks") or []
+        return
+    columns = [_faststat_column(data["columns"][field]) for field in FASTSTAT_FIELDS]
+    for row in zip(*columns):
+        yield dict(zip(FASTSTAT_FIELDS, row))
+
+def _faststat_from_columnar(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Восстанавливает привычный вид {"date", "tasks": [{...}], "total_tasks"} из колоночного кэша."""
+    if data.get("format") != "columnar":
+        return data
+    tasks = list(_iter_faststat_columnar(data))
+    return {"date": data.get("date"), "tasks": tasks, "total_tasks": len(tasks)}
+
+def _write_faststat_cache(date_str: str, result: Dict[str, Any]) -> None:
+    _ensure_day_dir(date_str)
+    path = _day_faststat_cache_path(date_str)
+    payload = json.dumps(_faststat_to_columnar(result), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if FASTSTAT_CACHE_GZIP:
+        payload = gzip.compress(payload, compresslevel=6)
+    with _atomic_output(path) as f:
+        f.write(payload)
+
+def _read_faststat_cache(date_str: str, columnar: bool = False) -> Optional[Dict[str, Any]]:
+    """Читает кэш faststat (gzip определяется по сигнатуре файла).
+
+    columnar=True — вернуть как хранится; иначе — в виде списка задач.
+    None, если кэша нет или он битый.
+    """
+    path = _day_faststat_cache_path(date_str)
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if raw[:2] == b"\x1f\x8b":
+            raw = gzip.decompress(raw)
+        data = json.loads(raw.decode("utf-8"))
+    except Exception:
+        return None
+    return data if columnar else _faststat_from_columnar(data)
+
+def _read_json_file(path: str) -> Optional[Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+# Версии алгоритмов стадий: увеличьте при изменении кода, который строит артефакт,
+# — старые артефакты перестанут считаться готовыми и будут пересобраны
+ARTIFACT_VERSIONS: Dict[str, int] = {
+    "faststat": 1,
+    "analysis": 2,  # 2: сумма перерывов по gap_seconds (ANL_breaks_sum.json с нулями пересобираются)
+    "facts": 1,
+    "summary": 1,
+    "idle": 1,
+    "companies": 1,
+    "company_views": 1,
+}
+_MANIFEST_LOCK = threading.Lock()
+
+
+def _employees_version() -> Optional[str]:
+    """Версия справочника сотрудников: "путь:mtime_ns:размер" или None, если файла нет."""
+    path = _get_employees_file_path()
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        st = None
+    return f"{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}" if st else None
+
+def _day_input_versions(date_str: str) -> Dict[str, Optional[str]]:
+    """Версии внешних входов артефактов дня: CSV дня и справочник сотрудников."""
+    try:
+        st = os.stat(_day_path(date_str))
+        day = f"{st.st_mtime_ns}-{st.st_size}"
+    except OSError:
+        day = None
+    return {"day": day, "employees": _employees_version()}
+
+def _artifact_inputs(date_str: str, name: str, inputs: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """Входы, по которым строится артефакт стадии: версия алгоритма, параметры,
+    версии данных дня/справочника и отпечатки стадий-зависимостей."""
+    stage = DAY_STAGES[name]
+    parts: Dict[str, Any] = {"algorithm": ARTIFACT_VERSIONS.get(name, 0), "params": stage["params"]()}
+    for dep in stage["inputs"]:
+        parts[dep] = inputs["day"] if dep == "raw" else _artifact_fingerprint(date_str, dep, inputs)
+    if stage["employees"]:
+        parts["employees"] = inputs["employees"]
+    return parts
+
+def _artifact_fingerprint(date_str: str, name: str, inputs: Optional[Dict[str, Optional[str]]] = None) -> str:
+    parts = _artifact_inputs(date_str, name, inputs or _day_input_versions(date_str))
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def _read_artifact_manifest(date_str: str) -> Dict[str, Any]:
+    return _read_json_file(_day_manifest_path(date_str)) or {}
+
+def _record_artifact(date_str: str, name: str, inputs: Dict[str, Optional[str]]) -> None:
+    """Записывает в манифест дня, по каким входам построен артефакт стадии."""
+    with _MANIFEST_LOCK, _file_lock(_day_build_lock_path(date_str, "manifest")):
+        manifest = _read_artifact_manifest(date_str)
+        manifest[name] = {
+            "fingerprint": _artifact_fingerprint(date_str, name, inputs),
+            "inputs": _artifact_inputs(date_str, name, inputs),
+            "built_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        _atomic_write_json(_day_manifest_path(date_str), manifest)
+
+def _artifact_ready(date_str: str, name: str, inputs: Optional[Dict[str, Optional[str]]] = None,
+                    manifest: Optional[Dict[str, Any]] = None) -> bool:
+    """Артефакт стадии на месте и построен по текущим входам (см. MANIFEST.json)."""
+    try:
+        if not DAY_STAGES[name]["ready"](date_str):
+            return False
+    except Exception:
+        return False
+    if manifest is None:
+        manifest = _read_artifact_manifest(date_str)
+    recorded = (manifest.get(name) or {}).get("fingerprint")
+    return recorded is not None and recorded == _artifact_fingerprint(date_str, name, inputs)
+
+def _stage_analysis_build(ctx: Dict[str, Any]) -> pd.DataFrame:
+    result_df = analyze_dataframe(ctx["raw"])
+    _write_day_analysis_cache(ctx["date"], result_df)
+    return result_df
+
+def _stage_analysis_load(date_str: str) -> Optional[pd.DataFrame]:
+    cached = _read_day_analysis_cache(date_str)
+    return cached[0] if cached is not None else None
+
+def _facts_ready(date_str: str) -> bool:
+    """Строки дня есть в таблице фактов (БД могли пересоздать или очистить мимо манифеста)."""
+    return bool(query_facts("SELECT 1 FROM approver_day_facts WHERE day = {p} LIMIT 1", (date_str,)))
+
+def _stage_facts_build(ctx: Dict[str, Any]) -> int:
+    """Строки дня в таблице фактов (компании — из текущего справочника сотрудников)."""
+    _upsert_day_facts(ctx["date"], ctx["analysis"], _read_breaks_sum(ctx["date"]))
+    return len(ctx["analysis"])
+
+def _ensure_day_analysis(date_str: str, wait: Optional[float] = None) -> Optional[Tuple[pd.DataFrame, Dict[str, object], Dict[str, object]]]:
+    """Анализ дня через конвейер (вместе с таблицей фактов): (result_df, перерывы, по-часам).
+
+    None — за день нет данных; ошибка анализа — RuntimeError; wait — см. _materialize_day.
+    """
+    res = _materialize_day(date_str, ["analysis", "facts"], wait=wait)
+    if "raw" in res["errors"]:
+        return None
+    if "analysis" in res["errors"]:
+        raise RuntimeError(res["errors"]["analysis"])
+    result_df = res["values"].get("analysis")
+    # Свежий результат этого процесса несёт карты перерывов; собранный в пуле — читаем из кэша
+    if "analysis" in res["built"] and hasattr(result_df, "breaks_by_approver"):
+        return (result_df, getattr(result_df, "breaks_by_approver", {}) or {},
+                getattr(result_df, "hourly_by_approver", {}) or {})
+    return _read_day_analysis_cache(date_str)
+
+def _stage_faststat_build(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    result = _generate_faststat_tasks(ctx["date"], df=ctx["raw"])
+    # Кэшируем и «пустой день» (no_data), чтобы не пересчитывать его на каждый запрос
+    if "error" not in result or result.get("error") == "no_data":
+        _write_faststat_cache(ctx["date"], result)
+    return result
+
+def _stage_summary_build(ctx: Dict[str, Any]) -> Dict[str, object]:
+    return _build_day_summary(ctx["date"], preloaded_result=ctx["analysis"], write_cache=True)
+
+def _stage_companies_build(ctx: Dict[str, Any]) -> List[str]:
+    """Компании сотрудников, встречающихся в CSV дня (по справочнику сотрудников)."""
+    df = ctx["raw"]
+    companies: List[str] = []
+    approver_col = next((c for c in df.columns if 'утвердил' in c.lower().strip() or 'approver' in c.lower().strip()), None)
+    company_map = _employees_company_map()
+    if approver_col and company_map:
+        employees = df[approver_col].astype(str).str.strip().unique()
+        companies = sorted({company_map[e] for e in employees if company_map.get(e)})
+    _atomic_write_json(_day_companies_cache_path(ctx["date"]), companies)
+    return companies
+
+IDLE_MIN_SECONDS = 600  # простой — пауза между задачами более 10 минут
+
+
+def _compute_idle_times(df: pd.DataFrame) -> Dict[str, Any]:
+    """Находит простои (паузы > IDLE_MIN_SECONDS) между задачами каждого сотрудника.
+
+    Возвращает колонки employee/from/to/duration_seconds, отсортированные по
+    убыванию длительности; при равной длительности — в порядке первого появления
+    сотрудника и времени. Строки без сотрудника или с нераспознанным временем
+    подтверждения пропускаются.
+    """
+    approver_col = None
+    time_col = None
+    for col in df.columns:
+        col_clean = col.lower().strip().replace(':', '').replace('.', '').replace(' ', '')
+        if 'утвердил' in col_clean or 'approver' in col_clean:
+            approver_col = col
+        if 'время' in col_clean and ('подтвержд' in col_clean or 'confirmation' in col_clean):
+            time_col = col
+    if not approver_col or not time_col:
+        return {"error": "columns_not_found"}
+
+    employees = df[approver_col].astype(str).str.strip()
+    times = df[time_col].where(df[time_col].notna(), "").astype(str).str.strip()
+    keep = (employees != "") & (times != "") & ~employees.str.lower().str.contains('утвердил', regex=False)
+    # ЧЧ:ММ[:СС[:...]] — секунды необязательны, всё после них игнорируется
+    parts = times[keep].str.extract(r'^([+-]?\d+)\s*:\s*([+-]?\d+)\s*(?::\s*([+-]?\d+)\s*(?::.*)?)?$')
+    valid = parts[0].notna()
+    parts = parts[valid]
+    seconds = (
+        parts[0].astype(np.int64) * 3600
+        + parts[1].astype(np.int64) * 60
+        + parts[2].fillna("0").astype(np.int64)
+    ).to_numpy()
+    emp = employees[keep][valid].to_numpy()
+    tm = times[keep][valid].to_numpy()
+
+    codes, _ = pd.factorize(emp)
+    order = np.lexsort((seconds, codes))
+    codes, seconds, emp, tm = codes[order], seconds[order], emp[order], tm[order]
+    diffs = np.diff(seconds)
+    idx = np.nonzero((codes[1:] == codes[:-1]) & (diffs > IDLE_MIN_SECONDS))[0]
+    by_duration = np.argsort(-diffs[idx], kind="stable")
+    idx = idx[by_duration]
+    return {
+        "employee": emp[idx + 1].tolist(),
+        "from": tm[idx].tolist(),
+        "to": tm[idx + 1].tolist(),
+        "duration_seconds": diffs[idx].astype(int).tolist(),
+    }
+
+def _stage_company_views_build(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Срезы дня по каждой компании справочника из полного результата анализа.
+
+    {"top_leaders": [...], "companies": {компания: {"summary", "records", "employees"}}} —
+    готовые ответы /day_summary, /analyze_day и /employee_stats с company_name.
+    """
+    date_str = ctx["date"]
+    result_df = ctx["analysis"]
+    records = _page_records(result_df)
+    merged = pd.DataFrame.from_records(records) if records else result_df
+    employees = _employee_stats_rows(merged, _read_breaks_sum(date_str))
+    views: Dict[str, Dict[str, Any]] = {}
+    for company in sorted(set(_employees_company_map().values())):
+        views[company] = {
+            "summary": _build_day_summary(date_str, company_name=company, preloaded_result=result_df, write_cache=False),
+            "records": [r for r in records if str(r.get("Компания") or "").strip() == company],
+            "employees": [e for e in employees if e["company"] == company],
+        }
+    result = {"top_leaders": _top_leaders(records), "companies": views}
+    _atomic_write_json(_day_company_views_path(date_str), result)
+    return result
+
+def _company_view(date_str: str, company: str, wait: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Срез компании за день ({"summary", "records", "employees", "top_leaders"}).
+
+    None — срез недоступен (нет данных, компании нет в справочнике, ошибка сборки);
+    тогда вызывающий считает ответ по полному дню, как раньше.
+    """
+    res = _materialize_day(date_str, ["company_views"], wait=wait)
+    views = res["values"].get("company_views")
+    if not views:
+        return None
+    view = (views.get("companies") or {}).get(company.strip())
+    if view is None:
+        return None
+    return dict(view, top_leaders=views.get("top_leaders") or [])
+
+def _stage_idle_build(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    result = _compute_idle_times(ctx["raw"])
+    _atomic_write_json(_day_idle_cache_path(ctx["date"]), result)
+    return result
+
+# Стадии материализации дня. inputs — от чего стадия зависит: "raw" (CSV дня,
+# читается один раз на весь прогон) или имена других стадий; employees — зависит ли
+# от справочника сотрудников; params — пороги/настройки, влияющие на результат;
+# ready — файлы артефакта на месте (соответствие входам проверяет манифест дня).
+# Порядок объявления — порядок выполнения: faststat первым, чтобы /faststat_data
+# получил данные раньше.
+DAY_STAGES: Dict[str, Dict[str, Any]] = {
+    "faststat": {
+        "inputs": ["raw"],
+        "employees": True,
+        "params": lambda: {"gzip": FASTSTAT_CACHE_GZIP},
+        "build": _stage_faststat_build,
+        "ready": lambda d: os.path.exists(_day_faststat_cache_path(d)),
+        "load": _read_faststat_cache,
+    },
+    "analysis": {
+        "inputs": ["raw"],
+        "employees": False,
+        "params": lambda: {
+            "break_min_minutes": BREAK_MIN_MINUTES,
+            "active_gap_cap_minutes": ACTIVE_GAP_CAP_MINUTES,
+            "buckets": list(BREAK_BUCKETS_MINUTES),
+        },
+        "build": _stage_analysis_build,
+        "ready": lambda d: all(os.path.exists(p) for p in (
+            *_day_analysis_cache_paths(d), _day_analysis_meta_path(d), _day_gaps_cache_path(d), _day_breaks_sum_cache_path(d),
+        )),
+        "load": _stage_analysis_load,
+    },
+    "facts": {
+        "inputs": ["analysis"],
+        "employees": True,
+        "params": lambda: {},
+        "build": _stage_facts_build,
+        "ready": _facts_ready,
+        "load": lambda d: None,
+    },
+    "summary": {
+        "inputs": ["analysis"],
+        "employees": True,
+        "params": lambda: {},
+        "build": _stage_summary_build,
+        "ready": lambda d: os.path.exists(_day_summary_cache_path(d)),
+        "load": lambda d: _read_json_file(_day_summary_cache_path(d)),
+    },
+    "idle": {
+        "inputs": ["raw"],
+        "employees": False,
+        "params": lambda: {"idle_min_seconds": IDLE_MIN_SECONDS},
+        "build": _stage_idle_build,
+        "ready": lambda d: os.path.exists(_day_idle_cache_path(d)),
+        "load": lambda d: _read_json_file(_day_idle_cache_path(d)),
+    },
+    "companies": {
+        "inputs": ["raw"],
+        "employees": True,
+        "params": lambda: {},
+        "build": _stage_companies_build,
+        "ready": lambda d: os.path.exists(_day_companies_cache_path(d)),
+        "load": lambda d: _read_json_file(_day_companies_cache_path(d)),
+    },
+    "company_views": {
+        "inputs": ["analysis"],
+        "employees": True,
+        "params": lambda: {},
+        "build": _stage_company_views_build,
+        "ready": lambda d: os.path.exists(_day_company_views_path(d)),
+        "load": lambda d: _read_json_file(_day_company_views_path(d)),
+    },
+}
+
+
+# Сборки артефактов дня в этом процессе: (дата, стадия) -> {"lock", "users", "started_at"}
+_DAY_BUILDS: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_DAY_BUILDS_LOCK = threading.Lock()
+
+
+class DayBuildPending(Exception):
+    """Стадию дня строит другой запрос или процесс, а ждать дольше нельзя."""
+
+    def __init__(self, date_str: str, stage: str):
+        super().__init__(f"{date_str}: стадия {stage} ещё строится")
+        self.date = date_str
+        self.stage = stage
+        self.token = f"{date_str}:{stage}"
+
+
+@contextmanager
+def _file_lock(path: str, deadline: Optional[float] = None, shared: bool = False):
+    """flock на path между процессами; отдаёт False, если не дождались deadline.
+
+    deadline — момент по time.monotonic() (None — ждать сколько нужно); shared —
+    разделяемая блокировка для чтения. Держатель эксклюзивной блокировки записывает
+    в файл свой pid и время захвата (см. _day_build_state).
+    """
+    if fcntl is None:
+        yield True
+        return
+    mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    with open(path, "a+") as fh:
+        if deadline is None:
+            fcntl.flock(fh.fileno(), mode)
+        else:
+            while True:
+                try:
+                    fcntl.flock(fh.fileno(), mode | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        yield False
+                        return
+                    time.sleep(0.05)
+        try:
+            if not shared:
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps({"pid": os.getpid(), "started_at": time.time()}))
+                fh.flush()
+            yield True
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def _day_build_slot(date_str: str, name: str, wait: Optional[float] = None):
+    """Право строить стадию дня: одно на (дату, стадию) в процессе и между процессами.
+
+    wait — сколько секунд ждать чужую сборку (None — без ограничения); не дождались —
+    DayBuildPending. После входа стадию стоит проверить снова: её мог собрать тот,
+    кого ждали.
+    """
+    key = (date_str, name)
+    with _DAY_BUILDS_LOCK:
+        slot = _DAY_BUILDS.setdefault(key, {"lock": threading.Lock(), "users": 0, "started_at": None})
+        slot["users"] += 1
+    deadline = None if wait is None else time.monotonic() + max(0.0, wait)
+    try:
+        if not slot["lock"].acquire(timeout=-1 if deadline is None else max(0.0, wait)):
+            raise DayBuildPending(date_str, name)
+        try:
+            _ensure_day_dir(date_str)
+            with _file_lock(_day_build_lock_path(date_str, name), deadline) as acquired:
+                if not acquired:
+                    raise DayBuildPending(date_str, name)
+                slot["started_at"] = time.time()
+                try:
+                    yield
+                finally:
+                    slot["started_at"] = None
+        finally:
+            slot["lock"].release()
+    finally:
+        with _DAY_BUILDS_LOCK:
+            slot["users"] -= 1
+            if not slot["users"]:
+                _DAY_BUILDS.pop(key, None)
+
+def _wait_left(deadline: Optional[float]) -> Optional[float]:
+    """Сколько секунд осталось до deadline (time.monotonic()); None — без ограничения."""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+def _day_build_state(date_str: str, name: str) -> Dict[str, Any]:
+    """Состояние сборки стадии: {"state": "running"|"queued"|"ready"|"idle", "started_at", "pid"}.
+
+    queued — сборка с этой стадией ждёт свободного процесса в пуле (_DAY_PROCESS_INFLIGHT).
+    """
+    with _DAY_BUILDS_LOCK:
+        slot = _DAY_BUILDS.get((date_str, name))
+        started_at = slot["started_at"] if slot else None
+    if started_at is not None:
+        return {"state": "running", "started_at": started_at, "pid": os.getpid()}
+    path = _day_build_lock_path(date_str, name)
+    if fcntl is not None and os.path.exists(path):
+        # Сборка в другом процессе: его flock не даст взять даже разделяемую блокировку
+        with open(path, "r") as fh:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            except BlockingIOError:
+                try:
+                    holder = json.loads(fh.read() or "{}")
+                except ValueError:
+                    holder = {}
+                return {"state": "running", "started_at": holder.get("started_at"), "pid": holder.get("pid")}
+    with _DAY_PROCESS_LOCK:
+        queued = any(
+            key[0] == date_str and not fut.done() and name in _stage_order(list(key[1]) if key[1] else None)
+            for key, fut in _DAY_PROCESS_INFLIGHT.items()
+        )
+    if queued:
+        return {"state": "queued", "started_at": None, "pid": None}
+    state = "ready" if _artifact_ready(date_str, name) else "idle"
+    return {"state": state, "started_at": None, "pid": None}
+
+def _day_build_pending_response(e: DayBuildPending, **extra: Any):
+    """Ответ 202 на запрос, который не дождался чужой сборки дня."""
+    body = {
+        "status": "processing",
+        "message": "Данные дня обрабатываются, повторите запрос через несколько секунд",
+        "token": e.token,
+        "progress_url": url_for("day_build_status", token=e.token),
+    }
+    body.update(extra)
+    return body, 202, {"Retry-After": "3"}
+
+
+# Пул процессов для сборки артефактов дня (см. _materialize_day): pandas не держит
+# GIL веб-процесса. В пул уходят только дата, стадии и версия CSV, результаты
+# пишутся на диск, а запросившая сторона читает их оттуда
+_DAY_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_DAY_PROCESS_INFLIGHT: Dict[Tuple[Any, ...], Future] = {}
+_DAY_PROCESS_LOCK = threading.Lock()
+_IN_DAY_PROCESS = False  # True в процессах пула: там сборка идёт на месте
+
+
+def _day_process_init() -> None:
+    global _IN_DAY_PROCESS
+    _IN_DAY_PROCESS = True
+
+def _materialize_day_worker(date_str: str, stages: Optional[List[str]], force: bool,
+                            day_version: Optional[str]) -> Dict[str, Any]:
+    """Сборка дня в процессе пула; в вызывающий процесс возвращает только built/errors."""
+    current = _day_input_versions(date_str)["day"]
+    if current != day_version:
+        # CSV дописали, пока задача ждала в очереди: строим по актуальной версии
+        app.logger.info(f"{date_str}: версия данных {day_version} сменилась на {current}")
+    res = _materialize_day(date_str, stages, force)
+    return {"built": res["built"], "errors": res["errors"]}
+
+def _submit_day_process(date_str: str, stages: Optional[List[str]], force: bool, day_version: Optional[str]) -> Future:
+    """Ставит сборку дня в пул процессов; одинаковая сборка (та же версия CSV) не дублируется."""
+    global _DAY_PROCESS_POOL
+    key = (date_str, tuple(stages) if stages else None, force, day_version)
+    with _DAY_PROCESS_LOCK:
+        fut = _DAY_PROCESS_INFLIGHT.get(key)
+        if fut is not None:
+            return fut
+        if _DAY_PROCESS_POOL is None:
+            # Процессы пула запускаются по мере надобности и наследуют окружение родителя
+            os.environ[_DAY_PROCESS_ENV] = "1"
+            _DAY_PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=DAY_PROCESS_WORKERS,
+                # spawn, а не fork: веб-процесс многопоточный, форк мог бы унаследовать чужие блокировки
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_day_process_init,
+            )
+        fut = _DAY_PROCESS_POOL.submit(_materialize_day_worker, date_str, stages, force, day_version)
+        _DAY_PROCESS_INFLIGHT[key] = fut
+
+    def _done(_f: Future) -> None:
+        with _DAY_PROCESS_LOCK:
+            if _DAY_PROCESS_INFLIGHT.get(key) is _f:
+                del _DAY_PROCESS_INFLIGHT[key]
+
+    fut.add_done_callback(_done)
+    return fut
+
+def _materialize_day_offloaded(date_str: str, stages: Optional[List[str]], force: bool, wait: Optional[float],
+                               pending_stage: str, day_version: Optional[str]) -> Optional[Dict[str, Any]]:
+    """_materialize_day через пул процессов: ждёт сборку и читает запрошенные артефакты с диска.
+
+    None — пул недоступен (сломан или не запускается), тогда сборка идёт в этом процессе.
+    """
+    global _DAY_PROCESS_POOL
+    try:
+        remote = _submit_day_process(date_str, stages, force, day_version).result(timeout=wait)
+    except _FuturesTimeout:
+        raise DayBuildPending(date_str, pending_stage)
+    except (BrokenProcessPool, OSError) as e:
+        app.logger.error(f"Пул процессов сборки дня недоступен, считаем в этом процессе: {e}")
+        with _DAY_PROCESS_LOCK:
+            _DAY_PROCESS_POOL = None
+        return None
+    errors: Dict[str, str] = dict(remote["errors"])
+    values: Dict[str, Any] = {}
+    if "raw" not in errors:
+        for name in DAY_STAGES:
+            if name in (stages or DAY_STAGES) and name not in errors:
+                try:
+                    values[name] = DAY_STAGES[name]["load"](date_str)
+                except Exception as e:
+                    errors[name] = str(e)
+    return {"date": date_str, "built": remote["built"], "errors": errors, "values": values}
+
+def _stage_order(stages: Optional[List[str]]) -> List[str]:
+    """Стадии вместе с зависимостями в порядке объявления DAY_STAGES (None — все)."""
+    order: List[str] = []
+
+    def _visit(name: str) -> None:
+        if name == "raw" or name in order:
+            return
+        for dep in DAY_STAGES[name]["inputs"]:
+            _visit(dep)
+        order.append(name)
+
+    for name in (stages or list(DAY_STAGES)):
+        _visit(name)
+    # Выполняем в порядке объявления стадий (он же согласован с зависимостями)
+    order.sort(key=list(DAY_STAGES).index)
+    return order
+
+def _materialize_day(date_str: str, stages: Optional[List[str]] = None, force: bool = False,
+                     wait: Optional[float] = None) -> Dict[str, Any]:
+    """Строит артефакты дня за один разбор CSV.
+
+    stages — какие стадии нужны (по умолчанию все); зависимости добавляются сами.
+    Артефакт пересобирается, только если его нет, он построен по другим входам
+    (см. MANIFEST.json и _artifact_inputs) или force=True.
+    Каждую стадию строит один вызов (_day_build_slot): остальные ждут его и берут
+    готовый артефакт; wait — общий на все стадии предел ожидания в секундах, после
+    него DayBuildPending.
+    Если что-то нужно собрать, сборка уходит в пул процессов (DAY_PROCESS_WORKERS),
+    а значения читаются с диска.
+    CSV дня читается только если хотя бы одной пересобираемой стадии нужен "raw".
+    Возвращает {"date", "built", "errors", "values"}; ошибка стадии не останавливает
+    независимые от неё стадии.
+    """
+    deadline = None if wait is None else time.monotonic() + max(0.0, wait)
+    order = _stage_order(stages)
+
+    # Версии входов фиксируем до чтения CSV: если он изменится во время сборки,
+    # манифест сохранит старую версию и артефакт пересоберётся при следующем запросе
+    inputs = _day_input_versions(date_str)
+    manifest = _read_artifact_manifest(date_str)
+    to_build = set()
+    for name in order:
+        stage = DAY_STAGES[name]
+        if force or any(dep in to_build for dep in stage["inputs"]) or not _artifact_ready(date_str, name, inputs, manifest):
+            to_build.add(name)
+
+    # Готовые значения читаем с диска, только если они запрошены или нужны пересборке
+    wanted = set(stages or DAY_STAGES)
+    for name in to_build:
+        wanted.update(DAY_STAGES[name]["inputs"])
+
+    if any("raw" in DAY_STAGES[name]["inputs"] for name in to_build) and not os.path.exists(_day_path(date_str)):
+        return {"date": date_str, "built": [], "errors": {"raw": "no_data"}, "values": {}}
+    if to_build and DAY_PROCESS_WORKERS > 0 and not _IN_DAY_PROCESS:
+        pending_stage = next(name for name in order if name in to_build)
+        offloaded = _materialize_day_offloaded(date_str, stages, force, _wait_left(deadline), pending_stage, inputs["day"])
+        if offloaded is not None:
+            return offloaded
+
+    ctx: Dict[str, Any] = {"date": date_str}
+    errors: Dict[str, str] = {}
+    built: List[str] = []
+    for name in order:
+        stage = DAY_STAGES[name]
+        try:
+            if name in to_build:
+                for dep in stage["inputs"]:
+                    if dep in errors:
+                        raise RuntimeError(f"стадия {dep} завершилась с ошибкой")
+                with _day_build_slot(date_str, name, _wait_left(deadline)):
+                    # Пока ждали, стадию мог собрать другой запрос — тогда берём готовый артефакт
+                    if force or not _artifact_ready(date_str, name, inputs):
+                        if "raw" in stage["inputs"] and "raw" not in ctx:
+                            with _file_lock(_day_build_lock_path(date_str, "day"), shared=True):
+                                raw = _load_day_df(date_str)
+                            if raw is None or raw.empty:
+                                errors["raw"] = "no_data"
+                                break
+                            ctx["raw"] = raw
+                        ctx[name] = stage["build"](ctx)
+                        _record_artifact(date_str, name, inputs)
+                        built.append(name)
+                        continue
+            if name in wanted or name in to_build:
+                ctx[name] = stage["load"](date_str)
+        except DayBuildPending:
+            raise
+        except Exception as e:
+            errors[name] = str(e)
+            app.logger.error(f"Ошибка стадии {name} для {date_str}: {e}", exc_info=True)
+    if built:
+        _catalog_refresh_artifacts(date_str)
+    values = {name: ctx[name] for name in order if name in ctx}
+    return {"date": date_str, "built": built, "errors": errors, "values": values}
+
+
+def _faststat_query() -> Dict[str, Any]:
+    """Разбирает параметры выборки /faststat_data. ValueError — некорректный запрос.
+
+    fields — список полей через запятую; employee/company — точное совпадение
+    (компания без учёта регистра); offset/limit — окно выдачи после фильтров;
+    format=ndjson (или Accept: application/x-ndjson) — построчная потоковая отдача;
+    format=columnar — кэш в колоночном виде как есть (допускает только fields).
+    """
+    fields_raw = request.args.get("fields", "").strip()
+    fields = [f.strip() for f in fields_raw.split(",") if f.strip()] if fields_raw else None
+    if fields:
+        unknown = [f for f in fields if f not in FASTSTAT_FIELDS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(unknown)}; допустимые: {', '.join(FASTSTAT_FIELDS)}")
+    try:
+        offset = int(request.args.get("offset", "0").strip() or 0)
+        limit_raw = request.args.get("limit", "").strip()
+        limit = int(limit_raw) if limit_raw else None
+    except ValueError:
+        raise ValueError("offset и limit должны быть целыми числами")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset и limit должны быть неотрицательными")
+    fmt = request.args.get("format", "").strip().lower()
+    if fmt not in ("", "json", "ndjson", "columnar"):
+        raise ValueError("format должен быть json, ndjson или columnar")
+    ndjson = fmt == "ndjson" or (not fmt and "application/x-ndjson" in request.headers.get("Accept", ""))
+    employee = request.args.get("employee", "").strip() or None
+    company = request.args.get("company", "").strip().lower() or None
+    if fmt == "columnar" and (employee or company or offset or limit is not None):
+        raise ValueError("format=columnar поддерживает только параметр fields")
+    return {
+        "fields": fields,
+        "employee": employee,
+        "company": company,
+        "offset": offset,
+        "limit": limit,
+        "ndjson": ndjson,
+        "columnar": fmt == "columnar",
+    }
+
+def _iter_faststat_tasks(tasks, query: Dict[str, Any], counter: Optional[Dict[str, int]] = None):
+    """Отбирает задачи по сотруднику/компании, применяет окно offset/limit и проекцию полей.
+
+    tasks — любой итератор задач. counter — если передан, после окна перебор продолжается
+    и в counter["matched"] остаётся число всех подходящих задач.
+    """
+    employee, company, fields = query["employee"], query["company"], query["fields"]
+    offset, limit = query["offset"], query["limit"]
+    matched = 0
+    for task in tasks:
+        if employee is not None and task.get("employee") != employee:
+            continue
+        if company is not None and str(task.get("company", "")).strip().lower() != company:
+            continue
+        matched += 1
+        if counter is not None:
+            counter["matched"] = matched
+        if matched <= offset:
+            continue
+        if limit is not None and matched > offset + limit:
+            if counter is None:
+                break
+            continue
+        yield {f: task.get(f) for f in fields} if fields else task
+
+def _is_full_faststat_query(query: Dict[str, Any]) -> bool:
+    """Запрос всего списка задач в обычном JSON — без выборки, страниц и других форматов."""
+    return not (
+        query["fields"] or query["employee"] or query["company"] or query["offset"]
+        or query["limit"] is not None or query["ndjson"] or query["columnar"]
+    )
+
+def _faststat_precompressed(date_str: str) -> Optional[Response]:
+    """Полный ответ /faststat_data из заранее сжатого gzip-файла.
+
+    Файл создаётся при первом запросе и переиспользуется, пока он не старше кэша
+    faststat. None — кэш содержит ошибку или не читается (отдаём обычным путём).
+    """
+    body_path = _day_faststat_body_path(date_str)
+    try:
+        fresh = os.path.getmtime(body_path) >= os.path.getmtime(_day_faststat_cache_path(date_str))
+    except OSError:
+        fresh = False
+    if fresh:
+        with open(body_path, "rb") as f:
+            body = f.read()
+    else:
+        data = _read_faststat_cache(date_str)
+        if data is None or "error" in data:
+            return None
+        body = gzip.compress(app.json.response(data).get_data(), compresslevel=COMPRESS_LEVEL)
+        # Файл могут одновременно создавать несколько воркеров: каждый пишет свой
+        # временный файл, os.replace оставит один из одинаковых результатов
+        with _atomic_output(body_path) as f:
+            f.write(body)
+    resp = app.response_class(body, mimetype="application/json")
+    resp.headers["Content-Encoding"] = "gzip"
+    _add_vary_accept_encoding(resp)
+    return resp
+
+def _faststat_response(date_str: str, data: Dict[str, Any], query: Dict[str, Any]):
+    """Отдаёт задачи FastStat целиком, страницей, потоком NDJSON или по колонкам.
+
+    data — кэш в колоночном виде (см. _faststat_to_columnar).
+    """
+    if query["columnar"]:
+        if query["fields"] and data.get("format") == "columnar":
+            data = dict(data, columns={f: data["columns"][f] for f in query["fields"]})
+        return data
+    if query["ndjson"]:
+        # Строки собираются из колонок по мере отдачи
+        def generate():
+            for task in _iter_faststat_tasks(_iter_faststat_columnar(data), query):
+                yield json.dumps(task, ensure_ascii=False) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    if _is_full_faststat_query(query):
+        return _faststat_from_columnar(data)
+    counter = {"matched": 0}
+    page = list(_iter_faststat_tasks(_iter_faststat_columnar(data), query, counter))
+    return {
+        "date": data.get("date", date_str),
+        "tasks": page,
+        "total_tasks": data.get("total_tasks", 0),
+        "matched_tasks": counter["matched"],
+        "returned": len(page),
+        "offset": query["offset"],
+        "limit": query["limit"],
+    }
+
+
 @app.route("/faststat_data/<date_str>", methods=["GET"])
+@_conditional_get(_day_data_version)
 def faststat_data(date_str: str):
-    """Возвращает детальные данные по задачам за день для FastStat."""
+    """Возвращает детальные данные по задачам за день для FastStat.
+
+    Поддерживает выборку ?fields=&employee=&company=&offset=&limit= и потоковую
+    отдачу NDJSON (?format=ndjson) — см. _faststat_query.
+    """
+    try:
+        query = _faststat_query()
+    except ValueError as e:
+        return {"error": "bad_request", "message": str(e), "tasks": []}, 400
     try:
         faststat_cache_path = _day_faststat_cache_path(date_str)
-        processing_flag = _day_faststat_processing_flag(date_str)
         
-        # ПРИОРИТЕТ 1: Проверяем кэш (быстрая отдача готовых данных)
-        if os.path.exists(faststat_cache_path):
+        # ПРИОРИТЕТ 1: Проверяем кэш (быстрая отдача готовых данных), если он построен по текущим входам
+        if _artifact_ready(date_str, "faststat"):
+            if _is_full_faststat_query(query) and request.accept_encodings.quality("gzip") > 0:
+                try:
+                    precompressed = _faststat_precompressed(date_str)
+                    if precompressed is not None:
+                        return precompressed
+                except Exception as e:
+                    app.logger.warning(f"Не удалось отдать сжатый ответ faststat для {date_str}: {e}")
             try:
-                import json as _json
-                with open(faststat_cache_path, 'r', encoding='utf-8') as f:
-                    cached_data = _json.load(f)
+                cached_data = _read_faststat_cache(date_str, columnar=True)
+                if cached_data is None:
+                    raise ValueError("кэш повреждён")
                 # Если в кэше есть ошибка - возвращаем ее с кодом
                 if "error" in cached_data:
                     status_code = 404 if cached_data.get("error") in ["no_data", "no_tasks"] else 400
                     return cached_data, status_code
-                return cached_data
+                return _faststat_response(date_str, cached_data, query)
             except Exception as e:
                 app.logger.warning(f"Ошибка при чтении кэша faststat для {date_str}: {e}")
-                # Продолжаем выполнение
+                # Битый кэш удаляем, чтобы фоновая обработка построила его заново
+                try:
+                    os.remove(faststat_cache_path)
+                except OSError:
+                    pass
         
-        # ПРИОРИТЕТ 2: Проверяем, идет ли обработка
-        if os.path.exists(processing_flag):
-            # Обработка уже запущена - возвращаем статус "processing"
+        # ПРИОРИТЕТ 2: Проверяем, идет ли обработка (в очереди задач этого процесса
+        # или сборка faststat в любом процессе)
+        if _task_pending(_day_task_key("faststat", date_str)) or _day_build_state(date_str, "faststat")["state"] in ("running", "queued"):
             return {
                 "status": "processing",
                 "message": "Данные обрабатываются, попробуйте запросить позже",
@@ -2956,54 +4992,9 @@ def faststat_data(date_str: str):
                 "tasks": []
             }, 404
         
-        # ПРИОРИТЕТ 4: Если кэша нет, но файл есть - запускаем обработку в фоне
-        def process_faststat_async():
-            """Асинхронная обработка faststat данных"""
-            try:
-                # Создаем флаг обработки
-                _ensure_day_dir(date_str)
-                try:
-                    with open(processing_flag, 'w') as f:
-                        f.write(str(time.time()))
-                except Exception:
-                    pass
-                
-                try:
-                    app.logger.info(f"Начата фоновая обработка faststat для {date_str}")
-                    result = _generate_faststat_tasks(date_str)
-                    
-                    # Сохраняем в кэш для будущих запросов (только если нет ошибки)
-                    if "error" not in result or result.get("error") == "no_data":
-                        try:
-                            import json as _json
-                            tmp_path = f"{faststat_cache_path}.tmp"
-                            with open(tmp_path, 'w', encoding='utf-8') as f:
-                                _json.dump(result, f, ensure_ascii=False, indent=2)
-                            os.replace(tmp_path, faststat_cache_path)
-                            app.logger.info(f"Кэш faststat для {date_str} сохранен")
-                        except Exception as e:
-                            app.logger.warning(f"Не удалось сохранить кэш faststat для {date_str}: {e}")
-                finally:
-                    # Удаляем флаг обработки
-                    try:
-                        if os.path.exists(processing_flag):
-                            os.remove(processing_flag)
-                    except Exception:
-                        pass
-            except Exception as e:
-                app.logger.error(f"Ошибка при фоновой обработке faststat для {date_str}: {e}")
-                import traceback
-                app.logger.error(traceback.format_exc())
-                # Удаляем флаг обработки при ошибке
-                try:
-                    if os.path.exists(processing_flag):
-                        os.remove(processing_flag)
-                except Exception:
-                    pass
-        
-        # Запускаем обработку в фоновом потоке
-        processing_thread = threading.Thread(target=process_faststat_async, daemon=True)
-        processing_thread.start()
+        # ПРИОРИТЕТ 4: Если кэша нет, но файл есть - ставим расчёт faststat первым
+        # приоритетом в очередь фоновых задач
+        _submit_task(_day_task_key("faststat", date_str), TASK_PRIORITY_FASTSTAT, _run_day_task, date_str, ["faststat"])
         
         # Возвращаем статус "processing" - клиент может опросить позже
         return {
@@ -3130,45 +5121,8 @@ def _send_telegram_photo(photo_path: str, caption: str = "") -> bool:
 def _get_companies_for_date(date_str: str) -> List[str]:
     """Получает список уникальных компаний для указанной даты."""
     try:
-        df = _load_day_df(date_str)
-        if df is None or df.empty:
-            return []
-        
-        # Загружаем маппинг сотрудников
-        employee_company_map = {}
-        candidate_path = _get_employees_file_path()
-        if candidate_path:
-            try:
-                emp_df = _try_read_employees(candidate_path)
-                if emp_df is not None:
-                    mapping = _extract_employees_mapping(emp_df)
-                    if mapping is not None and not mapping.empty:
-                        for _, row in mapping.iterrows():
-                            emp_code = str(row["Утвердил"]).strip()
-                            company = str(row.get("Компания", "")).strip() if "Компания" in row else ""
-                            if emp_code and company:
-                                employee_company_map[emp_code] = company
-            except Exception:
-                pass
-        
-        # Получаем уникальные компании
-        companies = set()
-        approver_col = None
-        for col in df.columns:
-            col_lower = col.lower().strip()
-            if 'утвердил' in col_lower or 'approver' in col_lower:
-                approver_col = col
-                break
-        
-        if approver_col:
-            for _, row in df.iterrows():
-                employee = str(row.get(approver_col, '')).strip()
-                if employee and employee in employee_company_map:
-                    company = employee_company_map[employee]
-                    if company:
-                        companies.add(company)
-        
-        return sorted(list(companies))
+        res = _materialize_day(date_str, ["companies"])
+        return list(res["values"].get("companies") or [])
     except Exception as e:
         app.logger.error(f"Ошибка при получении списка компаний: {e}")
         return []
@@ -3241,7 +5195,7 @@ def send_idle_screenshots(date_str: str):
     """Отправляет скриншоты простоев по компаниям в Telegram после загрузки отчета."""
     try:
         # Получаем простои за указанную дату
-        idle_response = get_idle_times(date_str)
+        idle_response = _idle_times_payload(date_str)
         if isinstance(idle_response, tuple):
             idle_data = idle_response[0]
         else:
@@ -3309,27 +5263,16 @@ def telegram_webhook():
         
         # Обработка команды /pull
         if text == "/pull":
-            # Получаем последнюю доступную дату
-            data_days_dir = DATA_DIR
-            if not os.path.exists(data_days_dir):
-                _send_telegram_message(chat_id, "Нет данных для отправки")
-                return {"ok": True}
-            
-            # Находим последнюю дату
-            dates = []
-            for item in os.listdir(data_days_dir):
-                item_path = os.path.join(data_days_dir, item)
-                if os.path.isdir(item_path) and len(item) == 10 and item[4] == '-' and item[7] == '-':
-                    dates.append(item)
-            
+            # Получаем последнюю доступную дату из каталога дней
+            dates = _catalog_days()
             if not dates:
                 _send_telegram_message(chat_id, "Нет данных для отправки")
                 return {"ok": True}
             
-            latest_date = sorted(dates)[-1]
+            latest_date = dates[-1]
             
             # Получаем простои за последнюю дату
-            idle_response = get_idle_times(latest_date)
+            idle_response = _idle_times_payload(latest_date)
             if isinstance(idle_response, tuple):
                 idle_data = idle_response[0]
             else:
@@ -3575,7 +5518,7 @@ def get_idle_times_html(date_str: str):
             return {"error": "company parameter required"}, 400
         
         # Получаем простои
-        idle_response = get_idle_times(date_str)
+        idle_response = _idle_times_payload(date_str)
         if isinstance(idle_response, tuple):
             idle_data = idle_response[0]
         else:
@@ -3678,100 +5621,44 @@ def get_idle_times_html(date_str: str):
 
 
 @app.route("/idle_times/<date_str>", methods=["GET"])
+@_conditional_get(_day_data_version)
 def get_idle_times(date_str: str):
-    """Получает все простои сотрудников более 10 минут за указанную дату."""
+    """JSON: простои сотрудников более 10 минут за указанную дату."""
+    return _idle_times_payload(date_str)
+
+
+def _idle_times_payload(date_str: str):
+    """Получает все простои сотрудников более 10 минут за указанную дату.
+
+    Простои берутся из кэша дня IDLE.json (строится конвейером материализации),
+    компании сотрудников подставляются из текущего справочника.
+    """
     try:
-        # Получаем данные задач
-        df = _load_day_df(date_str)
-        if df is None or df.empty:
+        res = _materialize_day(date_str, ["idle"])
+        idle = res["values"].get("idle")
+        if "raw" in res["errors"]:
             return {"error": "no_data", "message": "Нет данных за указанную дату", "idle_times": []}, 404
-        
-        # Загружаем маппинг сотрудников
-        employee_company_map = {}
-        candidate_path = _get_employees_file_path()
-        if candidate_path:
-            try:
-                emp_df = _try_read_employees(candidate_path)
-                if emp_df is not None:
-                    mapping = _extract_employees_mapping(emp_df)
-                    if mapping is not None and not mapping.empty:
-                        for _, row in mapping.iterrows():
-                            emp_code = str(row["Утвердил"]).strip()
-                            company = str(row.get("Компания", "")).strip() if "Компания" in row else ""
-                            if emp_code and company:
-                                employee_company_map[emp_code] = company
-            except Exception as e:
-                app.logger.error(f"Ошибка при загрузке маппинга сотрудников: {e}")
-        
-        # Находим нужные колонки
-        approver_col = None
-        time_col = None
-        
-        for col in df.columns:
-            col_lower = col.lower().strip()
-            col_clean = col_lower.replace(':', '').replace('.', '').replace(' ', '')
-            if 'утвердил' in col_clean or 'approver' in col_clean:
-                approver_col = col
-            if 'время' in col_clean and ('подтвержд' in col_clean or 'confirmation' in col_clean):
-                time_col = col
-        
-        if not approver_col or not time_col:
+        if "idle" in res["errors"] or idle is None:
+            return {"error": res["errors"].get("idle", "idle_unavailable"), "idle_times": []}, 500
+        if idle.get("error") == "columns_not_found":
             return {"error": "columns_not_found", "message": "Не найдены необходимые колонки", "idle_times": []}, 404
-        
-        # Группируем задачи по сотрудникам
-        employees_tasks: Dict[str, List[Dict]] = {}
-        for idx, row in df.iterrows():
-            employee = str(row.get(approver_col, '')).strip()
-            time_val = str(row.get(time_col, '')).strip()
-            
-            if pd.isna(employee) or pd.isna(time_val) or not employee or not time_val:
-                continue
-            
-            # Пропускаем заголовок
-            if employee.lower() == 'утвердил' or 'утвердил' in employee.lower():
-                continue
-            
-            if employee not in employees_tasks:
-                employees_tasks[employee] = []
-            
-            employees_tasks[employee].append({
-                "time": time_val,
-                "employee": employee
-            })
-        
-        # Анализируем простои для каждого сотрудника
-        idle_times_list = []
-        
-        def time_to_seconds(time_str: str) -> int:
-            parts = time_str.split(':')
-            return int(parts[0]) * 3600 + int(parts[1]) * 60 + (int(parts[2]) if len(parts) > 2 else 0)
-        
-        for employee, tasks in employees_tasks.items():
-            if len(tasks) < 2:
-                continue
-            
-            # Сортируем задачи по времени
-            sorted_tasks = sorted(tasks, key=lambda x: time_to_seconds(x["time"]))
-            
-            for i in range(1, len(sorted_tasks)):
-                prev_time = sorted_tasks[i - 1]["time"]
-                curr_time = sorted_tasks[i]["time"]
-                diff_seconds = abs(time_to_seconds(curr_time) - time_to_seconds(prev_time))
-                
-                # Простой более 10 минут (600 секунд)
-                if diff_seconds > 600:
-                    company = employee_company_map.get(employee, '')
-                    idle_times_list.append({
-                        "employee": employee,
-                        "company": company,
-                        "from": prev_time,
-                        "to": curr_time,
-                        "duration_seconds": diff_seconds,
-                        "duration_formatted": f"{diff_seconds // 3600} ч {(diff_seconds % 3600) // 60} мин {diff_seconds % 60} сек"
-                    })
-        
-        # Сортируем по длительности простоя (по убыванию)
-        idle_times_list.sort(key=lambda x: x["duration_seconds"], reverse=True)
+
+        # Загружаем маппинг сотрудников
+        employee_company_map = _employees_company_map()
+
+        idle_times_list = [
+            {
+                "employee": employee,
+                "company": employee_company_map.get(employee, ''),
+                "from": from_time,
+                "to": to_time,
+                "duration_seconds": diff_seconds,
+                "duration_formatted": f"{diff_seconds // 3600} ч {(diff_seconds % 3600) // 60} мин {diff_seconds % 60} сек"
+            }
+            for employee, from_time, to_time, diff_seconds in zip(
+                idle["employee"], idle["from"], idle["to"], idle["duration_seconds"]
+            )
+        ]
         
         return {
             "date": date_str,
@@ -3796,14 +5683,29 @@ def upload_employees():
 		flash("Не выбрано имя файла.", "danger")
 		return redirect(url_for("index"))
 	filename = secure_filename(file.filename)
+	# Сохраняем с исходным расширением, поддерживаем CSV и XLSX
+	ext = os.path.splitext(filename)[1].lower()
+	save_path = EMPLOYEES_FILE_PATH if ext not in {'.xlsx', '.xls'} else EMPLOYEES_XLSX_PATH
+	# Сначала во временный файл: разбираем и строим индекс, старый файл заменяем только при успехе
+	tmp_path = _unique_tmp_path(f"{save_path}.upload", suffix=ext)
 	try:
-		# Сохраняем с исходным расширением, поддерживаем CSV и XLSX
-		ext = os.path.splitext(filename)[1].lower()
-		save_path = EMPLOYEES_FILE_PATH if ext not in {'.xlsx', '.xls'} else EMPLOYEES_XLSX_PATH
-		file.save(save_path)
-		flash("Файл сотрудников сохранён.", "success")
+		file.save(tmp_path)
+		try:
+			with _employees_index_lock():
+				info = _build_employees_index(tmp_path, source_path=save_path)
+				os.replace(tmp_path, save_path)
+		except ValueError as e:
+			flash(f"Файл сотрудников не принят: {e}", "danger")
+			return redirect(url_for("index"))
+		flash(f"Файл сотрудников сохранён: {info['rows']} сотрудников.", "success")
 	except Exception as e:
 		flash(f"Не удалось сохранить файл: {e}", "danger")
+	finally:
+		if os.path.exists(tmp_path):
+			try:
+				os.remove(tmp_path)
+			except OSError:
+				pass
 	return redirect(url_for("index"))
 
 if __name__ == "__main__":
@@ -3811,6 +5713,9 @@ if __name__ == "__main__":
 	default_port = 5050
 	# Используем только ANALYZ_PORT, игнорируем PORT чтобы не конфликтовать с Backend
 	port = int(os.environ.get("ANALYZ_PORT", default_port))
+	# С перезагрузчиком прогрев нужен только в дочернем процессе, который обслуживает запросы
+	if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+		start_cache_warmer()
 	app.run(host=os.environ.get("ANALYZ_HOST", "0.0.0.0"), port=port, debug=True)
 
 
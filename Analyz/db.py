@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 # PostgreSQL connection settings
 USE_POSTGRES = os.environ.get("BARCODE_USE_POSTGRES", "false").lower() == "true"
@@ -37,6 +37,17 @@ else:
     )
 
 
+def reset_connection_pool() -> None:
+    """Forget the PostgreSQL pool inherited from a parent process (call right after fork).
+
+    Connections opened before the fork belong to the parent, so they are not closed
+    here; the worker opens its own pool lazily on the next get_db_connection().
+    """
+    global _pg_pool
+    if USE_POSTGRES:
+        _pg_pool = None
+
+
 def get_db_connection(timeout_seconds: Optional[float] = 5.0):
     """Return a database connection (PostgreSQL or SQLite).
     
@@ -160,3 +171,123 @@ def ensure_schema() -> None:
         
         conn.commit()
         conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Daily per-approver fact table (analytics)
+# ---------------------------------------------------------------------------
+DAY_FACT_COLUMNS = (
+    "day",
+    "approver",
+    "company",
+    "tasks",
+    "weight",
+    "qty",
+    "active_seconds",
+    "break_seconds",
+    "b15",
+    "b30",
+    "b45",
+)
+
+
+def ensure_facts_schema() -> None:
+    """Ensure the `approver_day_facts` table and its indexes exist.
+
+    One row per (day, approver) with the per-day aggregates produced by the
+    day analysis. `day` is stored as ISO text (YYYY-MM-DD) so range filters
+    compare lexicographically in both SQLite and PostgreSQL.
+    """
+    weight_type = "DOUBLE PRECISION" if USE_POSTGRES else "REAL"
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS approver_day_facts (
+                day TEXT NOT NULL,
+                approver TEXT NOT NULL,
+                company TEXT,
+                tasks INTEGER NOT NULL DEFAULT 0,
+                weight {weight_type} NOT NULL DEFAULT 0,
+                qty INTEGER NOT NULL DEFAULT 0,
+                active_seconds INTEGER NOT NULL DEFAULT 0,
+                break_seconds INTEGER NOT NULL DEFAULT 0,
+                b15 INTEGER NOT NULL DEFAULT 0,
+                b30 INTEGER NOT NULL DEFAULT 0,
+                b45 INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, approver)
+            );
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_facts_approver_day ON approver_day_facts(approver, day);
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_facts_company_day ON approver_day_facts(company, day);
+            """
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        raise e
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+
+def replace_day_facts(day: str, rows: List[Dict[str, Any]]) -> None:
+    """Replace all fact rows of one day in a single transaction.
+
+    Deleting before inserting keeps the table in sync when an approver
+    disappears from a re-analysed day (e.g. after a corrected upload).
+    """
+    param = get_param_placeholder()
+    placeholders = ", ".join([param] * len(DAY_FACT_COLUMNS))
+    insert_sql = (
+        f"INSERT INTO approver_day_facts ({', '.join(DAY_FACT_COLUMNS)}) "
+        f"VALUES ({placeholders})"
+    )
+    values = [tuple(r.get(c) for c in DAY_FACT_COLUMNS[1:]) for r in rows]
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"DELETE FROM approver_day_facts WHERE day = {param}", (day,))
+        if values:
+            cur.executemany(insert_sql, [(day,) + v for v in values])
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        raise e
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+
+def query_facts(sql: str, params: Tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
+    """Run a read-only query against the fact table and return dict rows.
+
+    `sql` must use `{p}` where a parameter placeholder is expected; it is
+    substituted with the placeholder of the active database.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(sql.format(p=get_param_placeholder()), params)
+        names = [d[0] for d in cur.description]
+        rows = [dict(zip(names, r)) for r in cur.fetchall()]
+        cur.close()
+        return rows
+    finally:
+        if conn:
+            release_db_connection(conn)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Конфигурация gunicorn для Analyz: несколько процессов-воркеров (pre-fork).
+# Запуск: gunicorn -c gunicorn.conf.py wsgi:app
+
+import multiprocessing
+import os
+
+# Пул процессов сборки дня создаётся в каждом воркере (полная копия приложения на процесс),
+# поэтому под gunicorn по умолчанию — один процесс сборки на воркер
+os.environ.setdefault("DAY_PROCESS_WORKERS", "1")
+
+bind = f"{os.environ.get('ANALYZ_HOST', '0.0.0.0')}:{os.environ.get('ANALYZ_PORT', '5050')}"
+workers = int(os.environ.get("ANALYZ_WORKERS", str(min(4, multiprocessing.cpu_count()))))
+# Потоки внутри воркера: запросы, ждущие сборку дня, не занимают весь процесс
+worker_class = "gthread"
+threads = int(os.environ.get("ANALYZ_THREADS", "8"))
+# Загрузка отчёта и первый анализ большого дня могут идти минуты (как ANALYZ_PROXY_TIMEOUT_MS у backend)
+timeout = int(os.environ.get("ANALYZ_TIMEOUT", "600"))
+graceful_timeout = 30
+# pandas, numpy и код приложения импортируются один раз в мастере и делятся с воркерами
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Пулы, очередь задач и соединения с БД у каждого воркера свои
+    from app import reset_after_fork, start_cache_warmer
+
+    reset_after_fork()
+    start_cache_warmer()
@@ -12,20 +12,21 @@ barcode_bp = Blueprint('barcode', __name__, url_prefix='/barcode')
 
 # ensure_schema теперь импортируется из db.py
 
-# Ensure DB schema exists at startup
-try:
-    ensure_schema()
-    import sys
-    use_postgres = os.environ.get("BARCODE_USE_POSTGRES", "false").lower() == "true"
-    if use_postgres:
-        print(f"INFO: Barcode database schema initialized successfully in PostgreSQL", file=sys.stderr)
-    else:
-        db_path = os.environ.get("DB_PATH", os.path.join(os.path.dirname(__file__), "..", "..", "database.sqlite3"))
-        print(f"INFO: Barcode database schema initialized successfully at {db_path}", file=sys.stderr)
-except Exception as e:
-    import sys
-    print(f"ERROR: Could not initialize barcode database schema: {e}", file=sys.stderr)
-    print(f"Barcode generator may not work until database is accessible.", file=sys.stderr)
+# Ensure DB schema exists at startup (not in day-build pool processes, see app._DAY_PROCESS_ENV)
+if os.environ.get("ANALYZ_DAY_PROCESS") != "1":
+    try:
+        ensure_schema()
+        import sys
+        use_postgres = os.environ.get("BARCODE_USE_POSTGRES", "false").lower() == "true"
+        if use_postgres:
+            print(f"INFO: Barcode database schema initialized successfully in PostgreSQL", file=sys.stderr)
+        else:
+            db_path = os.environ.get("DB_PATH", os.path.join(os.path.dirname(__file__), "..", "..", "database.sqlite3"))
+            print(f"INFO: Barcode database schema initialized successfully at {db_path}", file=sys.stderr)
+    except Exception as e:
+        import sys
+        print(f"ERROR: Could not initialize barcode database schema: {e}", file=sys.stderr)
+        print(f"Barcode generator may not work until database is accessible.", file=sys.stderr)
 
 @barcode_bp.route("/")
 def index():
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# Продакшен: gunicorn -c gunicorn.conf.py wsgi:app (несколько воркеров, см. gunicorn.conf.py).
+# python wsgi.py — встроенный сервер Flask в одном процессе.
+
 import os
-from app import app
+from app import app, start_cache_warmer
 
 if __name__ == "__main__":
     # Явно указываем порт 5050 для Analyz
     default_port = 5050
     port = int(os.environ.get("ANALYZ_PORT", default_port))
     host = os.environ.get("ANALYZ_HOST", "0.0.0.0")
+    # Прогрев кэшей последних дней в фоне, чтобы первые запросы не считали их сами
+    start_cache_warmer()
     app.run(host=host, port=port, debug=False)
 
@@ -907,11 +907,9 @@ const shiftHourWindow = (direction: number) => {
                   </div>
                   <hr className="my-2" />
                   <div className="space-y-2 mb-4">
-                    <div><strong>Штат:</strong> {lastDaySummary.by_company['Штат'] || 0}</div>
-                    <div><strong>Мувинг:</strong> {lastDaySummary.by_company['Мувинг'] || 0}</div>
-                    <div><strong>Градус:</strong> {lastDaySummary.by_company['Градус'] || 0}</div>
-                    <div><strong>Два Колеса:</strong> {lastDaySummary.by_company['Два Колеса'] || 0}</div>
-                    <div><strong>Без компании:</strong> {lastDaySummary.by_company['без компании'] || 0}</div>
+                    {Object.entries(lastDaySummary.by_company).map(([company, count]) => (
+                      <div key={company}><strong>{company}:</strong> {count}</div>
+                    ))}
                   </div>
                   {lastDaySummary.latest_finish && (
                     <>
@@ -233,11 +233,25 @@ export default function ShowStats({ embedded = false }: ShowStatsProps = {} as S
     }
   };
 
-  const load = async () => {
+  const load = async (retryCount = 0) => {
     setLoading(true);
     setError(null);
     try {
       const res = await axios.get<EmployeeStatsResponse>('/integrations/analyz/employee_stats_today');
+      // 202 Accepted — день ещё считается другим запросом, повторяем через несколько секунд
+      if (res.status === 202 || (res.data as any)?.status === 'processing') {
+        if (retryCount < 10) {
+          setError('Данные обрабатываются, пожалуйста, подождите...');
+          setTimeout(() => {
+            void load(retryCount + 1);
+          }, 3000);
+          return;
+        }
+        setError('Превышено время ожидания обработки данных. Попробуйте обновить страницу.');
+        setEmployees([]);
+        setDate('');
+        return;
+      }
       if ((res.data as any)?.error) {
         const errorMsg = (res.data as any).error;
         // Если нет данных за сегодня, это не критическая ошибка